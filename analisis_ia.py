@@ -1,92 +1,185 @@
 import streamlit as st
 import requests
+import numpy as np
 import pandas as pd
+import os
 import re
+import time
+import hashlib
+import unicodedata
 import json
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import atexit
+import sqlite3
+import logging
+import threading
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# =========================================
-def resumen_texto_para_perplexity_avanzado(resumen, df_sesion):
-    if resumen is None or not isinstance(resumen, pd.DataFrame):
-        return "Resumen detallado de clusters: No hay datos de resumen."
-    if "tipo_sesion" not in resumen.columns or resumen.empty:
-        return "Resumen detallado de clusters: No hay clusters con datos."
-
-    lineas = []
-    for tipo in resumen["tipo_sesion"]:
-        data_cluster = df_sesion[df_sesion["tipo_sesion"] == tipo]
-        if data_cluster.empty:
-            continue
-        dist_media = data_cluster["distancia"].mean()
-        ritmo_medio = data_cluster["ritmo"].mean()
-        count = len(data_cluster)
-        linea = (
-            f"Cluster '{tipo}': {count} sesiones, "
-            f"distancia media {dist_media:.1f} km, "
-            f"ritmo medio {ritmo_medio:.2f} min/km."
-        )
-        lineas.append(linea)
+from memoria import memorizar
+from metricas import construir_cubo_temporal, MES_NOMBRES
 
-    if not lineas:
-        return "Resumen detallado de clusters: No hay clusters con datos."
+# Log propio en consola (stderr): Streamlit sólo configura el suyo, y sin handler
+# los logger.info (tiempos de las consultas IA) no se verían. IA_LOG_NIVEL lo ajusta.
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _handler_log = logging.StreamHandler()
+    _handler_log.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_handler_log)
+    logger.setLevel(os.environ.get("IA_LOG_NIVEL", "INFO").upper())
 
-    texto = "Resumen detallado de clusters o tipos de sesion:\n" + "\n".join(lineas)
-    return texto
+# =========================================
+# Contexto IA: resumen de tamaño fijo
+
+# Presupuesto del contexto enviado con cada pregunta (caracteres, ~4 por token)
+MAX_CARACTERES_CONTEXTO = 3500
+
+# Tipos de sesión, meses y semanas que entran en el contexto
+MAX_TIPOS_CONTEXTO = 6
+MESES_CONTEXTO = 12
+SEMANAS_CONTEXTO = 8
+
+INFO_FILTRADO = (
+    "Filtrado de sesiones aplicado:\n"
+    "- Solo sesiones de los últimos 12 meses.\n"
+    "- Se descartaron sesiones menores a 200 metros.\n"
+    "- Se verificó que todas las sesiones sean constantes, "
+    "con diferencias entre timestamps menores a 16 segundos (tolerancia 5%)."
+)
+
+RANGOS_DISTANCIA = [0, 5, 10, 15, 21, 42, np.inf]
+ETIQUETAS_RANGOS = ["0-5km", "5-10km", "10-15km", "15-21km (Media Maratón)", "21-42km (Entre media y maratón)", "Maratón+"]
+
+def _percentiles(valores, nombre, unidad, decimales):
+    valores = valores[np.isfinite(valores)]
+    if not len(valores):
+        return f"{nombre}: sin datos."
+    p10, p50, p90 = np.percentile(valores, [10, 50, 90])
+    return (f"{nombre} ({unidad}): p10 {p10:.{decimales}f}, mediana {p50:.{decimales}f}, "
+            f"p90 {p90:.{decimales}f}, máximo {valores.max():.{decimales}f}.")
+
+def _seccion_sesiones(df_sesion):
+    fechas = pd.to_datetime(df_sesion["fecha"], errors="coerce")
+    distancia = df_sesion["distancia"].to_numpy(dtype=float)
+    tiempo = df_sesion["tiempo"].to_numpy(dtype=float)
+    ritmo = df_sesion["ritmo"].to_numpy(dtype=float)
+
+    conteo, _ = np.histogram(distancia[np.isfinite(distancia)], bins=RANGOS_DISTANCIA)
+    rangos = ", ".join(f"{e}: {c}" for e, c in zip(ETIQUETAS_RANGOS, conteo))
+    return "\n".join([
+        f"Sesiones: {len(df_sesion)} entre {fechas.min():%Y-%m-%d} y {fechas.max():%Y-%m-%d}, "
+        f"{fechas.dt.date.nunique()} días de entrenamiento; total {np.nansum(distancia):.0f} km "
+        f"y {np.nansum(tiempo) / 60:.0f} h.",
+        _percentiles(distancia, "Distancia", "km", 1),
+        _percentiles(tiempo, "Tiempo", "min", 0),
+        _percentiles(ritmo, "Ritmo", "min/km", 2),
+        f"Sesiones por rango de distancia: {rangos}.",
+    ])
+
+def _seccion_tipos(df_sesion):
+    if "tipo_sesion" not in df_sesion.columns or df_sesion["tipo_sesion"].isna().all():
+        return "Tipos de sesión: clustering no ejecutado."
+    tipos = df_sesion.groupby("tipo_sesion").agg(
+        sesiones=("distancia", "size"), distancia=("distancia", "mean"), ritmo=("ritmo", "mean")
+    ).sort_values("sesiones", ascending=False)
+    lineas = ["Tipos de sesión (clustering):"]
+    lineas += [f"- {f.Index}: {f.sesiones} sesiones, {f.distancia:.1f} km y {f.ritmo:.2f} min/km de media."
+               for f in tipos.head(MAX_TIPOS_CONTEXTO).itertuples()]
+    if len(tipos) > MAX_TIPOS_CONTEXTO:
+        lineas.append(f"- Otros {len(tipos) - MAX_TIPOS_CONTEXTO} tipos: "
+                      f"{tipos['sesiones'].iloc[MAX_TIPOS_CONTEXTO:].sum()} sesiones.")
+    return "\n".join(lineas)
+
+def _seccion_volumen(cubo):
+    anios = cubo["anio"][cubo["anio"]["sesiones"] > 0]
+    meses = cubo["mes"].tail(MESES_CONTEXTO)
+    semanas = cubo["semana"].tail(SEMANAS_CONTEXTO)
+    return "\n".join([
+        "Volumen por año: " + "; ".join(
+            f"{f.periodo.year}: {f.distancia:.0f} km ({f.sesiones} sesiones)" for f in anios.itertuples()) + ".",
+        "Kilómetros por mes (km/sesiones): " + "; ".join(
+            f"{f.periodo:%Y-%m} {f.distancia:.0f}/{f.sesiones}" for f in meses.itertuples()) + ".",
+        "Kilómetros por semana, últimas semanas: " + "; ".join(
+            f"{f.periodo:%d/%m} {f.distancia:.0f}" for f in semanas.itertuples()) + ".",
+    ])
+
+def _seccion_tendencias(df_sesion, cubo):
+    lineas = ["Tendencias:"]
+    fechas = pd.to_datetime(df_sesion["fecha"], errors="coerce")
+    dias = ((fechas - fechas.min()).dt.total_seconds() / 86400).to_numpy()
+    ritmo = df_sesion["ritmo"].to_numpy(dtype=float)
+    validos = np.isfinite(dias) & np.isfinite(ritmo)
+    if validos.sum() >= 5 and np.ptp(dias[validos]) >= 14:
+        # Pendiente de la recta ritmo ~ fecha, en segundos por km al mes
+        pendiente = round(np.polyfit(dias[validos], ritmo[validos], 1)[0] * 30 * 60)
+        sentido = "mejora" if pendiente < -1 else "empeora" if pendiente > 1 else "se mantiene estable"
+        lineas.append(f"- El ritmo {sentido} ({pendiente:+.0f} s/km por mes, recta de ajuste).")
+    else:
+        lineas.append("- No hay sesiones suficientes para estimar la tendencia del ritmo.")
+
+    semanas = cubo["semana"]["distancia"].to_numpy()
+    if len(semanas) >= 8:
+        recientes, previas = semanas[-4:].sum(), semanas[-8:-4].sum()
+        cambio = f"{(recientes / previas - 1) * 100:+.0f}%" if previas > 0 else "sin datos previos"
+        lineas.append(f"- Últimas 4 semanas: {recientes:.0f} km; 4 anteriores: {previas:.0f} km ({cambio}).")
+    if len(semanas):
+        lineas.append(f"- Media de {semanas.mean():.1f} km y "
+                      f"{cubo['semana']['sesiones'].mean():.1f} sesiones por semana.")
+    return "\n".join(lineas)
+
+def generar_digest_contexto(df_sesion, resumen_zonas=None, resumen_prediccion=None,
+                            max_caracteres=MAX_CARACTERES_CONTEXTO):
+    """
+    Contexto para la IA con tamaño acotado: totales, percentiles, tipos de
+    sesión, volumen por año/mes/semana y tendencias, todo desde agregados
+    vectorizados (y el cubo temporal), con un número fijo de líneas. El texto
+    no crece con el número de sesiones y nunca pasa de max_caracteres.
+    Se memoriza por el contenido de las columnas usadas.
+    """
+    columnas = [c for c in ("fecha", "distancia", "tiempo", "ritmo", "tipo_sesion") if c in df_sesion.columns]
+    return _digest_contexto(df_sesion[columnas], resumen_zonas, resumen_prediccion, max_caracteres)
+
+@memorizar
+def _digest_contexto(df_sesion, resumen_zonas, resumen_prediccion, max_caracteres):
+    if df_sesion.empty:
+        return f"{INFO_FILTRADO}\n\nNo hay sesiones registradas."
+
+    cubo = construir_cubo_temporal(df_sesion)
+    # En orden de prioridad: si no cabe todo, se recortan las últimas
+    secciones = [
+        ("Resumen de sesiones", lambda: _seccion_sesiones(df_sesion)),
+        ("Predicción", lambda: resumen_prediccion or "Predicción: no disponible."),
+        ("Tipos de sesión", lambda: _seccion_tipos(df_sesion)),
+        ("Tendencias", lambda: _seccion_tendencias(df_sesion, cubo)),
+        ("Volumen", lambda: _seccion_volumen(cubo)),
+        ("Zonas de ritmo", lambda: resumen_zonas or "Zonas de ritmo: no calculadas."),
+    ]
+    partes = [INFO_FILTRADO]
+    for nombre, seccion in secciones:
+        try:
+            partes.append(seccion())
+        except Exception as e:
+            partes.append(f"{nombre}: error al generar ({e}).")
+
+    contexto = ""
+    for parte in partes:
+        restante = max_caracteres - len(contexto) - 2
+        if len(parte) > restante:
+            # Se corta por líneas completas
+            parte = parte[:max(restante, 0)].rsplit("\n", 1)[0] if restante > 0 else ""
+            contexto += ("\n\n" + parte) if parte else ""
+            break
+        contexto += ("\n\n" if contexto else "") + parte
+    return contexto
 
 def generar_contexto_completo(df_sesion, resumen_clusters=None, resumen_prediccion=None, df_intervalos_prediccion=None):
-    partes = []
-
-    # 🔹 Información de filtrado y calidad de los datos
-    info_filtrado = (
-        "Filtrado de sesiones aplicado:\n"
-        "- Solo sesiones de los últimos 12 meses.\n"
-        "- Se descartaron sesiones menores a 200 metros.\n"
-        "- Se verificó que todas las sesiones sean constantes, "
-        "con diferencias entre timestamps menores a 16 segundos (tolerancia 5%)."
-    )
-    partes.append(info_filtrado)
-
-    # 1) Resumen clusters
-    try:
-        if resumen_clusters is not None:
-            texto_clusters = resumen_texto_para_perplexity_avanzado(resumen_clusters, df_sesion)
-        else:
-            texto_clusters = "Resumen de clusters: no ejecutado."
-    except Exception as e:
-        texto_clusters = f"Resumen de clusters: error al generar ({e})."
-    partes.append(texto_clusters)
-
-    # 2) Kilómetros por mes
-    try:
-        texto_km_mes = resumen_kilometros_por_mes_textual(df_sesion)
-    except Exception as e:
-        texto_km_mes = f"Kilómetros por mes: error al generar ({e})."
-    partes.append(texto_km_mes)
-
-    # 3) Resumen detallado de sesiones
-    try:
-        texto_sesiones = resumen_ia_detallado_sesiones(df_sesion)
-    except Exception as e:
-        texto_sesiones = f"Resumen detallado de sesiones: error al generar ({e})."
-    partes.append(texto_sesiones)
-
-    # 4) Resumen de predicción
-    try:
-        texto_pred = ""
-        if resumen_prediccion:
-            texto_pred = resumen_texto_para_prediccion(resumen_prediccion, df_intervalos_prediccion)
-    except Exception as e:
-        texto_pred = f"Resumen de predicción: error al generar ({e})."
-    partes.append(texto_pred)
-
-    contexto_completo = "\n\n".join(partes)
-    return contexto_completo
-
-
-def resumen_kilometros_por_mes_textual(df_sesion):
-    return st.session_state.get("resumen_km", "No hay resumen disponible. Ejecuta primero tab_kilometros_por_mes(df_sesion).")
+    """Contexto de la consulta IA (ver generar_digest_contexto)."""
+    if resumen_clusters is None:
+        df_sesion = df_sesion.drop(columns="tipo_sesion", errors="ignore")
+    texto_pred = None
+    if resumen_prediccion:
+        texto_pred = resumen_texto_para_prediccion(resumen_prediccion, df_intervalos_prediccion)
+    return generar_digest_contexto(df_sesion, st.session_state.get("resumen_zonas"), texto_pred)
 
 def resumen_texto_para_prediccion(resumen_prediccion, df_intervalos=None):
     if not resumen_prediccion:
@@ -105,66 +198,251 @@ def resumen_texto_para_prediccion(resumen_prediccion, df_intervalos=None):
             f"Ritmo máximo: {ritmo_max:.2f} min/km.\n"
             f"Ritmo promedio: {ritmo_prom:.2f} min/km.\n"
         )
-    return texto
-
-def resumen_ia_detallado_sesiones(df_sesion):
-    if df_sesion is None or df_sesion.empty:
-        return "No hay sesiones registradas para generar resumen."
-
-    resumen = []
-    total_sesiones = len(df_sesion)
-    resumen.append(f"Analizadas {total_sesiones} sesiones registradas.")
-
-    dist_mean = df_sesion["distancia"].mean()
-    dist_min = df_sesion["distancia"].min()
-    dist_max = df_sesion["distancia"].max()
-    resumen.append(f"Distancia promedio: {dist_mean:.2f} km, mínimo: {dist_min:.2f} km, máximo: {dist_max:.2f} km.")
-
-    tiempo_mean = df_sesion["tiempo"].mean()
-    tiempo_min = df_sesion["tiempo"].min()
-    tiempo_max = df_sesion["tiempo"].max()
-    resumen.append(f"Tiempo promedio: {tiempo_mean:.1f} min, mínimo: {tiempo_min:.1f} min, máximo: {tiempo_max:.1f} min.")
-
-    ritmo_mean = df_sesion["ritmo"].mean()
-    ritmo_min = df_sesion["ritmo"].min()
-    ritmo_max = df_sesion["ritmo"].max()
-    resumen.append(f"Ritmo promedio de todas las sesiones: {ritmo_mean:.2f} min/km, mínimo: {ritmo_min:.2f} min/km, máximo: {ritmo_max:.2f} min/km.")
-
-    bins = [0, 5, 10, 15, 21, 42, float('inf')]
-    labels = ["0-5km", "5-10km", "10-15km", "15-21km (Media Maratón)", "21-42km (Entre media y maratón)", "Maratón+"]
-    df_sesion["rango_distancia"] = pd.cut(df_sesion["distancia"], bins=bins, labels=labels, right=False)
-    conteo_rangos = df_sesion["rango_distancia"].value_counts().sort_index()
-    sesiones_rangos = ", ".join([f"{label}: {conteo_rangos.get(label, 0)}" for label in labels])
-    resumen.append(f"Sesiones por rango de distancia: {sesiones_rangos}.")
-
-    df_sesion['fecha'] = pd.to_datetime(df_sesion['fecha'], errors='coerce')
-    num_dias = df_sesion['fecha'].dt.date.nunique()
-    fecha_min = df_sesion['fecha'].min().strftime('%Y-%m-%d')
-    fecha_max = df_sesion['fecha'].max().strftime('%Y-%m-%d')
-    resumen.append(f"Las sesiones cubren un período desde {fecha_min} hasta {fecha_max}, con {num_dias} días únicos de entrenamiento.")
-
-    df_sorted = df_sesion.sort_values("fecha")
-    if len(df_sorted) > 1 and "ritmo" in df_sesion.columns:
-        cambio_ritmo = df_sorted["ritmo"].iloc[-1] - df_sorted["ritmo"].iloc[0]
-        if cambio_ritmo < -0.1:
-            resumen.append("Se observa mejora en el ritmo a lo largo del tiempo.")
-        elif cambio_ritmo > 0.1:
-            resumen.append("Se observa empeoramiento en el ritmo a lo largo del tiempo.")
-        else:
-            resumen.append("El ritmo se mantiene estable a lo largo del tiempo.")
-
-    return "\n".join(resumen)
+    return texto.strip()
 
 # =========================================
-# Funciones IA
-def analizar_con_perplexity(texto_resumen, pregunta):
-    api_key = st.secrets.get("PERPLEXITY_API_KEY", None)
-    if not api_key:
-        st.error("Falta la clave PERPLEXITY_API_KEY en Streamlit secrets.")
+# Recuperación de registros relevantes para la pregunta (índice TF-IDF local)
+
+# Registros de mes y de sesión que se añaden al contexto en cada pregunta
+MAX_MESES_CONTEXTO = 2
+MAX_SESIONES_CONTEXTO = 6
+
+DIAS_NOMBRES = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+
+# Palabras vacías en español, sin tildes (sklearn sólo trae las inglesas)
+PALABRAS_VACIAS = {
+    "a", "al", "algo", "como", "con", "cual", "cuales", "cuando", "cuanto", "cuantos", "de", "del",
+    "donde", "el", "en", "era", "es", "esta", "este", "fue", "ha", "han", "hay", "he", "la", "las",
+    "le", "lo", "los", "mas", "me", "mi", "mis", "muy", "no", "o", "para", "pero", "por", "que",
+    "se", "si", "sin", "sobre", "son", "su", "sus", "tan", "te", "tu", "tus", "un", "una",
+    "uno", "y", "ya", "yo",
+}
+
+def _terminos(texto):
+    """
+    Analizador del índice: minúsculas sin tildes, sólo palabras (y 5k, 10k...),
+    sin palabras vacías y con el plural recortado (largas -> larga).
+    """
+    texto = unicodedata.normalize("NFKD", texto.lower()).encode("ascii", "ignore").decode()
+    terminos = []
+    for t in re.findall(r"\b(?:\d+k|[a-z]+)\b", texto):
+        if t in PALABRAS_VACIAS:
+            continue
+        terminos.append(t[:-1] if len(t) > 3 and t.endswith("s") else t)
+    return terminos
+
+def _etiquetas_distancia(km):
+    if km >= 40:
+        return "maratón 42k larga"
+    if km >= 20:
+        return "media maratón 21k larga"
+    if km >= 14:
+        return "larga"
+    if km >= 9:
+        return "10k"
+    if km >= 4.5:
+        return "5k"
+    return "corta"
+
+def _registros_sesiones(df_sesion):
+    fechas = pd.to_datetime(df_sesion["fecha"], errors="coerce")
+    ultima = fechas.max()
+    tipos = df_sesion["tipo_sesion"] if "tipo_sesion" in df_sesion.columns else pd.Series(None, index=df_sesion.index)
+    registros = []
+    for fecha, dist, tiempo, ritmo, tipo in zip(fechas, df_sesion["distancia"], df_sesion["tiempo"],
+                                                 df_sesion["ritmo"], tipos):
+        if pd.isna(fecha):
+            continue
+        recencia = ""
+        if (ultima - fecha).days < 7:
+            recencia = " Reciente: última semana."
+        elif fecha.to_period("M") == ultima.to_period("M"):
+            recencia = " Reciente: último mes."
+        registros.append(
+            f"Sesión del {DIAS_NOMBRES[fecha.weekday()]} {fecha:%Y-%m-%d} ({MES_NOMBRES[fecha.month]} {fecha.year}, "
+            f"{fecha:%H:%M} h){f', tipo {tipo}' if pd.notna(tipo) else ''}: {dist:.1f} km en {tiempo:.0f} min, "
+            f"ritmo {ritmo:.2f} min/km; {_etiquetas_distancia(dist)}.{recencia}"
+        )
+    return registros
+
+def _registros_meses(cubo):
+    meses = cubo["mes"][cubo["mes"]["sesiones"] > 0]
+    if meses.empty:
+        return []
+    ultimo = meses["periodo"].max()
+    return [
+        f"Mes {MES_NOMBRES[f.periodo.month]} {f.periodo.year} ({f.periodo:%Y-%m}): {f.distancia:.0f} km en "
+        f"{f.sesiones} sesiones, {f.tiempo / 60:.1f} h; volumen mensual."
+        + (" Reciente: último mes." if f.periodo == ultimo else "")
+        for f in meses.itertuples()
+    ]
+
+def construir_indice_registros(df_sesion):
+    """
+    Índice TF-IDF de registros de texto, uno por sesión y uno por mes, para
+    elegir los más relevantes para cada pregunta sin servicios externos.
+    Se construye una vez por conjunto de datos (memorizado por contenido).
+    Devuelve (registros, n_meses, vectorizador, matriz) o None si no hay
+    sesiones; los n_meses primeros registros son los de mes.
+    """
+    columnas = [c for c in ("fecha", "distancia", "tiempo", "ritmo", "tipo_sesion") if c in df_sesion.columns]
+    return _indice_registros(df_sesion[columnas])
+
+@memorizar
+def _indice_registros(df_sesion):
+    if df_sesion.empty:
+        return None
+    registros_meses = _registros_meses(construir_cubo_temporal(df_sesion))
+    registros = registros_meses + _registros_sesiones(df_sesion)
+    if not registros:
         return None
+    from sklearn.feature_extraction.text import TfidfVectorizer
 
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    vectorizador = TfidfVectorizer(analyzer=_terminos, sublinear_tf=True)
+    matriz = vectorizador.fit_transform(registros)
+    return registros, len(registros_meses), vectorizador, matriz
+
+def recuperar_registros(indice, pregunta, k_meses=MAX_MESES_CONTEXTO, k_sesiones=MAX_SESIONES_CONTEXTO):
+    """
+    Registros con mayor similitud coseno con la pregunta: como mucho k_meses de
+    mes y k_sesiones de sesión (se puntúan por separado para que las sesiones,
+    mucho más numerosas, no desplacen a los meses). Sin términos comunes no entran.
+    """
+    if indice is None or not pregunta.strip():
+        return []
+    registros, n_meses, vectorizador, matriz = indice
+    similitud = (matriz @ vectorizador.transform([pregunta]).T).toarray().ravel()
+    elegidos = []
+    for inicio, fin, k in ((0, n_meses, k_meses), (n_meses, len(registros), k_sesiones)):
+        mejores = inicio + np.argsort(-similitud[inicio:fin], kind="stable")[:k]
+        elegidos += [registros[i] for i in mejores if similitud[i] > 0]
+    return elegidos
+
+def contexto_para_pregunta(digest, df_sesion, pregunta):
+    """Digest global más los registros de sesiones/meses más relevantes para la pregunta."""
+    registros = recuperar_registros(construir_indice_registros(df_sesion), pregunta)
+    if not registros:
+        return digest
+    return digest + "\n\nRegistros relevantes para la pregunta:\n" + "\n".join(f"- {r}" for r in registros)
 
+# =========================================
+# Caché en disco de respuestas IA
+
+# Modelo y longitud de respuesta (forman parte de la clave de la caché)
+MODELO_IA = "sonar-pro"
+MAX_TOKENS_IA = 200
+
+# Respuestas guardadas: un JSON por clave; la fecha de modificación marca el último uso (LRU)
+RUTA_CACHE_IA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_ia")
+MAX_ENTRADAS_CACHE_IA = 500
+TTL_CACHE_IA_S = 7 * 24 * 3600
+
+def normalizar_pregunta(pregunta):
+    """Minúsculas, sin tildes, signos ni espacios repetidos: '¿Cuántos km?' == 'cuantos km'."""
+    texto = unicodedata.normalize("NFKD", pregunta.lower()).encode("ascii", "ignore").decode()
+    return " ".join(re.findall(r"\w+", texto))
+
+def clave_cache_ia(contexto, pregunta):
+    """Hash del contexto, la pregunta normalizada y los parámetros del modelo."""
+    h = hashlib.blake2b(digest_size=16)
+    for parte in (contexto, normalizar_pregunta(pregunta), modelo_backend_ia(), str(MAX_TOKENS_IA)):
+        h.update(parte.encode("utf-8") + b"\0")
+    return h.hexdigest()
+
+def leer_cache_ia(clave):
+    """Respuesta guardada para clave, o None si no existe o ha caducado."""
+    ruta = os.path.join(RUTA_CACHE_IA, f"{clave}.json")
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            entrada = json.load(f)
+        if time.time() - entrada["creado"] > TTL_CACHE_IA_S:
+            os.remove(ruta)
+            return None
+        os.utime(ruta)
+        return entrada["respuesta"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def guardar_cache_ia(clave, respuesta):
+    """Guarda la respuesta y expulsa las caducadas y, si sobran, las de uso más antiguo."""
+    try:
+        os.makedirs(RUTA_CACHE_IA, exist_ok=True)
+        ruta = os.path.join(RUTA_CACHE_IA, f"{clave}.json")
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"creado": time.time(), "respuesta": respuesta}, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+        ahora = time.time()
+        entradas = sorted(
+            (os.path.getmtime(os.path.join(RUTA_CACHE_IA, nombre)), nombre)
+            for nombre in os.listdir(RUTA_CACHE_IA) if nombre.endswith(".json")
+        )
+        sobran = len(entradas) - MAX_ENTRADAS_CACHE_IA
+        for i, (usado, nombre) in enumerate(entradas):
+            if i < sobran or ahora - usado > TTL_CACHE_IA_S:
+                os.remove(os.path.join(RUTA_CACHE_IA, nombre))
+    except OSError:
+        # La caché es sólo una optimización: si el disco falla se consulta la IA sin ella
+        pass
+
+# =========================================
+# Funciones IA
+# Cliente HTTP compartido: conexiones reutilizadas (keep-alive) y reintentos acotados
+URL_BASE_IA = "https://api.perplexity.ai"
+TIMEOUT_CONEXION_IA_S = 5
+TIMEOUT_LECTURA_IA_S = 30
+REINTENTOS_IA = 3
+
+_lock_sesion_http = threading.Lock()
+_sesion_http = None
+
+def sesion_http():
+    """requests.Session del proceso con pool de conexiones y reintentos con backoff exponencial."""
+    global _sesion_http
+    with _lock_sesion_http:
+        if _sesion_http is None:
+            reintentos = Retry(
+                total=REINTENTOS_IA, connect=REINTENTOS_IA, read=0,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,  # también POST: la consulta no tiene efectos en el servidor
+                backoff_factor=0.5, respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            sesion = requests.Session()
+            sesion.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=reintentos))
+            sesion.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=reintentos))
+            _sesion_http = sesion
+        return _sesion_http
+
+def leer_eventos_sse(response):
+    """Fragmentos de texto de una respuesta chat-completions en modo stream (Server-Sent Events)."""
+    for linea in response.iter_lines(decode_unicode=True):
+        if not linea or not linea.startswith("data:"):
+            continue
+        datos = linea[len("data:"):].strip()
+        if datos == "[DONE]":
+            return
+        evento = json.loads(datos)
+        opcion = (evento.get("choices") or [{}])[0]
+        fragmento = (opcion.get("delta") or {}).get("content") or (opcion.get("message") or {}).get("content")
+        if fragmento:
+            yield fragmento
+
+def fin_frases_completas(texto, desde=0):
+    """
+    Posición tras la última oración que ya se sabe completa en un texto que aún
+    está llegando: sólo cuenta un '.', '!' o '?' seguido de espacio y mayúscula
+    (al final del texto podría ser un decimal a medias). Busca desde `desde`,
+    así cada fragmento nuevo sólo recorre lo añadido.
+    """
+    fin = desde
+    for m in re.finditer(r'[.!?](?=\s+[A-Z])', texto[max(desde - 1, 0):]):
+        fin = max(desde - 1, 0) + m.end()
+    return fin
+
+def construir_mensajes(texto_resumen, pregunta):
+    """Mensajes de chat (system + user) con las instrucciones, el contexto y la pregunta."""
     # 🔹 Prompt mejorado: instrucciones claras, tono profesional, límite de extensión
     prompt = (
         "Eres un asistente experto en análisis de rendimiento deportivo para corredores. "
@@ -177,49 +455,131 @@ def analizar_con_perplexity(texto_resumen, pregunta):
         f"\n\nContexto analizado:\n{texto_resumen}\n\n"
         f"Pregunta del usuario:\n{pregunta}"
     )
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Eres un asistente experto en análisis de rendimiento deportivo. "
+                "Debes responder de forma breve, clara y precisa, en un máximo de tres párrafos."
+            )
+        },
+        {"role": "user", "content": prompt}
+    ]
 
-    # 🔹 Payload ajustado: elimina redundancia con el system message
-    payload = {
-        "model": "sonar-pro",
-        "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "Eres un asistente experto en análisis de rendimiento deportivo. "
-                    "Debes responder de forma breve, clara y precisa, en un máximo de tres párrafos."
-                )
-            },
-            {"role": "user", "content": prompt}
-        ],
-        "max_tokens": 200
-    }
+# =========================================
+# Backends de IA: funciones mensajes -> iterador de fragmentos de texto.
+# Se elige con IA_BACKEND (variable de entorno o secrets); por defecto Perplexity.
+
+# Endpoint local compatible con OpenAI (llama.cpp, Ollama, vLLM...)
+URL_BASE_LOCAL_IA = "http://localhost:11434/v1"
+MODELO_LOCAL_IA = "llama3"
 
+def config_ia(nombre, defecto=None):
+    """Configuración: variable de entorno o, si no está, st.secrets (sin secrets.toml, el defecto)."""
+    if nombre in os.environ:
+        return os.environ[nombre]
     try:
-        response = requests.post(
-            "https://api.perplexity.ai/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-    except Exception as e:
-        st.error(f"Error al conectar con Perplexity: {e}")
-        return None
+        return st.secrets.get(nombre, defecto)
+    except FileNotFoundError:
+        return defecto
+
+def _fragmentos_chat_completions(url_base, api_key, modelo, mensajes):
+    """Llamada /chat/completions en modo stream sobre la sesión HTTP compartida."""
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    payload = {"model": modelo, "messages": mensajes, "max_tokens": MAX_TOKENS_IA, "stream": True}
+    response = sesion_http().post(
+        url_base.rstrip("/") + "/chat/completions", headers=headers, json=payload, stream=True,
+        timeout=(TIMEOUT_CONEXION_IA_S, TIMEOUT_LECTURA_IA_S)
+    )
+    with response:
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.status_code} - {response.text}")
+        yield from leer_eventos_sse(response)
 
-    if response.status_code != 200:
-        st.error(f"Error al llamar Perplexity: {response.status_code} - {response.text}")
-        return None
+def backend_perplexity(mensajes):
+    api_key = config_ia("PERPLEXITY_API_KEY")
+    if not api_key:
+        raise RuntimeError("Falta la clave PERPLEXITY_API_KEY en Streamlit secrets.")
+    return _fragmentos_chat_completions(config_ia("PERPLEXITY_BASE_URL", URL_BASE_IA), api_key, MODELO_IA, mensajes)
 
+def backend_openai_compatible(mensajes):
+    return _fragmentos_chat_completions(
+        config_ia("IA_BASE_URL", URL_BASE_LOCAL_IA), config_ia("IA_API_KEY"),
+        config_ia("IA_MODELO", MODELO_LOCAL_IA), mensajes
+    )
+
+def backend_stub(mensajes):
+    """
+    Respuesta determinista sin red (pruebas y benchmarks): depende sólo del
+    hash de los mensajes. IA_STUB_LATENCIA_S simula el tiempo hasta el primer
+    fragmento e IA_STUB_FRAGMENTO_S el tiempo entre fragmentos.
+    """
+    latencia = float(config_ia("IA_STUB_LATENCIA_S", 0) or 0)
+    entre_fragmentos = float(config_ia("IA_STUB_FRAGMENTO_S", 0) or 0)
+    semilla = int(hashlib.blake2b(json.dumps(mensajes).encode(), digest_size=4).hexdigest(), 16)
+    texto = (
+        f"Respuesta de prueba {semilla % 1000:03d} para un contexto de "
+        f"{len(mensajes[-1]['content'])} caracteres. "
+        f"Tu ritmo medio estimado es {4 + semilla % 3}.{semilla % 60:02d} min/km. "
+        "Mantén la constancia semanal. Esta última frase queda incompleta"
+    )
+    time.sleep(latencia)
+    for i, palabra in enumerate(texto.split(" ")):
+        if i and entre_fragmentos:
+            time.sleep(entre_fragmentos)
+        yield palabra if i == 0 else " " + palabra
+
+BACKENDS_IA = {
+    "perplexity": backend_perplexity,
+    "openai": backend_openai_compatible,
+    "stub": backend_stub,
+}
+
+def nombre_backend_ia():
+    nombre = config_ia("IA_BACKEND", "perplexity")
+    return nombre if nombre in BACKENDS_IA else "perplexity"
+
+def modelo_backend_ia():
+    """Backend y modelo en uso (forman parte de la clave de la caché de respuestas)."""
+    nombre = nombre_backend_ia()
+    modelo = {"perplexity": MODELO_IA, "openai": config_ia("IA_MODELO", MODELO_LOCAL_IA)}.get(nombre, nombre)
+    return f"{nombre}:{modelo}"
+
+def analizar_con_ia(texto_resumen, pregunta, contenedor=None):
+    """
+    Consulta el backend de IA configurado en modo streaming. Si se pasa
+    contenedor (st.empty()) el texto se va mostrando por oraciones completas
+    según llega. Registra en el log el tiempo hasta el primer fragmento y el
+    total. Devuelve el texto completo o None si hay error.
+    """
+    nombre = nombre_backend_ia()
+    inicio = time.perf_counter()
+    texto = ""
+    mostrado = 0
+    primer_fragmento = None
     try:
-        data = response.json()
-        contenido = data.get("choices", [{}])[0].get("message", {}).get("content", None)
-        if not contenido:
-            st.error("La respuesta de la IA no contiene texto válido.")
-            return None
-        return contenido.strip()
+        for fragmento in BACKENDS_IA[nombre](construir_mensajes(texto_resumen, pregunta)):
+            if primer_fragmento is None:
+                primer_fragmento = time.perf_counter() - inicio
+            texto += fragmento
+            fin = fin_frases_completas(texto, mostrado)
+            if contenedor is not None and fin > mostrado:
+                contenedor.markdown(texto[:fin])
+            mostrado = fin
     except Exception as e:
-        st.error(f"Error al procesar la respuesta de Perplexity: {e}")
+        st.error(f"Error al consultar la IA ({nombre}): {e}")
         return None
 
+    total = time.perf_counter() - inicio
+    logger.info("Consulta IA (%s): primer fragmento en %.2f s, respuesta completa en %.2f s (%d caracteres)",
+                nombre, primer_fragmento if primer_fragmento is not None else total, total, len(texto))
+    if not texto.strip():
+        st.error("La respuesta de la IA no contiene texto válido.")
+        return None
+    return texto.strip()
+
 
 def tab_analisis_ia(df_sesion):
     resumen = st.session_state.get("resumen_clusters")
@@ -247,89 +607,210 @@ def tab_analisis_ia(df_sesion):
     # ===========================================================================
 
     if st.button("Consultar IA"):
-        respuesta_ia = manejar_consulta_ia(texto_resumen_completo, pregunta)
-        if respuesta_ia:
-            st.markdown("### Respuesta IA")
-            st.markdown(respuesta_ia)
+        # Cada pregunta lleva el digest y sólo los registros relevantes
+        contexto = contexto_para_pregunta(texto_resumen_completo, df_sesion, pregunta)
+        manejar_consulta_ia(contexto, pregunta)  # muestra la respuesta según llega
 
 # =========================================
 # Gestión de contador de consultas IA con Google Sheets
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-secret = st.secrets["SERVICE_ACCOUNT_JSON"]
-if isinstance(secret, str):
-    SERVICE_ACCOUNT_INFO = json.loads(secret)
-else:
-    SERVICE_ACCOUNT_INFO = secret
-
-SPREADSHEET_ID = st.secrets["SPREADSHEET_ID"]
-RANGE_NAME = st.secrets["RANGE_NAME"]
-
-try:
-    creds = Credentials.from_service_account_info(SERVICE_ACCOUNT_INFO, scopes=SCOPES)
-    service = build('sheets', 'v4', credentials=creds)
-    sheet = service.spreadsheets()
-except Exception as e:
-    st.error(f"Error inicializando conexión con Google Sheets: {e}")
-    sheet = None
+# Cliente de Sheets del proceso: se crea en el primer uso (la primera reserva de consulta IA),
+# no al importar, para no pagar credenciales + discovery en cada arranque
+_lock_hoja = threading.Lock()
+_hoja = {"cliente": None, "iniciado": False, "id": None, "rango": None}
+
+def hoja_sheets():
+    """Cliente spreadsheets() compartido, o None si no hay credenciales o falla la conexión."""
+    with _lock_hoja:
+        if not _hoja["iniciado"]:
+            _hoja["iniciado"] = True
+            try:
+                from google.oauth2.service_account import Credentials
+                from googleapiclient.discovery import build
+
+                secret = config_ia("SERVICE_ACCOUNT_JSON")
+                _hoja["id"], _hoja["rango"] = config_ia("SPREADSHEET_ID"), config_ia("RANGE_NAME")
+                info = json.loads(secret) if isinstance(secret, str) else secret
+                if not info:
+                    raise RuntimeError("falta SERVICE_ACCOUNT_JSON en Streamlit secrets")
+                creds = Credentials.from_service_account_info(info, scopes=SCOPES)
+                service = build('sheets', 'v4', credentials=creds, cache_discovery=False)
+                _hoja["cliente"] = service.spreadsheets()
+            except Exception as e:
+                logger.warning("Error inicializando conexión con Google Sheets: %s", e)
+        return _hoja["cliente"]
 
 
 def leer_contador_gs():
+    sheet = hoja_sheets()
     if sheet is None:
-        st.warning("No se pudo conectar con Google Sheets (modo lectura).")
+        logger.warning("No se pudo conectar con Google Sheets (modo lectura).")
         return {"fecha": "", "contador": 0}
     try:
-        result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range=RANGE_NAME).execute()
+        result = sheet.values().get(spreadsheetId=_hoja["id"], range=_hoja["rango"]).execute()
         values = result.get('values', [])
         if not values or len(values[0]) < 2:
             return {"fecha": "", "contador": 0}
         return {"fecha": values[0][0], "contador": int(values[0][1])}
     except Exception as e:
-        st.warning(f"Error leyendo contador de Google Sheets: {e}")
+        logger.warning("Error leyendo contador de Google Sheets: %s", e)
         return {"fecha": "", "contador": 0}
 
 def guardar_contador_gs(fecha, contador):
+    sheet = hoja_sheets()
     if sheet is None:
-        st.warning("No se pudo conectar con Google Sheets (modo escritura).")
+        logger.warning("No se pudo conectar con Google Sheets (modo escritura).")
         return
     try:
         values = [[fecha, str(contador)]]
         body = {"values": values}
-        sheet.values().update(spreadsheetId=SPREADSHEET_ID, range=RANGE_NAME, valueInputOption="USER_ENTERED", body=body).execute()
+        sheet.values().update(spreadsheetId=_hoja["id"], range=_hoja["rango"], valueInputOption="USER_ENTERED", body=body).execute()
     except Exception as e:
-        st.warning(f"Error guardando contador en Google Sheets: {e}")
-
-def puede_consultar_ia():
-    data = leer_contador_gs()
-    hoy = datetime.now().strftime("%Y-%m-%d")
-    if data["fecha"] != hoy:
-        guardar_contador_gs(hoy, 0)
-        return True
-    return data["contador"] < 3 # Límite diario de 3 consultas
-
-def incrementar_contador():
-    data = leer_contador_gs()
-    hoy = datetime.now().strftime("%Y-%m-%d")
-    if data["fecha"] != hoy:
-        guardar_contador_gs(hoy, 1)
-    else:
-        guardar_contador_gs(hoy, data["contador"] + 1)
+        logger.warning("Error guardando contador en Google Sheets: %s", e)
+
+# =========================================
+# Límite diario de consultas IA: contador local atómico (SQLite) con copia en Google Sheets
+
+LIMITE_CONSULTAS_IA_DIA = 3
+RUTA_CUOTA_IA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cuota_ia.sqlite3")
+
+# La hoja se actualiza en segundo plano, como mucho una vez cada INTERVALO_SYNC_SHEETS_S
+INTERVALO_SYNC_SHEETS_S = 30
+
+# Con False no se lee ni se escribe la hoja (benchmarks y pruebas con una base temporal)
+SYNC_SHEETS_IA = True
+
+_local_cuota = threading.local()
+_lock_sync = threading.Lock()
+_lock_sembrado = threading.Lock()
+_evento_sync = threading.Event()
+_estado_sync = {"hilo": None, "sincronizado": None, "sembrado": False}
+
+def _hoy():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def _conexion_cuota():
+    """Conexión SQLite del hilo actual (sqlite3 no comparte conexiones entre hilos)."""
+    conexion = getattr(_local_cuota, "conexion", None)
+    if conexion is None or getattr(_local_cuota, "ruta", None) != RUTA_CUOTA_IA:
+        conexion = sqlite3.connect(RUTA_CUOTA_IA, timeout=5, isolation_level=None)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("CREATE TABLE IF NOT EXISTS cuota (fecha TEXT PRIMARY KEY, contador INTEGER NOT NULL)")
+        _local_cuota.conexion, _local_cuota.ruta = conexion, RUTA_CUOTA_IA
+    return conexion
+
+def consultas_ia_hoy():
+    fila = _conexion_cuota().execute("SELECT contador FROM cuota WHERE fecha = ?", (_hoy(),)).fetchone()
+    return fila[0] if fila else 0
+
+def reservar_consulta_ia(limite=None):
+    """
+    Reserva una consulta del día si queda cupo, en una sola sentencia atómica
+    (UPSERT ... RETURNING): dos sesiones a la vez nunca superan el límite.
+    Devuelve True si se ha reservado.
+    """
+    _sembrar_cuota()
+    _iniciar_sync_sheets()
+    limite = LIMITE_CONSULTAS_IA_DIA if limite is None else limite
+    fila = _conexion_cuota().execute(
+        "INSERT INTO cuota (fecha, contador) VALUES (?, 1) "
+        "ON CONFLICT (fecha) DO UPDATE SET contador = contador + 1 WHERE contador < ? "
+        "RETURNING contador",
+        (_hoy(), limite)
+    ).fetchone()
+    if fila is None:
+        return False
+    _evento_sync.set()
+    return True
+
+def liberar_consulta_ia():
+    """Devuelve la consulta reservada si la IA no llegó a responder."""
+    _conexion_cuota().execute(
+        "UPDATE cuota SET contador = contador - 1 WHERE fecha = ? AND contador > 0", (_hoy(),)
+    )
+    _evento_sync.set()
+
+def _sincronizar_sheets():
+    """Escribe en la hoja el contador de hoy si ha cambiado desde la última copia."""
+    fecha, contador = _hoy(), consultas_ia_hoy()
+    if _estado_sync["sincronizado"] != (fecha, contador):
+        guardar_contador_gs(fecha, contador)
+        _estado_sync["sincronizado"] = (fecha, contador)
+
+def _sembrar_cuota():
+    """
+    Una vez por proceso y antes de conceder ninguna consulta, recupera el
+    contador de hoy de la hoja (el disco local puede haberse borrado en un
+    redeploy) y se queda con el mayor de los dos. Se hace en el hilo que
+    reserva, no en el de sincronización: si no, la primera consulta tras un
+    redeploy se contaría sobre un contador local vacío.
+    """
+    if _estado_sync["sembrado"]:
+        return
+    with _lock_sembrado:
+        if _estado_sync["sembrado"]:
+            return
+        if SYNC_SHEETS_IA and hoja_sheets() is not None:
+            datos = leer_contador_gs()
+            if datos["fecha"] == _hoy() and datos["contador"] > 0:
+                _conexion_cuota().execute(
+                    "INSERT INTO cuota (fecha, contador) VALUES (?, ?) "
+                    "ON CONFLICT (fecha) DO UPDATE SET contador = MAX(contador, excluded.contador)",
+                    (datos["fecha"], datos["contador"])
+                )
+                _estado_sync["sincronizado"] = (datos["fecha"], datos["contador"])
+        _estado_sync["sembrado"] = True
+
+def _bucle_sync_sheets():
+    if hoja_sheets() is None:
+        return
+    # Lo pendiente se escribe también al cerrar el proceso, sólo si hay conexión con la hoja
+    atexit.register(lambda: _evento_sync.is_set() and _sincronizar_sheets())
+    while True:
+        _evento_sync.wait()
+        time.sleep(INTERVALO_SYNC_SHEETS_S)  # agrupa los cambios del intervalo en una escritura
+        _evento_sync.clear()
+        _sincronizar_sheets()
+
+def _iniciar_sync_sheets():
+    if not SYNC_SHEETS_IA:
+        return
+    with _lock_sync:
+        if _estado_sync["hilo"] is None:
+            _estado_sync["hilo"] = threading.Thread(target=_bucle_sync_sheets, name="sync-sheets", daemon=True)
+            _estado_sync["hilo"].start()
 
 def manejar_consulta_ia(contexto, pregunta):
-    if not puede_consultar_ia():
-        st.warning("Se alcanzó el límite de consultas diarias a la IA. Intenta mañana.")
-        return None
     if pregunta.strip() == "":
         st.warning("Por favor escribe una pregunta antes de consultar la IA.")
         return None
 
+    # Una pregunta ya respondida con los mismos datos no gasta consulta
+    clave = clave_cache_ia(contexto, pregunta)
+    respuesta = leer_cache_ia(clave)
+    if respuesta:
+        st.markdown("### Respuesta IA")
+        st.markdown(respuesta)
+        st.caption("Respuesta guardada de una consulta anterior (no cuenta para el límite diario).")
+        return respuesta
+
+    if not reservar_consulta_ia():
+        st.warning("Se alcanzó el límite de consultas diarias a la IA. Intenta mañana.")
+        return None
+
+    # La respuesta se va mostrando mientras llega
+    st.markdown("### Respuesta IA")
+    contenedor = st.empty()
     with st.spinner("Consultando IA..."):
-        respuesta = analizar_con_perplexity(contexto, pregunta)
+        respuesta = analizar_con_ia(contexto, pregunta, contenedor)
     if respuesta:
         respuesta = truncar_a_frase_completa(respuesta)
-        incrementar_contador()
+        contenedor.markdown(respuesta)
+        guardar_cache_ia(clave, respuesta)
         return respuesta
     else:
+        liberar_consulta_ia()
         st.error("Error al consultar la IA.")
         return None
 
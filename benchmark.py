@@ -0,0 +1,284 @@
+"""
+Benchmarks de rendimiento de la app.
+
+Uso:
+    python benchmark.py clustering [--tamanos 100 500 2000 3000 5000]
+    python benchmark.py ia [--usuarios 1 4 16] [--consultas 64] [--latencia 0.5]
+    python benchmark.py cuota [--hilos 16] [--intentos 2000] [--limite 3]
+    python benchmark.py arranque [--repeticiones 5] [--presupuesto 0.5]
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# ==========================
+def _sesiones_sinteticas(n, semilla=0):
+    """Matriz (distancia, ritmo) con varios tipos de sesión típicos."""
+    rng = np.random.default_rng(semilla)
+    centros = np.array([[3, 5.0], [5, 5.5], [8, 6.0], [10, 5.3], [15, 6.2], [21, 5.8]])
+    tipo = rng.integers(0, len(centros), size=n)
+    ruido = rng.normal(scale=[1.0, 0.35], size=(n, 2))
+    return centros[tipo] + ruido
+
+# ==========================
+def benchmark_clustering(tamanos, repeticiones=1):
+    """
+    Compara el barrido de k completo (KMeans + silhouette exacta) con el modo de
+    gran volumen (MiniBatchKMeans + silhouette muestreada) para varios tamaños
+    y muestra a partir de qué número de sesiones compensa el modo rápido:
+    el barrido completo tarda más del doble y el ahorro es apreciable (>0.25 s).
+    """
+    from sklearn.preprocessing import StandardScaler
+    from visualization import _evaluar_k, UMBRAL_SESIONES_GRAN_VOLUMEN
+
+    print(f"{'sesiones':>9} {'completo (s)':>13} {'gran vol. (s)':>14} "
+          f"{'silh. completo':>15} {'silh. gran vol.':>16}")
+    cruce = None
+    for n in tamanos:
+        X = StandardScaler().fit_transform(_sesiones_sinteticas(n))
+        tiempos = {}
+        mejores = {}
+        for gran_volumen in (False, True):
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                resultados = [_evaluar_k(X, k, gran_volumen) for k in range(2, min(8, n))]
+            tiempos[gran_volumen] = (time.perf_counter() - inicio) / repeticiones
+            mejores[gran_volumen] = max(resultados, key=lambda r: r[1])
+        print(f"{n:>9} {tiempos[False]:>13.3f} {tiempos[True]:>14.3f} "
+              f"{mejores[False][1]:>10.3f} (k={mejores[False][0]}) {mejores[True][1]:>11.3f} (k={mejores[True][0]})")
+        compensa = tiempos[False] > 2 * tiempos[True] and tiempos[False] - tiempos[True] > 0.25
+        if not compensa:
+            cruce = None
+        elif cruce is None:
+            cruce = n
+
+    if cruce is None:
+        print("\nEl modo de gran volumen no compensa en los tamaños más grandes probados.")
+    else:
+        print(f"\nEl modo de gran volumen compensa a partir de ~{cruce} sesiones "
+              f"(umbral configurado: {UMBRAL_SESIONES_GRAN_VOLUMEN}).")
+
+# ==========================
+PREGUNTAS_IA = [
+    "¿Cómo fueron mis tiradas largas del último mes?",
+    "¿Qué tal voy para la media maratón?",
+    "¿Cuántos km hice en marzo?",
+    "¿Mejora mi ritmo en los 10k?",
+]
+
+def _percentil(valores, q):
+    return float(np.percentile(valores, q)) if len(valores) else float("nan")
+
+def benchmark_ia(usuarios, consultas, latencia, n_sesiones=1000):
+    """
+    Latencia de extremo a extremo de analisis_ia.manejar_consulta_ia con el
+    backend stub (sin red): contexto (digest + registros relevantes), límite
+    diario, llamada en streaming y truncado, con varios usuarios concurrentes.
+    Cada consulta es una pregunta distinta y la caché de respuestas empieza
+    vacía, así que ninguna se sirve desde disco. El límite diario se
+    comprueba contra una base SQLite temporal, sin Google Sheets, con un límite
+    que no se alcanza.
+    """
+    os.environ["IA_BACKEND"] = "stub"
+    os.environ["IA_STUB_LATENCIA_S"] = str(latencia)
+    import pandas as pd
+    from streamlit.logger import set_log_level
+    set_log_level(logging.ERROR)  # avisos de Streamlit fuera de `streamlit run`
+    import analisis_ia
+    analisis_ia.logger.setLevel(logging.WARNING)  # sin una línea de tiempos por consulta
+
+    # Base temporal y sin copia en Google Sheets: el contador real de hoy no se toca
+    analisis_ia.SYNC_SHEETS_IA = False
+    analisis_ia.RUTA_CUOTA_IA = os.path.join(tempfile.mkdtemp(prefix="cuota_ia_"), "cuota.sqlite3")
+    analisis_ia.LIMITE_CONSULTAS_IA_DIA = 10 ** 9
+    rng = np.random.default_rng(0)
+    X = _sesiones_sinteticas(n_sesiones)
+    df_sesion = pd.DataFrame({
+        "fecha": pd.Timestamp("2025-10-01") - pd.to_timedelta(rng.uniform(0, 360, n_sesiones), unit="D"),
+        "distancia": X[:, 0].clip(0.5),
+        "ritmo": X[:, 1],
+        "tipo_sesion": rng.choice(["Rodaje suave", "Tirada larga", "Series"], n_sesiones),
+    })
+    df_sesion["tiempo"] = df_sesion["distancia"] * df_sesion["ritmo"]
+
+    def consulta(i):
+        inicio = time.perf_counter()
+        pregunta = f"{PREGUNTAS_IA[i % len(PREGUNTAS_IA)]} ({i})"
+        digest = analisis_ia.generar_digest_contexto(df_sesion)
+        contexto = analisis_ia.contexto_para_pregunta(digest, df_sesion, pregunta)
+        t_contexto = time.perf_counter() - inicio
+        respuesta = analisis_ia.manejar_consulta_ia(contexto, pregunta)
+        return t_contexto, time.perf_counter() - inicio, respuesta is not None
+
+    print(f"Backend stub con {latencia:.2f} s hasta el primer fragmento, {n_sesiones} sesiones, "
+          f"{consultas} consultas por nivel.")
+    print(f"{'usuarios':>9} {'contexto p50 (ms)':>18} {'p50 (s)':>8} {'p95 (s)':>8} "
+          f"{'máx (s)':>8} {'consultas/s':>12} {'errores':>8}")
+    for n_usuarios in usuarios:
+        analisis_ia.RUTA_CACHE_IA = tempfile.mkdtemp(prefix="cache_ia_")
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n_usuarios) as ejecutor:
+            resultados = list(ejecutor.map(consulta, range(consultas)))
+        duracion = time.perf_counter() - inicio
+        t_contexto = [r[0] for r in resultados]
+        totales = [r[1] for r in resultados]
+        errores = sum(not r[2] for r in resultados)
+        print(f"{n_usuarios:>9} {_percentil(t_contexto, 50) * 1000:>18.1f} {_percentil(totales, 50):>8.3f} "
+              f"{_percentil(totales, 95):>8.3f} {max(totales):>8.3f} {consultas / duracion:>12.1f} {errores:>8}")
+
+# ==========================
+def benchmark_cuota(hilos, intentos, limite):
+    """
+    Reservas del límite diario (analisis_ia.reservar_consulta_ia) desde varios
+    hilos a la vez sobre una base SQLite temporal (sin Google Sheets): tiempo por llamada y
+    comprobación de que se conceden exactamente `limite` consultas.
+    """
+    from streamlit.logger import set_log_level
+    set_log_level(logging.ERROR)
+    import analisis_ia
+
+    # Base temporal y sin copia en Google Sheets: el contador real de hoy no se toca
+    analisis_ia.SYNC_SHEETS_IA = False
+    analisis_ia.RUTA_CUOTA_IA = os.path.join(tempfile.mkdtemp(prefix="cuota_ia_"), "cuota.sqlite3")
+    analisis_ia.consultas_ia_hoy()  # crea la tabla
+
+    def reservar(_):
+        inicio = time.perf_counter()
+        concedida = analisis_ia.reservar_consulta_ia(limite)
+        return time.perf_counter() - inicio, concedida
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        resultados = list(ejecutor.map(reservar, range(intentos)))
+    duracion = time.perf_counter() - inicio
+
+    tiempos = [r[0] for r in resultados]
+    concedidas = sum(r[1] for r in resultados)
+    print(f"{intentos} reservas desde {hilos} hilos en {duracion:.2f} s: "
+          f"p50 {_percentil(tiempos, 50) * 1e6:.0f} µs, p95 {_percentil(tiempos, 95) * 1e6:.0f} µs.")
+    print(f"Concedidas {concedidas} de {limite} permitidas; contador final {analisis_ia.consultas_ia_hoy()}.")
+    if concedidas != limite:
+        raise SystemExit("El límite diario no se ha respetado.")
+
+# ==========================
+DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+
+# Módulos de la app cuyo tiempo de importación se mide
+MODULOS_APP = ["memoria", "metricas", "file_io", "reporte", "analisis_ia", "visualization"]
+
+# Dependencias que la primera página (formulario de carga) no debe importar
+MODULOS_DIFERIDOS = ["sklearn", "scipy", "bokeh", "joblib", "timezonefinder", "googleapiclient"]
+
+# Mediana máxima, en segundos, del primer render de main.py en un proceso nuevo
+PRESUPUESTO_PRIMER_RENDER_S = 0.5
+
+_CODIGO_IMPORTACION = """
+import json, sys, time
+inicio = time.perf_counter()
+import {modulo}
+print(json.dumps({{"segundos": time.perf_counter() - inicio}}))
+"""
+
+_CODIGO_PRIMER_RENDER = """
+import json, logging, sys, time
+from streamlit.logger import set_log_level
+from streamlit.testing.v1 import AppTest
+set_log_level(logging.ERROR)
+at = AppTest.from_file("main.py", default_timeout=120)
+inicio = time.perf_counter()
+at.run()
+segundos = time.perf_counter() - inicio
+print(json.dumps({{
+    "segundos": segundos,
+    "excepciones": len(at.exception),
+    "cargados": [m for m in {diferidos!r} if m in sys.modules],
+}}))
+"""
+
+def _medir_en_proceso_nuevo(codigo):
+    """Ejecuta codigo en un intérprete nuevo (sin módulos en memoria) y devuelve su última línea JSON."""
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=DIRECTORIO_APP,
+                            capture_output=True, text=True, check=True)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+def benchmark_arranque(repeticiones, presupuesto):
+    """
+    Tiempo de arranque de la app, siempre en procesos nuevos: importación de
+    cada módulo por separado y primer render de main.py (la página de carga de
+    datos) con streamlit.testing, que incluye importar todo lo que main.py
+    importa al principio. Falla si la mediana del primer render supera el
+    presupuesto, si el render lanza excepciones o si carga alguna de las
+    dependencias pesadas que sólo deben importarse al usarse (MODULOS_DIFERIDOS).
+    """
+    print(f"Importación en un proceso nuevo ({repeticiones} repeticiones):")
+    print(f"{'módulo':>14} {'p50 (s)':>8} {'mín (s)':>8}")
+    for modulo in MODULOS_APP:
+        tiempos = [_medir_en_proceso_nuevo(_CODIGO_IMPORTACION.format(modulo=modulo))["segundos"]
+                   for _ in range(repeticiones)]
+        print(f"{modulo:>14} {_percentil(tiempos, 50):>8.3f} {min(tiempos):>8.3f}")
+
+    codigo = _CODIGO_PRIMER_RENDER.format(diferidos=MODULOS_DIFERIDOS)
+    medidas = [_medir_en_proceso_nuevo(codigo) for _ in range(repeticiones)]
+    tiempos = [m["segundos"] for m in medidas]
+    mediana = _percentil(tiempos, 50)
+    cargados = sorted({modulo for m in medidas for modulo in m["cargados"]})
+    excepciones = max(m["excepciones"] for m in medidas)
+    print(f"\nPrimer render de main.py: p50 {mediana:.3f} s, mín {min(tiempos):.3f} s, "
+          f"máx {max(tiempos):.3f} s (presupuesto {presupuesto:.3f} s).")
+    print(f"Dependencias diferidas cargadas en el primer render: {', '.join(cargados) or 'ninguna'}.")
+
+    errores = []
+    if mediana > presupuesto:
+        errores.append(f"el primer render tarda {mediana:.3f} s (presupuesto {presupuesto:.3f} s)")
+    if cargados:
+        errores.append(f"el primer render importa {', '.join(cargados)}")
+    if excepciones:
+        errores.append(f"el primer render lanza {excepciones} excepciones")
+    if errores:
+        raise SystemExit("Arranque fuera de presupuesto: " + "; ".join(errores) + ".")
+
+# ==========================
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de Reporte Running")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_clustering = sub.add_parser("clustering", help="Barrido de k completo vs. modo de gran volumen")
+    p_clustering.add_argument("--tamanos", type=int, nargs="+", default=[100, 500, 1000, 2000, 3000, 5000])
+    p_clustering.add_argument("--repeticiones", type=int, default=1)
+
+    p_ia = sub.add_parser("ia", help="Latencia de las consultas IA con el backend stub y usuarios concurrentes")
+    p_ia.add_argument("--usuarios", type=int, nargs="+", default=[1, 4, 16])
+    p_ia.add_argument("--consultas", type=int, default=64)
+    p_ia.add_argument("--latencia", type=float, default=0.5, help="Segundos hasta el primer fragmento del stub")
+    p_ia.add_argument("--sesiones", type=int, default=1000)
+
+    p_cuota = sub.add_parser("cuota", help="Reservas concurrentes del límite diario de consultas IA")
+    p_cuota.add_argument("--hilos", type=int, default=16)
+    p_cuota.add_argument("--intentos", type=int, default=2000)
+    p_cuota.add_argument("--limite", type=int, default=3)
+
+    p_arranque = sub.add_parser("arranque", help="Importación y primer render de la app, con presupuesto")
+    p_arranque.add_argument("--repeticiones", type=int, default=5)
+    p_arranque.add_argument("--presupuesto", type=float, default=PRESUPUESTO_PRIMER_RENDER_S,
+                            help="Mediana máxima del primer render en segundos")
+
+    args = parser.parse_args()
+    if args.comando == "clustering":
+        benchmark_clustering(args.tamanos, args.repeticiones)
+    elif args.comando == "ia":
+        benchmark_ia(args.usuarios, args.consultas, args.latencia, args.sesiones)
+    elif args.comando == "cuota":
+        benchmark_cuota(args.hilos, args.intentos, args.limite)
+    elif args.comando == "arranque":
+        benchmark_arranque(args.repeticiones, args.presupuesto)
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@ import zipfile, io, json, pytz
 import pandas as pd
 
 from datetime import datetime, timedelta
-from timezonefinder import TimezoneFinder
+from metricas import calcular_gap
+from memoria import memorizar
 
 # ==========================
 def es_sesion_constante(df_granular, umbral_segundos=16, tolerancia_pct=5):
@@ -53,8 +54,8 @@ def leer_json_granular(data_json, id_sesion=None):
     return df_granular
 
 # ==========================
-def filtrar_archivos_json_ultimos_12_meses(nombres_archivos):
-    hoy = datetime.now()
+def filtrar_archivos_json_ultimos_12_meses(nombres_archivos, hoy=None):
+    hoy = hoy or datetime.now()
     limite = hoy - timedelta(days=365)
     archivos_filtrados = []
     eliminados = 0
@@ -76,10 +77,10 @@ def leer_datos_zip_filtrado_pausas_unificado(origen_zip):
     """
     Lee un ZIP con JSON de sesiones de running.
     Mantiene timestamps en UTC hasta después del filtro de constancia.
+    El procesado se memoriza por contenido del ZIP (y día), así que la misma
+    subida, venga de donde venga, sólo se procesa una vez.
     """
 
-    tf = TimezoneFinder()
-
     # Detectar si origen_zip es URL de Google Drive
     if isinstance(origen_zip, str) and origen_zip.startswith("http"):
         import re
@@ -93,21 +94,36 @@ def leer_datos_zip_filtrado_pausas_unificado(origen_zip):
         url_descarga = f"https://drive.google.com/uc?export=download&id={id_archivo}"
         res = requests.get(url_descarga)
         res.raise_for_status()
-        archivo_zip = zipfile.ZipFile(io.BytesIO(res.content))
+        contenido = res.content
     elif isinstance(origen_zip, io.BytesIO):
-        archivo_zip = zipfile.ZipFile(origen_zip)
+        contenido = origen_zip.getvalue()
     elif isinstance(origen_zip, str):
         # Ruta local
         with open(origen_zip, "rb") as f:
-            archivo_zip = zipfile.ZipFile(io.BytesIO(f.read()))
+            contenido = f.read()
     else:
         raise TypeError("El parámetro debe ser una URL de Google Drive, ruta local o BytesIO.")
 
-    # Resto del código original sin cambios...
+    (df_total, df_granular_total, procesados,
+     eliminados_fecha, eliminados_constancia, eliminados_distancia) = _procesar_zip(contenido, datetime.now().date())
+    archivo_zip = zipfile.ZipFile(io.BytesIO(contenido))
+
+    return df_total, df_granular_total, archivo_zip, procesados, eliminados_fecha, eliminados_constancia, eliminados_distancia
+
+@memorizar
+def _procesar_zip(contenido, dia):
+    """Procesa los bytes del ZIP; dia fija la ventana de 12 meses (y forma parte de la clave)."""
+    from timezonefinder import TimezoneFinder
+
+    tf = TimezoneFinder()
+    archivo_zip = zipfile.ZipFile(io.BytesIO(contenido))
+
     archivos_json = [n for n in archivo_zip.namelist()
                      if "/GPS-data/" in n and n.lower().endswith(".json")]
 
-    archivos_validos, eliminados_fecha = filtrar_archivos_json_ultimos_12_meses(archivos_json)
+    archivos_validos, eliminados_fecha = filtrar_archivos_json_ultimos_12_meses(
+        archivos_json, datetime.combine(dia, datetime.now().time())
+    )
 
     dfs = []
     df_granular_sessions = []
@@ -167,9 +183,10 @@ def leer_datos_zip_filtrado_pausas_unificado(origen_zip):
     df_granular_total = pd.concat(df_granular_sessions, ignore_index=True)
     procesados = len(archivos_validos) - eliminados_constancia - eliminados_distancia
 
-    return df_total, df_granular_total, archivo_zip, procesados, eliminados_fecha, eliminados_constancia, eliminados_distancia
+    return df_total, df_granular_total, procesados, eliminados_fecha, eliminados_constancia, eliminados_distancia
 
 # ==========================
+@memorizar
 def obtener_sesiones(df_granular):
     """
     Construye el DataFrame de sesiones resumidas a partir de df_granular.
@@ -208,6 +225,9 @@ def obtener_sesiones(df_granular):
 
     df_sesion = pd.DataFrame(df_sesion_list)
 
+    # Ritmo ajustado por pendiente (GAP), calculado en una sola pasada sobre df_granular
+    _, _, df_sesion_gap = calcular_gap(df_granular)
+    df_sesion = df_sesion.merge(df_sesion_gap, on="archivo", how="left")
     
     # ============================================================
     # Filtrar por distancias objetivo con tolerancia del 10%
@@ -0,0 +1,293 @@
+"""
+Procesado por lotes, sin Streamlit, de un directorio de exportaciones ZIP.
+
+Para cada atleta (un ZIP) ejecuta lo mismo que la app: ingesta y filtrado
+(file_io), sesiones, tipos de sesión (clustering), predicciones y el reporte
+HTML (reporte.construir_reporte). Los atletas se reparten entre procesos.
+
+Cada atleta deja en <salida>/<nombre del ZIP>/ su reporte.html, sesiones.csv,
+modelo_clusters.json y resumen.json. El modelo de clusters se carga en cada
+ejecución y sólo se reajusta si hay deriva, así que los tipos de sesión de un
+atleta se mantienen de una noche a otra. resumen.json se escribe el último y
+guarda el tamaño y la fecha de modificación del ZIP y las opciones, así que al
+relanzar tras una interrupción se saltan los atletas ya terminados (salvo que
+su ZIP o las opciones hayan cambiado). El rendimiento de cada ejecución queda
+en <salida>/resumen_lote.json.
+
+Uso:
+    python lote.py <directorio_zips> [--salida reportes_lote] [--procesos 4]
+                   [--gap] [--sin-conexion] [--rehacer]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import signal
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import numpy as np
+
+FEATURES_LOTE = ["distancia", "ritmo"]
+
+ARCHIVO_RESUMEN_ATLETA = "resumen.json"
+ARCHIVO_MODELO_CLUSTERS = "modelo_clusters.json"
+ARCHIVO_RESUMEN_LOTE = "resumen_lote.json"
+
+# ==========================
+def _escribir_atomico(ruta, datos):
+    """Escribe bytes en un temporal y lo renombra: un archivo a medias nunca queda con su nombre final."""
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+def _origen(ruta_zip):
+    """Tamaño y fecha de modificación del ZIP, para saber si un resultado guardado sigue valiendo."""
+    info = os.stat(ruta_zip)
+    return {"archivo": os.path.basename(ruta_zip), "bytes": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+def _dir_atleta(dir_salida, ruta_zip):
+    return os.path.join(dir_salida, os.path.splitext(os.path.basename(ruta_zip))[0])
+
+def atleta_terminado(ruta_zip, dir_atleta, opciones):
+    """True si dir_atleta tiene un resumen.json completo generado a partir de este mismo ZIP y con las mismas opciones."""
+    try:
+        with open(os.path.join(dir_atleta, ARCHIVO_RESUMEN_ATLETA), encoding="utf-8") as f:
+            guardado = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return guardado.get("origen") == _origen(ruta_zip) and guardado.get("opciones") == opciones
+
+# ==========================
+def _iniciar_proceso():
+    """Inicializador de cada proceso del pool."""
+    from streamlit.logger import set_log_level
+    from threadpoolctl import threadpool_limits
+
+    # Ctrl+C lo gestiona el proceso principal, que deja terminar a los atletas en curso
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_log_level(logging.ERROR)  # avisos de Streamlit fuera de `streamlit run`
+    # Un hilo de BLAS/OpenMP por proceso: el paralelismo está en el pool
+    threadpool_limits(1)
+
+def procesar_atleta(ruta_zip, dir_salida, usar_gap=False, sin_conexion=False):
+    """
+    Ejecuta el análisis completo de un ZIP y escribe sus resultados.
+    Fuera de `streamlit run` st.session_state es un diccionario vacío que no
+    guarda nada, así que las funciones de las vistas (solo_objeto=True) no
+    comparten estado entre atletas del mismo proceso.
+    Devuelve un diccionario con el estado, los volúmenes y los tiempos por etapa.
+    """
+    from file_io import leer_datos_zip_filtrado_pausas_unificado, obtener_sesiones
+    from memoria import limpiar_memoria
+    from metricas import (
+        PREDICCIONES_CARRERA, calcular_features_sesion, construir_cubo_temporal, remuestrear_sesiones
+    )
+    from reporte import construir_reporte
+    from visualization import COLORES_PREDICCION, tab_clustering, tab_kilometros_por_mes, tab_prediccion
+
+    dir_atleta = _dir_atleta(dir_salida, ruta_zip)
+    atleta = os.path.basename(dir_atleta)
+    etapas = {}
+    inicio = time.perf_counter()
+
+    def _etapa(nombre, desde):
+        etapas[nombre] = round(time.perf_counter() - desde, 3)
+        return time.perf_counter()
+
+    try:
+        origen = _origen(ruta_zip)
+        t = time.perf_counter()
+        with open(ruta_zip, "rb") as f:
+            contenido = io.BytesIO(f.read())
+        (_, df_granular, _, procesados,
+         eliminados_fecha, eliminados_constancia, eliminados_distancia) = \
+            leer_datos_zip_filtrado_pausas_unificado(contenido)
+        t = _etapa("ingesta", t)
+
+        sesiones = obtener_sesiones(df_granular)
+        df_sesion = sesiones[0]
+        t = _etapa("sesiones", t)
+
+        os.makedirs(dir_atleta, exist_ok=True)
+        # Una sola rejilla para las features y los ritmos por km de las predicciones, como en la app
+        rejilla = remuestrear_sesiones(df_granular)
+        df_features = calcular_features_sesion(df_granular, df_sesion, rejilla)
+        # Barrido de k secuencial: el paralelismo está en el pool de procesos
+        tipos_sesion = tab_clustering(df_sesion, solo_objeto=True, usar_gap=usar_gap,
+                                      features=FEATURES_LOTE, df_features=df_features,
+                                      ruta_modelo=os.path.join(dir_atleta, ARCHIVO_MODELO_CLUSTERS),
+                                      hilos_kmeans=1)
+        t = _etapa("clustering", t)
+
+        predicciones = []
+        for idx, (nombre, posicion, dist) in enumerate(PREDICCIONES_CARRERA):
+            if sesiones[posicion].empty:
+                continue
+            grafico, _, resumen = tab_prediccion(
+                sesiones[posicion], dist, df_granular,
+                color_principal=COLORES_PREDICCION[idx % len(COLORES_PREDICCION)], usar_gap=usar_gap,
+                rejilla=rejilla
+            )
+            predicciones.append((nombre, grafico, resumen))
+        t = _etapa("predicciones", t)
+
+        cubo = construir_cubo_temporal(df_sesion)
+        html, n_figuras, _ = construir_reporte(
+            tipos_sesion,
+            tab_kilometros_por_mes(df_sesion),
+            predicciones,
+            cubo["mes"][cubo["mes"]["sesiones"] > 0].sort_values("periodo", ascending=False),
+            sin_conexion=sin_conexion
+        )
+        t = _etapa("reporte", t)
+
+        _escribir_atomico(os.path.join(dir_atleta, "reporte.html"), html)
+        _escribir_atomico(os.path.join(dir_atleta, "sesiones.csv"),
+                          df_sesion.to_csv(index=False).encode("utf-8"))
+        tarjetas = tipos_sesion[1]
+        resumen = {
+            "atleta": atleta,
+            "origen": origen,
+            "opciones": {"gap": usar_gap, "sin_conexion": sin_conexion},
+            "generado": datetime.now().isoformat(timespec="seconds"),
+            "sesiones": len(df_sesion),
+            "puntos_gps": len(df_granular),
+            "procesados": int(procesados),
+            "eliminados": {
+                "fecha": int(eliminados_fecha),
+                "constancia": int(eliminados_constancia),
+                "distancia": int(eliminados_distancia),
+            },
+            "tipos_sesion": {} if tarjetas is None else
+                {fila.tipo_sesion: int(fila.cantidad_sesiones) for fila in tarjetas.itertuples()},
+            "predicciones": {nombre: texto for nombre, _, texto in predicciones},
+            "figuras": n_figuras,
+            "etapas_s": etapas,
+        }
+        _escribir_atomico(os.path.join(dir_atleta, ARCHIVO_RESUMEN_ATLETA),
+                          json.dumps(resumen, ensure_ascii=False, indent=2).encode("utf-8"))
+        _etapa("escritura", t)
+        return {"atleta": atleta, "estado": "ok", "sesiones": resumen["sesiones"],
+                "puntos_gps": resumen["puntos_gps"], "bytes_zip": origen["bytes"],
+                "segundos": round(time.perf_counter() - inicio, 3), "etapas_s": etapas}
+    except Exception as e:
+        return {"atleta": atleta, "estado": "error", "error": f"{type(e).__name__}: {e}",
+                "traza": traceback.format_exc(), "segundos": round(time.perf_counter() - inicio, 3)}
+    finally:
+        # En el lote cada atleta es distinto: no tiene sentido conservar sus resultados en caché
+        limpiar_memoria()
+
+# ==========================
+def resumir_lote(resultados, saltados, procesos, segundos, interrumpido):
+    """Rendimiento de la ejecución: atletas, sesiones y puntos GPS por unidad de tiempo, y tiempos por etapa."""
+    correctos = [r for r in resultados if r["estado"] == "ok"]
+    por_atleta = [r["segundos"] for r in correctos]
+    sesiones = sum(r["sesiones"] for r in correctos)
+    puntos = sum(r["puntos_gps"] for r in correctos)
+    etapas = {}
+    for r in correctos:
+        for nombre, s in r["etapas_s"].items():
+            etapas[nombre] = etapas.get(nombre, 0.0) + s
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "procesos": procesos,
+        "interrumpido": interrumpido,
+        "atletas_procesados": len(correctos),
+        "atletas_saltados": saltados,
+        "atletas_con_error": len(resultados) - len(correctos),
+        "segundos": round(segundos, 2),
+        "atletas_por_minuto": round(60 * len(correctos) / segundos, 2) if segundos else None,
+        "sesiones_por_segundo": round(sesiones / segundos, 1) if segundos else None,
+        "puntos_gps_por_segundo": round(puntos / segundos) if segundos else None,
+        "segundos_por_atleta": {
+            "p50": round(float(np.percentile(por_atleta, 50)), 2) if por_atleta else None,
+            "p95": round(float(np.percentile(por_atleta, 95)), 2) if por_atleta else None,
+            "max": round(max(por_atleta), 2) if por_atleta else None,
+        },
+        "segundos_por_etapa": {nombre: round(s, 2) for nombre, s in etapas.items()},
+        "errores": {r["atleta"]: r["error"] for r in resultados if r["estado"] != "ok"},
+    }
+
+def procesar_directorio(dir_zips, dir_salida, procesos=None, usar_gap=False, sin_conexion=False, rehacer=False):
+    """
+    Procesa todos los ZIP de dir_zips en un pool de procesos y devuelve el
+    resumen del lote (que también se guarda en dir_salida/resumen_lote.json).
+    Los ZIP más grandes se lanzan primero para que al final no queden
+    procesos ociosos esperando al atleta más largo.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    rutas = sorted(os.path.join(dir_zips, n) for n in os.listdir(dir_zips) if n.lower().endswith(".zip"))
+    opciones = {"gap": usar_gap, "sin_conexion": sin_conexion}
+    pendientes = [r for r in rutas if rehacer or not atleta_terminado(r, _dir_atleta(dir_salida, r), opciones)]
+    pendientes.sort(key=os.path.getsize, reverse=True)
+    saltados = len(rutas) - len(pendientes)
+    os.makedirs(dir_salida, exist_ok=True)
+    print(f"{len(rutas)} ZIP en {dir_zips}: {saltados} ya procesados, {len(pendientes)} pendientes, "
+          f"{procesos} procesos.")
+
+    resultados = []
+    interrumpido = False
+    inicio = time.perf_counter()
+
+    def _anotar(r):
+        resultados.append(r)
+        if r["estado"] == "ok":
+            print(f"[{len(resultados)}/{len(pendientes)}] {r['atleta']}: {r['sesiones']} sesiones "
+                  f"en {r['segundos']:.1f} s")
+        else:
+            print(f"[{len(resultados)}/{len(pendientes)}] {r['atleta']}: ERROR {r['error']}")
+
+    # Como mucho un atleta en curso por proceso: al interrumpir sólo se esperan esos
+    cola = list(pendientes)
+    en_curso = set()
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso) as ejecutor:
+        try:
+            while cola or en_curso:
+                while cola and len(en_curso) < procesos:
+                    en_curso.add(ejecutor.submit(procesar_atleta, cola.pop(0), dir_salida, usar_gap, sin_conexion))
+                hechos, en_curso = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    _anotar(futuro.result())
+        except KeyboardInterrupt:
+            interrumpido = True
+            print(f"\nInterrumpido: se terminan los {len(en_curso)} atletas en curso; "
+                  f"los {len(cola)} restantes quedan para la próxima ejecución.")
+            for futuro in en_curso:
+                _anotar(futuro.result())
+
+    resumen = resumir_lote(resultados, saltados, procesos, time.perf_counter() - inicio, interrumpido)
+    _escribir_atomico(os.path.join(dir_salida, ARCHIVO_RESUMEN_LOTE),
+                      json.dumps(resumen, ensure_ascii=False, indent=2).encode("utf-8"))
+    return resumen
+
+# ==========================
+def main():
+    parser = argparse.ArgumentParser(description="Reporte Running por lotes (sin Streamlit)")
+    parser.add_argument("directorio", help="Directorio con un ZIP de Adidas Running/Runtastic por atleta")
+    parser.add_argument("--salida", default="reportes_lote", help="Directorio de resultados")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos en paralelo (por defecto, nº de CPUs)")
+    parser.add_argument("--gap", action="store_true", help="Usar ritmo ajustado por pendiente (GAP)")
+    parser.add_argument("--sin-conexion", action="store_true",
+                        help="Incrustar BokehJS en los reportes para verlos sin conexión")
+    parser.add_argument("--rehacer", action="store_true", help="Volver a procesar también los atletas ya terminados")
+    args = parser.parse_args()
+
+    resumen = procesar_directorio(args.directorio, args.salida, args.procesos, args.gap,
+                                  args.sin_conexion, args.rehacer)
+    print(f"\n{resumen['atletas_procesados']} atletas en {resumen['segundos']:.1f} s "
+          f"({resumen['atletas_por_minuto']} atletas/min, {resumen['sesiones_por_segundo']} sesiones/s, "
+          f"{resumen['puntos_gps_por_segundo']} puntos GPS/s); {resumen['atletas_saltados']} saltados, "
+          f"{resumen['atletas_con_error']} con error.")
+    print(f"Resumen en {os.path.join(args.salida, ARCHIVO_RESUMEN_LOTE)}")
+    if resumen["interrumpido"]:
+        raise SystemExit(130)
+    if resumen["atletas_con_error"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
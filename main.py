@@ -1,86 +1,164 @@
 import streamlit as st
-import pandas as pd
 import io
-from bokeh.embed import file_html
-from bokeh.resources import CDN
-
-from visualization import (
-    tab_clustering,
-    tab_kilometros_por_mes,
-    tab_prediccion,
-    mostrar_tabla_resumen_con_expansion,
-)
+from concurrent.futures import TimeoutError as TiempoAgotado
 
 from file_io import (
     leer_datos_zip_filtrado_pausas_unificado,
     obtener_sesiones
 )
 
+from metricas import (
+    FEATURES_SESION,
+    LIMITES_ZONAS_RITMO,
+    PREDICCIONES_CARRERA,
+    remuestrear_sesiones,
+    matriz_splits,
+    calcular_features_sesion,
+    tiempo_en_zonas,
+    formatear_limites_zonas,
+    parsear_limites_zonas,
+    construir_cubo_temporal
+)
+
 from analisis_ia import tab_analisis_ia
 
-# ========================
-# Íconos SVG para el reporte
-ICONO_REPORTE = (
-    '<svg xmlns="http://www.w3.org/2000/svg" height="44px" '
-    'viewBox="0 -960 960 960" width="44px" fill="#222222" '
-    'style="vertical-align:middle;margin-right:10px;">'
-    '<path d="M680-330q-50 0-85-35t-35-85q0-50 35-85t85-35q50 0 85 35t35 85q0 50-35 85t-85 35Zm0-60q25.5 0 42.75-17.25T740-450q0-25.5-17.25-42.75T680-510q-25.5 0-42.75 17.25T620-450q0 25.5 17.25 42.75T680-390ZM440-50v-116q0-21 10-39.5t28-29.5q28-17 58-29.5t62-20.5l82 106 82-106q32 8 61.5 20.5T881-235q18 11 28.5 29.5T920-166v116H440Zm60-60h157l-82-106q-20 8-39 17.5T500-178v68Zm203 0h157v-68q-17-11-35.5-20.5T786-216l-83 106Zm-46 0Zm46 0Zm-523-10q-24.75 0-42.37-17.63Q120-155.25 120-180v-600q0-24.75 17.63-42.38Q155.25-840 180-840h600q24.75 0 42.38 17.62Q840-804.75 840-780v247q-11-20-26-37t-34-30v-180H180v600h200v60H180Zm100-500h341q14-5 28.84-7.5T680-630v-50H280v60Zm0 170h220q0-15 2.5-30.5T510-510H280v60Zm0 170h158q17-13 36-21.5t39-16.5v-22H280v60ZM180-180v-600 180-30 450Zm500-270Z"/>'
-    '</svg>'
+from reporte import (
+    ICONO_REPORTE,
+    ICONO_DISTANCIA,
+    ICONO_CLUSTER,
+    ICONO_PREDICCION,
+    ICONO_CALENDARIO,
+    ICONO_IA,
+    LOCK_BOKEH,
+    lanzar_reporte
 )
 
-ICONO_SESION = (
-    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" viewBox="0 -960 960 960" '
-    'width="40px" fill="#264653">'
-    '<path d="M320-360h66.67v-126.67H556v90L680-520 556-644v90.67H353.33q-14.16 0-23.75 9.58Q320-534.17 320-520v160ZM479.97-78Q467-78 454.5-82.67q-12.5-4.66-21.83-14l-336-336q-9.34-9.33-14-21.86Q78-467.07 78-480.03q0-12.97 4.67-25.47 4.66-12.5 14-21.83l336-336q9.33-9.34 21.86-14 12.54-4.67 25.5-4.67 12.97 0 25.47 4.67 12.5 4.66 21.83 14l336 336q9.34 9.33 14 21.86 4.67 12.54 4.67 25.5 0 12.97-4.67 25.47-4.66 12.5-14 21.83l-336 336q-9.33 9.34-21.86 14Q492.93-78 479.97-78ZM312-312l168 168 336-336-336-336-336 336 168 168Zm168-168Z"/>'
-    '</svg>'
-)
+# Espera máxima del rerun del botón por el reporte; si se pasa, se muestra en el siguiente rerun
+ESPERA_MAX_REPORTE_S = 60
 
-ICONO_DISTANCIA = (
-    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
-    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
-    'style="vertical-align:middle;margin-right:8px;">'
-    '<path d="M653.33-160v-280H800v280H653.33Zm-246.66 0v-640h146.66v640H406.67ZM160-160v-440h146.67v440H160Z"/>'
-    '</svg>'
-)
+# ===========================
+# Cálculos bajo demanda
+# Sólo se calcula la vista abierta (o lo que pidan el reporte y la IA). Cada
+# resultado se guarda en st.session_state["vistas"] bajo una clave con sus
+# entradas, así los reruns por otros widgets lo reutilizan sin recalcular.
+
+# Claves de session_state de los DataFrames que devuelve obtener_sesiones, en su orden
+CLAVES_SESIONES = ['df_sesion', 'df_5k', 'df_10k', 'df_21k', 'df_42k']
+
+CLAVES_DERIVADAS = [
+    *CLAVES_SESIONES, 'rejilla', 'splits', 'df_features',
+    'zonas', 'zonas_limites', 'vistas', 'reporte_futuro',
+    'resumen_clusters', 'resumen_km', 'resumen_zonas', 'resumen_prediccion'
+]
+
+def invalidar_calculos():
+    """Borra todo lo calculado a partir de una carga de datos anterior."""
+    for clave in CLAVES_DERIVADAS:
+        st.session_state.pop(clave, None)
+
+def calcular_vista(clave, funcion, *args, **kwargs):
+    """Devuelve el resultado guardado para clave o lo calcula con funcion(*args, **kwargs)."""
+    vistas = st.session_state.setdefault('vistas', {})
+    if clave not in vistas:
+        vistas[clave] = funcion(*args, **kwargs)
+    return vistas[clave]
+
+def obtener_sesiones_cargadas():
+    """obtener_sesiones una sola vez por carga de datos."""
+    if 'df_sesion' not in st.session_state:
+        st.session_state.update(zip(CLAVES_SESIONES, obtener_sesiones(st.session_state['df_granular'])))
+    return st.session_state['df_sesion']
+
+def obtener_rejilla():
+    """Rejilla de distancia remuestreada (metricas.remuestrear_sesiones)."""
+    if 'rejilla' not in st.session_state:
+        st.session_state['rejilla'] = remuestrear_sesiones(st.session_state['df_granular'])
+    return st.session_state['rejilla']
+
+def obtener_splits():
+    """Matriz de splits sesión × km, construida a partir de la rejilla."""
+    if 'splits' not in st.session_state:
+        st.session_state['splits'] = matriz_splits(rejilla=obtener_rejilla())
+    return st.session_state['splits']
+
+def obtener_features():
+    """Features por sesión para el clustering."""
+    if 'df_features' not in st.session_state:
+        st.session_state['df_features'] = calcular_features_sesion(
+            st.session_state['df_granular'], st.session_state['df_sesion'], obtener_rejilla()
+        )
+    return st.session_state['df_features']
+
+def obtener_zonas(limites_zonas):
+    """Tiempo en zonas; sólo se recalcula si cambian los límites."""
+    if st.session_state.get('zonas_limites') != limites_zonas:
+        st.session_state['zonas'] = tiempo_en_zonas(st.session_state['df_granular'], limites_zonas)
+        st.session_state['zonas_limites'] = limites_zonas
+    return st.session_state['zonas']
+
+def vista_prediccion(df_pred, dist, color, usar_gap):
+    """
+    tab_prediccion más el resumen para el contexto IA que deja en
+    st.session_state["resumen_prediccion"], para poder restaurarlo desde la caché.
+    """
+    grafico1, grafico2, resumen = tab_prediccion(
+        df_pred, dist, st.session_state['df_granular'], color_principal=color,
+        usar_gap=usar_gap, rejilla=obtener_rejilla()
+    )
+    return grafico1, grafico2, resumen, st.session_state.get('resumen_prediccion')
 
-ICONO_CLUSTER = (
-    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
-    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
-    'style="vertical-align:middle;margin-right:8px;">'
-    '<path d="m260.67-524 220-356 220 356h-440Z'
-    'M704-80q-74.33 0-125.17-50.83Q528-181.67 528-256t50.83-125.17Q629.67-432 704-432t125.17 50.83Q880-330.33 880-256t-50.83 125.17Q778.33-80 704-80Z'
-    'm-584-23.33v-309.34h309.33v309.34H120Z'
-    'm584.06-43.34q45.94 0 77.61-31.72 31.66-31.72 31.66-77.67 0-45.94-31.72-77.61-31.72-31.66-77.67-31.66-45.94 0-77.61 31.72-31.66 31.72-31.66 77.67 0 45.94 31.72 77.61 31.72 31.66 77.67 31.66Z'
-    'M186.67-170h176v-176h-176v176Z'
-    'M380-590.67h201.33L480.67-753.33 380-590.67Z"/>'
-    '</svg>'
-)
+def obtener_prediccion(idx, df_pred, dist, usar_gap):
+    color = COLORES_PREDICCION[idx % len(COLORES_PREDICCION)]
+    return calcular_vista(('prediccion', dist, usar_gap), vista_prediccion, df_pred, dist, color, usar_gap)
 
-ICONO_PREDICCION = (
-    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
-    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
-    'style="vertical-align:middle;margin-right:8px;">'
-    '<path d="M360-853.33V-920h240v66.67H360ZM480-80.67q-74 0-139.5-28.5T226-186.67q-49-49-77.5-114.5T120-440.67q0-74 28.5-139.5t77.5-114.5q49-49 114.5-77.5t139.5-28.5q65.33 0 123.67 21.67 58.33 21.67 105.66 61L762-770.67 808.67-724 756-671.33Q792.67-628 816.33-571 840-514 840-440.67q0 74-28.5 139.5T734-186.67q-49 49-114.5 77.5T480-80.67Zm0-66.66q122 0 207.67-85.67 85.66-85.67 85.66-207.67 0-122-85.66-207.66Q602-734 480-734q-122 0-207.67 85.67-85.66 85.66-85.66 207.66T272.33-233Q358-147.33 480-147.33ZM480-440Zm-75.33 151.33L632-441.33l-227.33-152v304.66Z"/>'
-    '</svg>'
-)
+def obtener_clustering(df_sesion, usar_gap, features):
+    """Clustering sin pintar (gráfico, tarjetas y colores) para el reporte y la IA."""
+    return calcular_vista(
+        ('clustering', usar_gap, tuple(features)), tab_clustering,
+        df_sesion, solo_objeto=True, usar_gap=usar_gap, features=features, df_features=obtener_features()
+    )
 
-# ==== ICONOS GLOBALES ====
-ICONO_CALENDARIO = (
-    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
-    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
-    'style="vertical-align:middle;margin-right:8px;">'
-    '<path d="M240-280h240v-80H240v80Zm120-160h240v-80H360v80Zm120-160h240v-80H480v80ZM200-120q-33 '
-    '0-56.5-23.5T120-200v-560q0-33 23.5-56.5T200-840h560q33 0 '
-    '56.5 23.5T840-760v560q0 33-23.5 56.5T760-120H200Zm0-80h560v-560H200v560Zm0-560v560-560Z"/>'
-    '</svg>'
-)
+def obtener_grafico_km(df_sesion):
+    return calcular_vista(('kilometros',), tab_kilometros_por_mes, df_sesion)
+
+def mostrar_figura(figura):
+    """st.bokeh_chart para figuras que también usa el reporte (que las serializa en otro hilo)."""
+    with LOCK_BOKEH:
+        st.bokeh_chart(figura, use_container_width=True)
+
+def solicitar_reporte(df_sesion, predicciones, usar_gap, features, sin_conexion):
+    """
+    Callback del botón de reporte: reúne figuras y resúmenes ya calculados por
+    las vistas (los calcula sólo si faltan) y lanza la generación en segundo plano.
+    """
+    cubo = construir_cubo_temporal(df_sesion)
+    predicciones_reporte = []
+    for idx, (nombre, df_pred, dist) in enumerate(predicciones):
+        grafico1, _, resumen, _ = obtener_prediccion(idx, df_pred, dist, usar_gap)
+        predicciones_reporte.append((nombre, grafico1, resumen))
+
+    st.session_state['reporte_futuro'] = lanzar_reporte(
+        obtener_clustering(df_sesion, usar_gap, features),
+        obtener_grafico_km(df_sesion),
+        predicciones_reporte,
+        cubo["mes"][cubo["mes"]["sesiones"] > 0].sort_values("periodo", ascending=False),
+        sin_conexion=sin_conexion
+    )
 
-ICONO_IA = (
-    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" viewBox="0 -960 960 960" width="40px" fill="#264653" '
-    'style="vertical-align:middle;margin-right:8px;">'
-    '<path d="M319-160q-9 0-16.83-4.5Q294.33-169 290-177l-82-146.33h66.67l41.33 80h90.67v-33.34H336l-41.33-80H190l-61-106.66q-2-4.34-3.17-8.34-1.16-4-1.16-8.33 0-2.67 4.33-16.67l61-106.66h104.67l41.33-80h70.67v-33.34H316l-41.33 80H208L290-783q4.33-8 12.17-12.5Q310-800 319-800h111q14.33 0 23.83 9.5 9.5 9.5 9.5 23.83v170h-76.66l-33.34 33.34h110v126.66h-94.66l-39.34-80h-96L200-483.33h108l40 80h115.33v210q0 14.33-9.5 23.83-9.5 9.5-23.83 9.5H319Zm211 0q-14.33 0-23.83-9.5-9.5-9.5-9.5-23.83v-210H612l40-80h108l-33.33-33.34h-96l-39.34 80h-94.66v-126.66h110l-33.34-33.34h-76.66v-170q0-14.33 9.5-23.83 9.5-9.5 23.83-9.5h111q9 0 16.83 4.5Q665.67-791 670-783l82 146.33h-66.67l-41.33-80h-90.67v33.34H624l41.33 80H770l61 106.66q2 4.34 3.17 8.34 1.16 4 1.16 8.33 0 2.67-4.33 16.67l-61 106.66H665.33l-41.33 80h-70.67v33.34H644l41.33-80H752L670-177q-4.33 8-12.17 12.5Q650-160 641-160H530Z"/>'
-    '</svg>'
-)
+def preparar_contexto_ia(df_sesion, predicciones, usar_gap, features):
+    """Calcula (o recupera) los resúmenes que usa el contexto IA sin pintar las vistas."""
+    obtener_clustering(df_sesion, usar_gap, features)
+    obtener_grafico_km(df_sesion)
+    if 'resumen_zonas' not in st.session_state:
+        archivos_zonas, nombres_zonas, matriz_zonas = obtener_zonas(
+            st.session_state.get('zonas_limites', LIMITES_ZONAS_RITMO)
+        )
+        tab_zonas_ritmo(archivos_zonas, nombres_zonas, matriz_zonas, df_sesion, solo_objeto=True)
+    # Como antes con todas las pestañas, el contexto usa la predicción de mayor distancia
+    resumen_prediccion = None
+    for idx, (_, df_pred, dist) in enumerate(predicciones):
+        resumen_prediccion = obtener_prediccion(idx, df_pred, dist, usar_gap)[3]
+    st.session_state['resumen_prediccion'] = resumen_prediccion
 
 # ===========================
 
@@ -148,6 +226,7 @@ if st.session_state['mostrar_inputs']:
                  procesados, eliminados_fecha, eliminados_constancia, eliminados_distancia) = \
                     leer_datos_zip_filtrado_pausas_unificado(urlzip)
 
+                invalidar_calculos()
                 st.session_state.update({
                     'df': df,
                     'df_granular': df_granular,
@@ -171,6 +250,7 @@ if st.session_state['mostrar_inputs']:
                  procesados, eliminados_fecha, eliminados_constancia, eliminados_distancia) = \
                     leer_datos_zip_filtrado_pausas_unificado(zip_bytes)
 
+                invalidar_calculos()
                 st.session_state.update({
                     'df': df,
                     'df_granular': df_granular,
@@ -194,6 +274,7 @@ if st.session_state['mostrar_inputs']:
                 (df, df_granular, archivo_zip, pais_uso_horario,
                  procesados, eliminados_fecha, eliminados_constancia, eliminados_distancia) = \
                     leer_datos_zip_filtrado_pausas_unificado(zip_bytes)
+                invalidar_calculos()
                 st.session_state.update({
                     'df': df,
                     'df_granular': df_granular,
@@ -211,6 +292,21 @@ if st.session_state['mostrar_inputs']:
 
 # --- Mostrar resultados si los datos fueron cargados ---
 if st.session_state['datos_cargados']:
+    # Las vistas (Bokeh, scikit-learn, SciPy) sólo se importan con datos cargados:
+    # la primera página, que es sólo el formulario de carga, no paga su importación.
+    from visualization import (
+        tab_clustering,
+        tab_kilometros_por_mes,
+        tab_kilometros_por_semana,
+        tab_calendario_km,
+        tab_prediccion,
+        tab_splits,
+        tab_detalle_sesion,
+        tab_zonas_ritmo,
+        mostrar_tabla_resumen_con_expansion,
+        COLORES_PREDICCION,
+    )
+
     if st.session_state['resumen_visible']:
         st.info(f"🗑️ Sesiones descartadas por antigüedad (>12 meses): {st.session_state['eliminados_fecha']}")
         st.info(f"🗑️ Sesiones descartadas por poca distancia (<200 metros): {st.session_state['eliminados_distancia']}")
@@ -223,31 +319,36 @@ if st.session_state['datos_cargados']:
             st.rerun()
 
     else:
-        df_sesion, df_5k, df_10k, df_21k, df_42k = obtener_sesiones(st.session_state['df_granular'])
-        st.session_state.update({
-            'df_sesion': df_sesion,
-            'df_5k': df_5k,
-            'df_10k': df_10k,
-            'df_21k': df_21k,
-            'df_42k': df_42k
-        })
-
-        # --- Configurar pestañas ---
-        pred_tabs, pred_dfs, pred_distancias = [], [], []
-        if not df_5k.empty: pred_tabs.append("Predicción 5K"); pred_dfs.append(df_5k); pred_distancias.append(5.0)
-        if not df_10k.empty: pred_tabs.append("Predicción 10K"); pred_dfs.append(df_10k); pred_distancias.append(10.0)
-        if not df_21k.empty: pred_tabs.append("Media Maratón (21K)"); pred_dfs.append(df_21k); pred_distancias.append(21.0)
-        if not df_42k.empty: pred_tabs.append("Maratón (42K)"); pred_dfs.append(df_42k); pred_distancias.append(42.195)
-
-        # ======== DEFINICIÓN DE TABS ========
+        df_sesion = obtener_sesiones_cargadas()
+
+        # --- Predicciones disponibles ---
+        predicciones = [
+            (nombre, st.session_state[CLAVES_SESIONES[posicion]], dist)
+            for nombre, posicion, dist in PREDICCIONES_CARRERA
+            if not st.session_state[CLAVES_SESIONES[posicion]].empty
+        ]
+        pred_tabs = [nombre for nombre, _, _ in predicciones]
+
+        # Ritmo ajustado por pendiente (GAP) para clustering y predicciones
+        usar_gap = st.checkbox(
+            "Usar ritmo ajustado por pendiente (GAP)",
+            value=False,
+            help="Normaliza el ritmo de cada tramo según su pendiente, como si fuera terreno llano."
+        )
+
+        # Variables de clustering elegidas (se conservan aunque la vista no esté abierta)
+        features_clustering = st.session_state.get('features_clustering', ["distancia", "ritmo"])
+
+        # ======== SELECTOR DE VISTA ========
         # Orden: Tipos de sesión, Distancia recorrida, Predicción(s), Resumen
-        tab_names = [" Tipos de sesión", " Distancia recorrida"] + pred_tabs + [" Resumen", "Análisis IA"]
-        tabs = st.tabs(tab_names)
+        # Sólo se ejecuta la vista elegida (st.tabs ejecutaría todas en cada rerun).
+        tab_names = [" Tipos de sesión", " Distancia recorrida"] + pred_tabs + [" Zonas de ritmo", " Splits por km", " Detalle de sesión", " Resumen", "Análisis IA"]
+        vista = st.radio("Vista", tab_names, horizontal=True, label_visibility="collapsed", key="vista_activa")
 
         # ============================================================
-        # PESTAÑA 1: TIPOS DE SESIÓN (CLUSTERING)
+        # VISTA: TIPOS DE SESIÓN (CLUSTERING)
         # ============================================================
-        with tabs[0]:
+        if vista == tab_names[0]:
             st.markdown(
                 f"""
                 <div style='display: flex; align-items: center; gap: 8px;'>
@@ -257,12 +358,23 @@ if st.session_state['datos_cargados']:
                 """,
                 unsafe_allow_html=True
             )
-            tab_clustering(df_sesion)
+            features_por_etiqueta = {etiqueta: col for col, etiqueta in FEATURES_SESION.items()}
+            seleccion_features = st.multiselect(
+                "Variables para agrupar las sesiones",
+                options=list(features_por_etiqueta),
+                default=[FEATURES_SESION[c] for c in features_clustering if c in FEATURES_SESION]
+            )
+            features_clustering = [features_por_etiqueta[e] for e in seleccion_features] or ["distancia", "ritmo"]
+            st.session_state['features_clustering'] = features_clustering
+            tab_clustering(
+                df_sesion, usar_gap=usar_gap,
+                features=features_clustering, df_features=obtener_features()
+            )
 
         # ============================================================
-        # PESTAÑA 2: DISTANCIA RECORRIDA
+        # VISTA: DISTANCIA RECORRIDA
         # ============================================================
-        with tabs[1]:
+        elif vista == tab_names[1]:
             st.markdown(
                 f"""
                 <div style='display: flex; align-items: center; gap: 8px;'>
@@ -273,55 +385,109 @@ if st.session_state['datos_cargados']:
                 unsafe_allow_html=True
             )
 
-            grafico_km = tab_kilometros_por_mes(df_sesion)
+            grafico_km = obtener_grafico_km(df_sesion)
             if grafico_km is not None:
-                st.bokeh_chart(grafico_km, use_container_width=True)
+                mostrar_figura(grafico_km)
+
+            # Vista semanal y calendario: salen del mismo cubo temporal que el gráfico mensual
+            st.markdown("**Kilómetros por semana**")
+            st.bokeh_chart(calcular_vista(('semanas',), tab_kilometros_por_semana, df_sesion), use_container_width=True)
+            st.markdown("**Calendario de kilómetros**")
+            st.bokeh_chart(calcular_vista(('calendario',), tab_calendario_km, df_sesion), use_container_width=True)
 
         # ============================================================
-        # PESTAÑAS DE PREDICCIÓN
+        # VISTAS DE PREDICCIÓN
         # ============================================================
-        graficos_prediccion = []
-        resumenes_prediccion = []
+        elif vista in pred_tabs:
+            idx = pred_tabs.index(vista)
+            tab_name, df_pred, dist = predicciones[idx]
+            st.markdown(
+                f"""
+                <div style='display: flex; align-items: center; gap: 8px;'>
+                    {ICONO_PREDICCION}
+                    <h3 style='margin: 0; font-weight: 600; color: #264653;'>{tab_name}</h3>
+                </div>
+                """,
+                unsafe_allow_html=True
+            )
 
-        # Definir colores diferentes para cada predicción
-        colores_prediccion = ['#6A994E', '#E76F51', '#2A9D8F', '#F4A261']
+            grafico1, grafico2, resumen, _ = obtener_prediccion(idx, df_pred, dist, usar_gap)
 
-        for idx, (tab_name, df_pred, dist) in enumerate(zip(pred_tabs, pred_dfs, pred_distancias)):
-            with tabs[2 + idx]:  # <-- ajustado: índice 2 para la primera predicción
+            if resumen:
                 st.markdown(
-                    f"""
-                    <div style='display: flex; align-items: center; gap: 8px;'>
-                        {ICONO_PREDICCION}
-                        <h3 style='margin: 0; font-weight: 600; color: #264653;'>{tab_name}</h3>
-                    </div>
-                    """,
+                    f"<div style='white-space: nowrap; font-weight: bold;'>{resumen}</div>",
                     unsafe_allow_html=True
                 )
 
-                # Pasar el color correspondiente según el índice
-                color = colores_prediccion[idx % len(colores_prediccion)]
-                grafico1, grafico2, resumen = tab_prediccion(df_pred, dist, st.session_state['df_granular'], color_principal=color)
+            if grafico1 is not None:
+                mostrar_figura(grafico1)
+            if grafico2 is not None:
+                st.bokeh_chart(grafico2, use_container_width=True)
 
-                if resumen:
-                    st.markdown(
-                        f"<div style='white-space: nowrap; font-weight: bold;'>{resumen}</div>",
-                        unsafe_allow_html=True
-                    )
-                    resumenes_prediccion.append(resumen)
-                else:
-                    resumenes_prediccion.append("")
+        # ============================================================
+        # VISTA: ZONAS DE RITMO
+        # ============================================================
+        elif vista == tab_names[-5]:
+            st.markdown(
+                f"""
+                <div style='display: flex; align-items: center; gap: 8px;'>
+                    {ICONO_DISTANCIA}
+                    <h3 style='margin: 0; font-weight: 600; color: #264653;'>Zonas de ritmo</h3>
+                </div>
+                """,
+                unsafe_allow_html=True
+            )
+
+            texto_limites = st.text_input(
+                "Límites de zona (min/km, separados por comas)",
+                value=formatear_limites_zonas(st.session_state.get('zonas_limites', LIMITES_ZONAS_RITMO))
+            )
+            try:
+                limites_zonas = parsear_limites_zonas(texto_limites)
+            except ValueError as e:
+                st.warning(f"{e} Se usan las zonas por defecto.")
+                limites_zonas = LIMITES_ZONAS_RITMO
+
+            archivos_zonas, nombres_zonas, matriz_zonas = obtener_zonas(limites_zonas)
+            tab_zonas_ritmo(archivos_zonas, nombres_zonas, matriz_zonas, df_sesion)
 
-                if grafico1 is not None:
-                    st.bokeh_chart(grafico1, use_container_width=True)
-                if grafico2 is not None:
-                    st.bokeh_chart(grafico2, use_container_width=True)
+        # ============================================================
+        # VISTA: SPLITS POR KM
+        # ============================================================
+        elif vista == tab_names[-4]:
+            st.markdown(
+                f"""
+                <div style='display: flex; align-items: center; gap: 8px;'>
+                    {ICONO_DISTANCIA}
+                    <h3 style='margin: 0; font-weight: 600; color: #264653;'>Splits por km</h3>
+                </div>
+                """,
+                unsafe_allow_html=True
+            )
 
-                graficos_prediccion.append((grafico1, grafico2))
+            archivos_splits, matriz_ritmo_splits = obtener_splits()
+            tab_splits(archivos_splits, matriz_ritmo_splits)
 
         # ============================================================
-        # PESTAÑA: TABLA RESUMEN SESIONES
+        # VISTA: DETALLE DE SESIÓN
+        # ============================================================
+        elif vista == tab_names[-3]:
+            st.markdown(
+                f"""
+                <div style='display: flex; align-items: center; gap: 8px;'>
+                    {ICONO_DISTANCIA}
+                    <h3 style='margin: 0; font-weight: 600; color: #264653;'>Detalle de sesión</h3>
+                </div>
+                """,
+                unsafe_allow_html=True
+            )
+
+            tab_detalle_sesion(st.session_state['df_granular'], df_sesion)
+
         # ============================================================
-        with tabs[-2]:
+        # VISTA: TABLA RESUMEN SESIONES
+        # ============================================================
+        elif vista == tab_names[-2]:
             st.markdown(f"""
                 <div style='display: flex; align-items: center; gap: 8px;'>
                     {ICONO_CALENDARIO}
@@ -332,9 +498,9 @@ if st.session_state['datos_cargados']:
             mostrar_tabla_resumen_con_expansion(st.session_state["df_sesion"])
 
         # ============================================================
-        # PESTAÑA: ANÁLISIS IA
+        # VISTA: ANÁLISIS IA
         # ============================================================
-        with tabs[-1]:
+        else:
             st.markdown(
                 f"""
                 <div style='display: flex; align-items: center; gap: 8px;'>
@@ -345,263 +511,50 @@ if st.session_state['datos_cargados']:
                 unsafe_allow_html=True
             )
 
+            # Los resúmenes del contexto se calculan aquí si su vista no se ha abierto
+            preparar_contexto_ia(df_sesion, predicciones, usar_gap, features_clustering)
             tab_analisis_ia(df_sesion)  # Función del análisis IA que te mostré antes
 
-
         st.markdown("---")
         # ============================================================
         # BOTÓN: Generar reporte HTML
         # ============================================================
-        if st.button("Generar reporte en HTML"):
-
-            # Copia de datos base
-            df = df_sesion.copy()
-            df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
-            df['distancia'] = pd.to_numeric(df.get('distancia', 0), errors='coerce').round(2)
-            df['archivo'] = df.index.astype(str)
-            df['mes_num'] = df['fecha'].dt.month.fillna(0).astype(int)
-            df['anio'] = df['fecha'].dt.year.fillna(0).astype(int)
-
-            MES_NOMBRES = [
-                "", "enero", "febrero", "marzo", "abril", "mayo", "junio",
-                "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"
-            ]
-
-            resumen = (
-                df.groupby(['anio', 'mes_num'], dropna=False)
-                .agg(sesiones=('archivo', 'count'), distancia_total=('distancia', 'sum'))
-                .reset_index()
-                .sort_values(['anio', 'mes_num'], ascending=[False, False])
-            )
-
-            # ============================================================
-            # ESTRUCTURA DEL HTML
-            # ============================================================
-            html_reporte = """
-            <html>
-            <head>
-                <meta charset='utf-8'>
-                <title>Reporte de Running</title>
-                <style>
-                    body { font-family: Arial, sans-serif; margin: 20px; }
-                    .section { background-color: #f7f9fc; border: 1px solid #ddd; border-radius: 8px;
-                                padding: 15px 25px; margin-bottom: 20px; }
-                    h1, h2, h3, h4 { color: #2a3f66; }
-                </style>
-            </head>
-            <body>
-            """
-
-            # Título principal
-            html_reporte += f"""
-            <div style='display: flex; align-items: center; gap: 10px;'>
-                {ICONO_REPORTE}
-                <h1 style='margin: 0; font-size: 1.8rem; font-weight: 600; color: #000000;'>
-                    Reporte Running
-                </h1>
-            </div>
-            """
-
-            # ============================================================
-            # 1️⃣ Tipos de sesión
-            # ============================================================
-            html_reporte += '<div class="section">'
-            html_reporte += f"""
-            <div style='display: flex; align-items: center; gap: 8px; margin-top: 1.5em;'>
-                {ICONO_CLUSTER}
-                <h3 style='margin: 0; color: #264653; font-weight: 600;'>Tipos de sesión</h3>
-            </div>
-            """
-
+        reporte_sin_conexion = st.checkbox(
+            "Reporte sin conexión",
+            value=False,
+            help="Incluye el JavaScript de Bokeh dentro del archivo (más pesado, pero se ve sin internet)."
+        )
+        # El HTML se arma en segundo plano (reporte.py) mientras se pintan las vistas;
+        # al final de este rerun se espera una sola vez al resultado
+        st.button(
+            "Generar reporte en HTML",
+            on_click=solicitar_reporte,
+            args=(df_sesion, predicciones, usar_gap, features_clustering, reporte_sin_conexion)
+        )
+
+        futuro_reporte = st.session_state.get('reporte_futuro')
+        if futuro_reporte is not None:
             try:
-                # Obtenemos gráfico Bokeh y datos de tarjetas para HTML
-                grafico_cluster_obj, tarjetas_cluster, colores_cluster = tab_clustering(df_sesion, solo_objeto=True)
-
-                # Agregar gráfico al HTML
-                if grafico_cluster_obj is not None:
-                    html_reporte += file_html(grafico_cluster_obj, CDN, "")
-
-                # Agregar tarjetas de resumen al HTML
-                if tarjetas_cluster is not None:
-                    # Ordenar las tarjetas por distancia_media ascendente
-                    tarjetas_cluster = tarjetas_cluster.sort_values("distancia_media")
-                    # Estilo CSS inline para las tarjetas
-                    html_reporte += """
-                    <style>
-                    .sesion-card {
-                        display:flex; align-items:center; justify-content:space-between;
-                        padding:10px 14px; border-radius:12px; margin-bottom:8px;
-                        box-shadow:0 1px 3px rgba(0,0,0,0.06); /* sombra más suave */
-                    }
-                    .sesion-left { display:flex; align-items:center; gap:12px; min-width:60px; }
-                    .sesion-tipo { flex:1; font-weight:600; font-size:15px; }
-                    .sesion-info { flex:1; line-height:1.2; }
-                    .sesion-count { font-weight: normal; color:#264653; text-align:right; min-width:70px; }
-                    </style>
-                    """
-
-                    for _, fila in tarjetas_cluster.iterrows():
-                        tipo = fila["tipo_sesion"]
-                        dist = fila["distancia_media"]
-                        ritmo = fila["ritmo_medio"]
-                        count = fila["cantidad_sesiones"]
-                        # Usa el color pastel HEX por tipo
-                        color_hex = colores_cluster.get(tipo, "#E6F0FA")
-                        # Conversión HEX → RGB
-                        r, g, b = int(color_hex[1:3], 16), int(color_hex[3:5], 16), int(color_hex[5:7], 16)
-                        # Opacidad baja para efecto suave pastel
-                        bg_color = f"rgba({r},{g},{b},0.13)"
-
-                        sesion_label = "sesión" if count == 1 else "sesiones"
-                        html_reporte += f"""
-                        <div class="sesion-card" style="background-color:{bg_color}; color:#264653;">
-                            <div class="sesion-left">{ICONO_SESION}</div>
-                            <div class="sesion-tipo">{tipo}</div>
-                            <div class="sesion-info">
-                                {dist:.1f} km (distancia media)<br>
-                                {ritmo} min/km (ritmo medio)
-                            </div>
-                            <div class="sesion-count">{count} {sesion_label}</div>
-                        </div>
-                        """
-
-            except Exception as e:
-                html_reporte += f"<p>(Error al exportar gráfico y tarjetas de tipos de sesión: {e})</p>"
-
-            html_reporte += "</div>"
-
-            # ============================================================
-            # 2️⃣ Distancia recorrida
-            # ============================================================
-            html_reporte += '<div class="section">'
-            html_reporte += f"""
-            <div style='display: flex; align-items: center; gap: 8px; margin-top: 1.5em;'>
-                {ICONO_DISTANCIA}
-                <h3 style='margin: 0; color: #264653; font-weight: 600;'>Distancia recorrida</h3>
-            </div>
-            """
-            try:
-                if grafico_km is not None:
-                    html_reporte += file_html(grafico_km, CDN, "")
+                with st.spinner("⏳ Generando el reporte..."):
+                    datos_reporte, n_figuras, segundos_reporte = futuro_reporte.result(
+                        timeout=ESPERA_MAX_REPORTE_S
+                    )
+            except TiempoAgotado:
+                st.info("⏳ El reporte sigue generándose; aparecerá al volver a interactuar con la página.")
             except Exception as e:
-                html_reporte += f"<p>(Error al exportar gráfico de kilómetros: {e})</p>"
-            html_reporte += "</div>"
-
-            # ============================================================
-            # 3️⃣ Predicciones
-            # ============================================================
-            html_reporte += '<div class="section">'
-
-            # Definir colores diferentes para cada predicción
-            colores_prediccion = ['#6A994E', '#E76F51', '#2A9D8F', '#F4A261']
-
-            n_tabs = min(len(pred_tabs), len(graficos_prediccion), len(resumenes_prediccion))
-
-            for i in range(n_tabs):
-                tab_name = pred_tabs[i]
-                g1, g2 = graficos_prediccion[i]  # g1 y g2 están disponibles
-                resumen_pred = resumenes_prediccion[i]
-
-                html_reporte += f"""
-                <div style='display: flex; align-items: center; gap: 8px; margin-top: 1.5em;'>
-                    {ICONO_PREDICCION}
-                    <h3 style='margin: 0; color: #264653; font-weight: 600;'>{tab_name}</h4>
-                </div>
-                """
-
-                if resumen_pred:
-                    html_reporte += f"<p><b>{resumen_pred}</b></p>"
-
-                # Solo exportar el gráfico de predicción (g1), NO el histograma (g2)
-                if g1 is not None:
-                    try:
-                        html_reporte += file_html(g1, CDN, "")
-                    except Exception as e:
-                        html_reporte += f"<p>(Error al exportar gráfico de predicción: {e})</p>"
-                
-                # g2 (histograma) se ignora completamente en el HTML
-
-            html_reporte += "</div>"
-
-            # ============================================================
-            # 4️⃣ Resumen mensual
-            # ============================================================
-            html_reporte += '<div class="section">'
-            html_reporte += f"""
-            <div style='display: flex; align-items: center; gap: 8px; margin-top: 1.5em;'>
-                {ICONO_CALENDARIO}
-                <h3 style='margin: 0; color: #264653; font-weight: 600;'>Resumen</h3>
-            </div>
-            """
-
-            # Estilo para las tarjetas de resumen (alineación tipo “Tipos de sesión”)
-            html_reporte += """
-            <style>
-            .resumen-card {
-                display: flex;
-                align-items: center;
-                justify-content: space-between;
-                padding: 10px 14px;
-                border-radius: 12px;
-                margin-bottom: 8px;
-                box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-                background-color: #2A9D8F; /* Color de fondo unificado para todas las tarjetas */
-                color: white; /* Ajustar el color del texto para mejor contraste */
-            }
-            .resumen-left {
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                width: 25px;
-                font-weight: bold;
-            }
-            .resumen-mes {
-                flex: 2;
-                font-weight: 600;
-                font-size: 15px;
-            }
-            .resumen-dist {
-                flex: 1;
-                text-align: left;
-            }
-            .resumen-sesiones {
-                flex: 1;
-                text-align: right;
-                font-weight: normal;
-            }
-            </style>
-
-            """
-
-            for _, fila in resumen.iterrows():
-                mes_num = int(fila['mes_num'])
-                anio = int(fila['anio'])
-                sesiones = int(fila['sesiones'])
-                distancia_total = float(fila['distancia_total']) if not pd.isna(fila['distancia_total']) else 0.0
-                mes_nombre_upper = MES_NOMBRES[mes_num].upper() if 1 <= mes_num <= 12 else "SIN FECHA"
-
-                html_reporte += f"""
-                <div class="resumen-card">
-                    <div class="resumen-left">┃</div>
-                    <div class="resumen-mes">{mes_nombre_upper} {anio}</div>
-                    <div class="resumen-dist">{distancia_total:.2f} km</div>
-                    <div class="resumen-sesiones">{sesiones} sesiones</div>
-                </div>
-                """
-
-            html_reporte += "</div>"
-
-            # ============================================================
-            # FINAL DEL HTML
-            # ============================================================
-            html_reporte += "</body></html>"
-
-            # ============================================================
-            # BOTÓN DESCARGA
-            # ============================================================
-            st.download_button(
-                "⬇️ Descargar reporte",
-                data=html_reporte.encode("utf-8"),
-                file_name="reporte_sesiones.html",
-                mime="text/html"
-            )
+                st.error(f"❌ Error al generar el reporte: {e}")
+                st.session_state.pop('reporte_futuro', None)
+            else:
+                # ============================================================
+                # BOTÓN DESCARGA
+                # ============================================================
+                st.download_button(
+                    "⬇️ Descargar reporte",
+                    data=datos_reporte,
+                    file_name="reporte_sesiones.html",
+                    mime="text/html"
+                )
+                st.caption(
+                    f"Reporte de {len(datos_reporte) / 1024:.0f} KB con {n_figuras} gráficos, "
+                    f"generado en {segundos_reporte:.2f} s."
+                )
@@ -0,0 +1,203 @@
+"""
+Memoización de las funciones de análisis por contenido de sus argumentos.
+
+Los resultados se guardan en una caché del proceso, compartida por todas las
+sesiones de usuario: dos cargas del mismo ZIP reutilizan ingesta, sesiones,
+clustering, agregados mensuales y predicciones. La clave es un hash del
+contenido de los argumentos (DataFrames, arrays, bytes...), no su identidad.
+La caché está acotada por número de entradas, bytes (medidos por entrada) y
+TTL; cuando se llena se expulsan primero las entradas menos usadas (LRU).
+"""
+import functools
+import hashlib
+import inspect
+import io
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Límites de la caché
+MEMORIA_MAX_BYTES = 512 * 1024 ** 2
+MEMORIA_MAX_ENTRADAS = 256
+MEMORIA_TTL_S = 3600
+
+_AUSENTE = object()
+
+_lock = threading.RLock()
+_entradas = OrderedDict()  # clave -> (valor, bytes, instante de caducidad)
+_estado = {"bytes": 0, "aciertos": 0, "fallos": 0, "expulsiones": 0}
+
+# ==========================
+def _firma_objeto(obj):
+    if isinstance(obj, pd.DataFrame):
+        return ("df", obj.shape, tuple(map(str, obj.columns)), tuple(map(str, obj.dtypes)))
+    if isinstance(obj, pd.Series):
+        return ("serie", obj.shape, str(obj.name), str(obj.dtype))
+    return ("array", obj.shape, obj.dtype.str)
+
+def _hash_objeto(obj):
+    """
+    Hash del contenido de un DataFrame, Series o array de numpy. Se calcula en
+    cada llamada: una huella reutilizada por identidad del objeto no vería los
+    cambios de valores en sitio (df.loc[...] = ..., a[i] = ...).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(_firma_objeto(obj)).encode())
+    if isinstance(obj, np.ndarray):
+        h.update(np.ascontiguousarray(obj).view(np.uint8).reshape(-1) if obj.dtype != object
+                 else pickle.dumps(obj, protocol=5))
+        return h.hexdigest()
+    try:
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    except TypeError:
+        # Columnas con valores no hashables (listas, dicts...)
+        h.update(pickle.dumps(obj, protocol=5))
+    return h.hexdigest()
+
+def huella_contenido(obj):
+    """
+    Hash barato del contenido de obj: DataFrames, Series, arrays, bytes,
+    BytesIO, escalares y tuplas/listas/dicts de los anteriores.
+    """
+    h = hashlib.blake2b(digest_size=16)
+
+    def _actualizar(x):
+        if isinstance(x, (pd.DataFrame, pd.Series, np.ndarray)):
+            h.update(b"O" + _hash_objeto(x).encode())
+        elif isinstance(x, (bytes, bytearray, memoryview)):
+            h.update(b"B" + hashlib.blake2b(x, digest_size=16).digest())
+        elif isinstance(x, io.BytesIO):
+            h.update(b"B" + hashlib.blake2b(x.getbuffer(), digest_size=16).digest())
+        elif x is None or isinstance(x, (bool, int, float, str, np.generic)):
+            h.update(f"{type(x).__name__}:{x!r};".encode())
+        elif isinstance(x, (tuple, list)):
+            h.update(f"{type(x).__name__}[{len(x)}](".encode())
+            for elemento in x:
+                _actualizar(elemento)
+            h.update(b")")
+        elif isinstance(x, dict):
+            h.update(f"dict[{len(x)}](".encode())
+            for k in sorted(x, key=repr):
+                _actualizar(k)
+                _actualizar(x[k])
+            h.update(b")")
+        else:
+            h.update(b"P" + pickle.dumps(x, protocol=5))
+
+    _actualizar(obj)
+    return h.hexdigest()
+
+# ==========================
+def tamano_bytes(valor):
+    """Memoria aproximada que ocupa valor (profunda para DataFrames y contenedores)."""
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(index=True, deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, (bytes, bytearray, str)):
+        return sys.getsizeof(valor)
+    if isinstance(valor, (tuple, list)):
+        return sys.getsizeof(valor) + sum(tamano_bytes(v) for v in valor)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamano_bytes(k) + tamano_bytes(v) for k, v in valor.items())
+    if valor is None or isinstance(valor, (bool, int, float, np.generic)):
+        return sys.getsizeof(valor)
+    try:
+        return len(pickle.dumps(valor, protocol=5))
+    except Exception:
+        return sys.getsizeof(valor)
+
+def _copiar(valor):
+    """Copia de los DataFrames/arrays del resultado para que quien llama no altere la caché."""
+    if isinstance(valor, (pd.DataFrame, pd.Series, np.ndarray)):
+        return valor.copy()
+    if isinstance(valor, tuple):
+        return tuple(_copiar(v) for v in valor)
+    if isinstance(valor, list):
+        return [_copiar(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: _copiar(v) for k, v in valor.items()}
+    return valor
+
+# ==========================
+def _expulsar(clave):
+    _, tamano, _ = _entradas.pop(clave)
+    _estado["bytes"] -= tamano
+    _estado["expulsiones"] += 1
+
+def _obtener(clave):
+    with _lock:
+        entrada = _entradas.get(clave)
+        if entrada is None:
+            _estado["fallos"] += 1
+            return _AUSENTE
+        if entrada[2] < time.monotonic():
+            _expulsar(clave)
+            _estado["fallos"] += 1
+            return _AUSENTE
+        _entradas.move_to_end(clave)
+        _estado["aciertos"] += 1
+        return entrada[0]
+
+def _guardar(clave, valor, ttl):
+    tamano = tamano_bytes(valor)
+    if tamano > MEMORIA_MAX_BYTES:
+        return
+    with _lock:
+        if clave in _entradas:
+            _expulsar(clave)
+        _entradas[clave] = (valor, tamano, time.monotonic() + ttl)
+        _estado["bytes"] += tamano
+        ahora = time.monotonic()
+        for k in [k for k, e in _entradas.items() if e[2] < ahora]:
+            _expulsar(k)
+        while len(_entradas) > MEMORIA_MAX_ENTRADAS or _estado["bytes"] > MEMORIA_MAX_BYTES:
+            _expulsar(next(iter(_entradas)))
+
+# ==========================
+def memorizar(funcion=None, *, ttl=MEMORIA_TTL_S):
+    """
+    Decorador: memoriza funcion en la caché del proceso, con clave por contenido
+    de los argumentos. Como en st.cache_*, los parámetros que empiezan por "_"
+    no forman parte de la clave (se usan para pasar datos ya identificados por
+    otro argumento, p. ej. una huella). Devuelve copias de DataFrames y arrays.
+    La función original queda en funcion.sin_memoria.
+    """
+    def decorador(f):
+        nombre = f"{f.__module__}.{f.__qualname__}"
+        firma = inspect.signature(f)
+
+        @functools.wraps(f)
+        def envoltura(*args, **kwargs):
+            ligados = firma.bind(*args, **kwargs)
+            ligados.apply_defaults()
+            argumentos = {k: v for k, v in ligados.arguments.items() if not k.startswith("_")}
+            clave = f"{nombre}:{huella_contenido(argumentos)}"
+
+            valor = _obtener(clave)
+            if valor is _AUSENTE:
+                valor = f(*args, **kwargs)
+                _guardar(clave, valor, ttl)
+            return _copiar(valor)
+
+        envoltura.sin_memoria = f
+        return envoltura
+
+    return decorador(funcion) if funcion is not None else decorador
+
+def estadisticas_memoria():
+    """Entradas, bytes ocupados, aciertos, fallos y expulsiones de la caché."""
+    with _lock:
+        return {"entradas": len(_entradas), **_estado}
+
+def limpiar_memoria():
+    with _lock:
+        _entradas.clear()
+        _estado.update(bytes=0, aciertos=0, fallos=0, expulsiones=0)
@@ -0,0 +1,788 @@
+import numpy as np
+import pandas as pd
+
+from memoria import memorizar
+
+# Puntos a cada lado usados para suavizar la pendiente
+VENTANA_PENDIENTE = 10
+
+# Rango de validez del modelo de coste energético de Minetti (±45%)
+PENDIENTE_MAX = 0.45
+
+# Distancia mínima (m) dentro de la ventana para calcular pendiente
+DISTANCIA_MIN_PENDIENTE = 5.0
+
+# Predicciones de carrera de la app y de lote.py:
+# (nombre, posición del DataFrame en file_io.obtener_sesiones, distancia en km)
+PREDICCIONES_CARRERA = [
+    ("Predicción 5K", 1, 5.0),
+    ("Predicción 10K", 2, 10.0),
+    ("Media Maratón (21K)", 3, 21.0),
+    ("Maratón (42K)", 4, 42.195),
+]
+
+# ==========================
+def _ordenar_por_sesion(df_granular, columnas):
+    """
+    Ordena df_granular por sesión y timestamp y devuelve el DataFrame ordenado,
+    el código entero de sesión por punto, los nombres de sesión y, para cada
+    punto, el índice del primer y último punto de su sesión.
+    """
+    df = df_granular[columnas].copy()
+    df = df[df["archivo"].notna()]
+    df = df.sort_values(["archivo", "timestamp"], kind="mergesort")
+
+    codigos, archivos = pd.factorize(df["archivo"], sort=False)
+    n = len(codigos)
+    nuevo = np.empty(n, dtype=bool)
+    if n:
+        nuevo[0] = True
+        nuevo[1:] = codigos[1:] != codigos[:-1]
+    inicios = np.flatnonzero(nuevo)
+    finales = np.r_[inicios[1:] - 1, n - 1] if n else inicios
+    inicio_punto = np.repeat(inicios, np.diff(np.r_[inicios, n]))
+    final_punto = np.repeat(finales, np.diff(np.r_[inicios, n]))
+
+    return df, codigos, np.asarray(archivos), nuevo, inicio_punto, final_punto
+
+# ==========================
+def _deltas_por_sesion(valores, nuevo):
+    """Diferencias entre puntos consecutivos, con 0 en el primer punto de cada sesión."""
+    deltas = np.diff(valores, prepend=valores[:1] if len(valores) else valores)
+    deltas[nuevo] = 0.0
+    return deltas
+
+# ==========================
+def factor_coste_pendiente(pendiente):
+    """
+    Factor de coste relativo a llano según el polinomio de Minetti et al. (2002)
+    para carrera (J/kg/m), normalizado por el coste en llano (3.6 J/kg/m).
+    """
+    i = np.clip(pendiente, -PENDIENTE_MAX, PENDIENTE_MAX)
+    coste = 155.4 * i**5 - 30.4 * i**4 - 43.3 * i**3 + 46.3 * i**2 + 19.5 * i + 3.6
+    return coste / 3.6
+
+# ==========================
+def calcular_gap(df_granular, ventana=VENTANA_PENDIENTE):
+    """
+    Calcula el ritmo ajustado por pendiente (GAP) de todos los puntos de
+    df_granular en una sola pasada de arrays, sin bucles por sesión.
+
+    La pendiente se suaviza tomando la diferencia de altitud y distancia entre
+    los extremos de una ventana de ±`ventana` puntos, recortada a los límites
+    de cada sesión. El GAP de un tramo es el tiempo empleado dividido por la
+    distancia equivalente en llano (distancia × factor de coste).
+
+    Devuelve:
+      - df_puntos: pendiente, factor_gap y ritmo_gap (min/km) por punto,
+        con el mismo índice que df_granular.
+      - df_splits_gap: ritmo_gap por sesión y kilómetro.
+      - df_sesion_gap: ritmo_gap medio por sesión.
+    """
+    columnas = ["archivo", "timestamp", "distance", "duration_s", "altitude"]
+    vacio = (
+        pd.DataFrame(columns=["pendiente", "factor_gap", "ritmo_gap"]),
+        pd.DataFrame(columns=["archivo", "km", "ritmo_gap"]),
+        pd.DataFrame(columns=["archivo", "ritmo_gap"]),
+    )
+    if df_granular is None or df_granular.empty or not set(columnas).issubset(df_granular.columns):
+        return vacio
+
+    df, codigos, archivos, nuevo, inicio_punto, final_punto = _ordenar_por_sesion(df_granular, columnas)
+    if df.empty:
+        return vacio
+
+    dist = df["distance"].to_numpy(dtype=float)
+    dur = df["duration_s"].to_numpy(dtype=float)
+    # Huecos de altitud: se rellenan dentro de cada sesión; sin altitud -> llano
+    alt = df["altitude"].astype(float).groupby(codigos).ffill()
+    alt = alt.groupby(codigos).bfill().to_numpy(dtype=float)
+
+    # --- Pendiente suavizada por ventana (recortada a la sesión) ---
+    pos = np.arange(len(dist))
+    lo = np.maximum(pos - ventana, inicio_punto)
+    hi = np.minimum(pos + ventana, final_punto)
+    dd_ventana = dist[hi] - dist[lo]
+    da_ventana = alt[hi] - alt[lo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pendiente = np.where(dd_ventana >= DISTANCIA_MIN_PENDIENTE, da_ventana / dd_ventana, 0.0)
+    pendiente = np.clip(np.nan_to_num(pendiente), -PENDIENTE_MAX, PENDIENTE_MAX)
+    factor = factor_coste_pendiente(pendiente)
+
+    # --- Tramos entre puntos consecutivos ---
+    dd = np.clip(np.nan_to_num(_deltas_por_sesion(dist, nuevo)), 0, None)
+    dt = np.clip(np.nan_to_num(_deltas_por_sesion(dur, nuevo)), 0, None)
+    dd_equiv = dd * factor
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ritmo_gap_punto = np.where(dd_equiv > 0, (dt / 60) / (dd_equiv / 1000), np.nan)
+
+    df_puntos = pd.DataFrame(
+        {"pendiente": pendiente, "factor_gap": factor, "ritmo_gap": ritmo_gap_punto},
+        index=df.index,
+    ).reindex(df_granular.index)
+
+    # --- GAP medio por sesión ---
+    n_sesiones = len(archivos)
+    t_sesion = np.bincount(codigos, weights=dt, minlength=n_sesiones)
+    d_sesion = np.bincount(codigos, weights=dd_equiv, minlength=n_sesiones)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ritmo_sesion = np.where(d_sesion > 0, (t_sesion / 60) / (d_sesion / 1000), np.nan)
+    df_sesion_gap = pd.DataFrame({"archivo": archivos, "ritmo_gap": ritmo_sesion})
+
+    # --- GAP por kilómetro (clave combinada sesión × km) ---
+    km = np.floor(np.nan_to_num(dist) / 1000).astype(np.int64)
+    n_km = int(km.max()) + 1 if len(km) else 1
+    clave = codigos.astype(np.int64) * n_km + km
+    t_split = np.bincount(clave, weights=dt, minlength=n_sesiones * n_km)
+    d_split = np.bincount(clave, weights=dd_equiv, minlength=n_sesiones * n_km)
+    con_datos = d_split > 0
+    claves_validas = np.flatnonzero(con_datos)
+    df_splits_gap = pd.DataFrame({
+        "archivo": archivos[claves_validas // n_km],
+        "km": claves_validas % n_km + 1,
+        "ritmo_gap": (t_split[con_datos] / 60) / (d_split[con_datos] / 1000),
+    })
+
+    return df_puntos, df_splits_gap, df_sesion_gap
+
+def intervalos_gap(df_granular, archivos, tramo_final_min_m=50):
+    """
+    df_intervalos (archivo, intervalo, ritmo_intervalo) con el ritmo ajustado
+    por pendiente de cada km de las sesiones archivos (df_splits_gap de
+    calcular_gap). Como en intervalos_desde_rejilla, el último km incompleto
+    se etiqueta con la distancia total de la sesión si tiene al menos
+    tramo_final_min_m metros; no hay tramo inicial de 0.1 km.
+    """
+    columnas = ["archivo", "intervalo", "ritmo_intervalo"]
+    df = df_granular[df_granular["archivo"].isin(archivos)]
+    _, df_splits_gap, _ = calcular_gap(df)
+    if df_splits_gap.empty:
+        return pd.DataFrame(columns=columnas)
+
+    dist_total_km = (df.groupby("archivo")["distance"].max() / 1000).to_dict()
+    total = df_splits_gap["archivo"].map(dist_total_km).to_numpy(dtype=float)
+    km = df_splits_gap["km"].to_numpy(dtype=float)
+    completo = km <= total
+    valido = completo | (total - (km - 1) >= tramo_final_min_m / 1000)
+    return pd.DataFrame({
+        "archivo": df_splits_gap["archivo"].to_numpy()[valido],
+        "intervalo": np.where(completo, km, total)[valido],
+        "ritmo_intervalo": df_splits_gap["ritmo_gap"].to_numpy(dtype=float)[valido],
+    })
+
+# ==========================
+# Remuestreo sobre rejilla fija de distancia
+
+# Paso de la rejilla de distancia (m)
+PASO_REJILLA_M = 100
+
+@memorizar
+def remuestrear_sesiones(df_granular, paso_m=PASO_REJILLA_M, dtype=np.float32):
+    """
+    Interpola el tiempo transcurrido de cada sesión sobre una rejilla fija de
+    distancia (0, paso_m, 2·paso_m, ...). Todas las sesiones se resuelven con una
+    única llamada a np.interp desplazando la distancia de cada sesión a su propio
+    tramo del eje, así que no hay bucles por sesión.
+
+    Devuelve (archivos, rejilla_m, matriz_tiempo, dist_final_m, t_final_s):
+      - archivos: nombre de sesión de cada fila.
+      - rejilla_m: distancias de la rejilla en metros.
+      - matriz_tiempo: (n_sesiones x n_celdas) segundos transcurridos en cada
+        punto de la rejilla; NaN más allá del final de la sesión.
+      - dist_final_m, t_final_s: distancia y tiempo reales al final de cada
+        sesión, que no suele caer en un punto de la rejilla.
+    La memoria depende sólo de n_sesiones x n_celdas, no de la frecuencia de muestreo.
+    """
+    columnas = ["archivo", "timestamp", "distance", "duration_s"]
+    vacia = (np.array([], dtype=object), np.array([], dtype=float), np.empty((0, 0), dtype=dtype),
+             np.array([], dtype=float), np.array([], dtype=float))
+    if df_granular is None or df_granular.empty or not set(columnas).issubset(df_granular.columns):
+        return vacia
+
+    df, codigos, archivos, _, _, _ = _ordenar_por_sesion(df_granular, columnas)
+    df = df.assign(distance=df["distance"].astype(float), duration_s=df["duration_s"].astype(float))
+    validos = df["distance"].notna().to_numpy() & df["duration_s"].notna().to_numpy()
+    df, codigos = df[validos], codigos[validos]
+    if df.empty:
+        return vacia
+
+    # La distancia acumulada debe ser monótona dentro de cada sesión para interpolar
+    dist = df["distance"].groupby(codigos).cummax().to_numpy()
+    dur = df["duration_s"].groupby(codigos).cummax().to_numpy()
+
+    n_sesiones = len(archivos)
+    dist_max = np.full(n_sesiones, -np.inf)
+    np.maximum.at(dist_max, codigos, dist)
+    dist_max[~np.isfinite(dist_max)] = 0.0
+    dur_max = np.zeros(n_sesiones)
+    np.maximum.at(dur_max, codigos, dur)
+
+    n_celdas = int(np.floor(dist_max.max() / paso_m)) + 1
+    rejilla_m = np.arange(n_celdas, dtype=float) * paso_m
+
+    # Cada sesión ocupa su propio tramo [k·desplazamiento, k·desplazamiento + dist_max_k]
+    desplazamiento = (n_celdas + 1) * paso_m
+    eje = dist + codigos * desplazamiento
+    consultas = rejilla_m[None, :] + (np.arange(n_sesiones) * desplazamiento)[:, None]
+    matriz_tiempo = np.interp(consultas.ravel(), eje, dur).reshape(n_sesiones, n_celdas).astype(dtype)
+
+    # Celdas anteriores al primer punto o posteriores al final de la sesión
+    dist_min = np.full(n_sesiones, np.inf)
+    np.minimum.at(dist_min, codigos, dist)
+    fuera = (rejilla_m[None, :] > dist_max[:, None]) | (rejilla_m[None, :] < dist_min[:, None])
+    matriz_tiempo[fuera] = np.nan
+    # El origen de la rejilla es el inicio de la sesión
+    matriz_tiempo[:, 0] = 0.0
+
+    return archivos, rejilla_m, matriz_tiempo, dist_max, dur_max
+
+# ==========================
+def ritmo_desde_rejilla(matriz_tiempo, paso_m=PASO_REJILLA_M, tramo_m=1000):
+    """
+    Ritmo (min/km) por tramos de tramo_m metros a partir de la matriz de tiempos
+    de la rejilla. Devuelve una matriz (n_sesiones x n_tramos) con NaN en los
+    tramos que la sesión no completó.
+    """
+    salto = max(1, int(round(tramo_m / paso_m)))
+    tiempos = matriz_tiempo[:, ::salto].astype(float)
+    with np.errstate(invalid="ignore"):
+        return np.diff(tiempos, axis=1) / 60 / (salto * paso_m / 1000)
+
+# ==========================
+def _tramos_rejilla(matriz_tiempo, dist_final_m, t_final_s, paso_m):
+    """
+    Tramos de tab_prediccion sobre la rejilla: ritmo (min/km) de 0.1 km inicial
+    y de cada km completo como matriz (n_sesiones x n_limites), y el tramo
+    final desde el último límite alcanzado hasta el final real de la sesión
+    (NaN si no llega a 50 m, como en calcular_intervalos_sesiones).
+    Devuelve (limites_km, ritmos, dist_final_km, ritmo_final).
+    """
+    tiempos = matriz_tiempo.astype(float)
+    n_sesiones, n_celdas = tiempos.shape
+    paso_km = paso_m / 1000
+    dist_final_m = np.asarray(dist_final_m, dtype=float)
+    t_final_s = np.asarray(t_final_s, dtype=float)
+
+    # Límites: 0.1 km y cada km completo
+    limites_km = np.r_[0.1, np.arange(1, int(np.floor(dist_final_m.max() / 1000)) + 1)]
+    cols = np.rint(limites_km / paso_km).astype(int)
+    cols = cols[cols < n_celdas]
+    limites_km = limites_km[:len(cols)]
+    t_limites = tiempos[:, cols]
+    t_previo = np.c_[np.zeros(n_sesiones), t_limites[:, :-1]]
+    d_segmento = np.diff(np.r_[0.0, limites_km])
+    ritmos = (t_limites - t_previo) / 60 / d_segmento[None, :]
+
+    # Tramo final: desde el último límite alcanzado hasta la distancia real
+    alcanzados = np.isfinite(t_limites)
+    ultimo = len(limites_km) - 1 - np.argmax(alcanzados[:, ::-1], axis=1)
+    alguno = alcanzados.any(axis=1)
+    filas = np.arange(n_sesiones)
+    d_inicio_m = np.where(alguno, limites_km[ultimo] * 1000, 0.0)
+    t_inicio = np.where(alguno, t_limites[filas, ultimo], 0.0)
+    restante_m = dist_final_m - d_inicio_m
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ritmo_final = np.where(restante_m >= 50, (t_final_s - t_inicio) / 60 / (restante_m / 1000), np.nan)
+    return limites_km, ritmos, dist_final_m / 1000, ritmo_final
+
+def intervalos_desde_rejilla(archivos, matriz_tiempo, dist_final_m, t_final_s, paso_m=PASO_REJILLA_M):
+    """
+    Construye df_intervalos (archivo, intervalo, ritmo_intervalo) con los mismos
+    tramos que tab_prediccion (0.1 km inicial, cada km y el tramo final de al
+    menos 50 m, etiquetado con la distancia total) usando sólo reducciones
+    sobre la matriz de la rejilla y el final real de cada sesión.
+    """
+    columnas = ["archivo", "intervalo", "ritmo_intervalo"]
+    if len(archivos) == 0 or matriz_tiempo.size == 0:
+        return pd.DataFrame(columns=columnas)
+
+    limites_km, ritmos, dist_final_km, ritmo_final = _tramos_rejilla(matriz_tiempo, dist_final_m, t_final_s, paso_m)
+    filas, columnas_ok = np.nonzero(np.isfinite(ritmos))
+    con_final = np.flatnonzero(np.isfinite(ritmo_final))
+    return pd.DataFrame({
+        "archivo": np.r_[archivos[filas], archivos[con_final]],
+        "intervalo": np.r_[limites_km[columnas_ok], dist_final_km[con_final]],
+        "ritmo_intervalo": np.r_[ritmos[filas, columnas_ok], ritmo_final[con_final]],
+    }).sort_values(["archivo", "intervalo"], ignore_index=True)
+
+# ==========================
+def redondear_intervalos(intervalos, dist_max):
+    """
+    Etiqueta de cada tramo en el perfil medio: km redondeado, salvo el tramo
+    inicial (<= 0.2 km) y el final de la sesión más larga (dist_max).
+    """
+    intervalos = np.asarray(intervalos, dtype=float)
+    return np.where(np.isclose(intervalos, dist_max) | (intervalos <= 0.2), intervalos, np.round(intervalos))
+
+def perfil_ritmo_desde_rejilla(matriz_tiempo, dist_final_m, t_final_s, paso_m=PASO_REJILLA_M):
+    """
+    Perfil medio de ritmo (intervalo_redondeado, ritmo_prom, ritmo_std) de los
+    tramos de intervalos_desde_rejilla, como reducción por columnas: los km
+    de cada sesión y su tramo final se colocan en la columna de su etiqueta
+    (redondear_intervalos) de una matriz (2·n_sesiones x n_etiquetas), y la
+    media y la desviación (ddof=1) se calculan sobre el eje de las sesiones.
+    """
+    columnas = ["intervalo_redondeado", "ritmo_prom", "ritmo_std"]
+    if matriz_tiempo.size == 0:
+        return pd.DataFrame(columns=columnas)
+
+    limites_km, ritmos, dist_final_km, ritmo_final = _tramos_rejilla(matriz_tiempo, dist_final_m, t_final_s, paso_m)
+    km_ok = np.isfinite(ritmos).any(axis=0)
+    con_final = np.isfinite(ritmo_final)
+    if not km_ok.any() and not con_final.any():
+        return pd.DataFrame(columns=columnas)
+
+    dist_max = np.r_[limites_km[km_ok], dist_final_km[con_final]].max()
+    etiqueta_km = redondear_intervalos(limites_km[km_ok], dist_max)
+    etiqueta_final = redondear_intervalos(dist_final_km[con_final], dist_max)
+    etiquetas = np.unique(np.r_[etiqueta_km, etiqueta_final])
+
+    n_sesiones = ritmos.shape[0]
+    perfil = np.full((2 * n_sesiones, len(etiquetas)), np.nan)
+    perfil[:n_sesiones, np.searchsorted(etiquetas, etiqueta_km)] = ritmos[:, km_ok]
+    perfil[n_sesiones + np.flatnonzero(con_final), np.searchsorted(etiquetas, etiqueta_final)] = ritmo_final[con_final]
+
+    n = np.isfinite(perfil).sum(axis=0)
+    media = np.nansum(perfil, axis=0) / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        desv = np.where(n > 1, np.sqrt(np.nansum((perfil - media) ** 2, axis=0) / (n - 1)), np.nan)
+    return pd.DataFrame({"intervalo_redondeado": etiquetas, "ritmo_prom": media, "ritmo_std": desv})
+
+# ==========================
+# Matriz de splits sesión × kilómetro
+
+def matriz_splits(df_granular=None, rejilla=None):
+    """
+    Construye la matriz de splits: un array 2-D (n_sesiones x n_km) con el
+    ritmo (min/km) de cada kilómetro completo, relleno con NaN donde la sesión
+    no llegó. Se obtiene de la rejilla remuestreada (se calcula si no se pasa).
+    Devuelve (archivos, matriz_ritmo); las filas siguen el orden de archivos.
+    """
+    if rejilla is None:
+        rejilla = remuestrear_sesiones(df_granular)
+    archivos, rejilla_m, matriz_tiempo, _, _ = rejilla
+    if len(archivos) == 0 or matriz_tiempo.size == 0:
+        return archivos, np.empty((len(archivos), 0))
+
+    paso_m = rejilla_m[1] - rejilla_m[0] if len(rejilla_m) > 1 else PASO_REJILLA_M
+    matriz_ritmo = ritmo_desde_rejilla(matriz_tiempo, paso_m, tramo_m=1000)
+
+    # Recortar columnas finales sin ningún dato
+    con_datos = np.flatnonzero(np.isfinite(matriz_ritmo).any(axis=0))
+    n_km = con_datos[-1] + 1 if len(con_datos) else 0
+    return archivos, matriz_ritmo[:, :n_km]
+
+# ==========================
+def bandas_percentiles_splits(matriz_ritmo, percentiles=(10, 25, 50, 75, 90)):
+    """
+    Percentiles de ritmo por kilómetro, calculados columna a columna sobre la
+    matriz de splits. Devuelve un DataFrame con km, n_sesiones y p<percentil>.
+    """
+    n_km = matriz_ritmo.shape[1] if matriz_ritmo.ndim == 2 else 0
+    bandas = pd.DataFrame({
+        "km": np.arange(1, n_km + 1),
+        "n_sesiones": np.isfinite(matriz_ritmo).sum(axis=0) if n_km else np.array([], dtype=int),
+    })
+    if n_km == 0 or matriz_ritmo.shape[0] == 0:
+        for q in percentiles:
+            bandas[f"p{q}"] = np.nan
+        return bandas
+
+    columnas_validas = bandas["n_sesiones"].to_numpy() > 0
+    valores = np.full((len(percentiles), n_km), np.nan)
+    valores[:, columnas_validas] = np.nanpercentile(matriz_ritmo[:, columnas_validas], percentiles, axis=0)
+    for q, fila in zip(percentiles, valores):
+        bandas[f"p{q}"] = fila
+    return bandas
+
+# ==========================
+def comparar_sesiones(archivos, matriz_ritmo, archivo_a, archivo_b):
+    """
+    Compara kilómetro a kilómetro dos sesiones de la matriz de splits.
+    diferencia > 0 significa que la sesión B fue más lenta en ese km.
+    """
+    archivos = np.asarray(archivos)
+    idx_a = np.flatnonzero(archivos == archivo_a)
+    idx_b = np.flatnonzero(archivos == archivo_b)
+    if len(idx_a) == 0 or len(idx_b) == 0:
+        return pd.DataFrame(columns=["km", "ritmo_a", "ritmo_b", "diferencia"])
+
+    ritmo_a = matriz_ritmo[idx_a[0]]
+    ritmo_b = matriz_ritmo[idx_b[0]]
+    comunes = np.isfinite(ritmo_a) & np.isfinite(ritmo_b)
+    km = np.arange(1, matriz_ritmo.shape[1] + 1)
+    return pd.DataFrame({
+        "km": km[comunes],
+        "ritmo_a": ritmo_a[comunes],
+        "ritmo_b": ritmo_b[comunes],
+        "diferencia": (ritmo_b - ritmo_a)[comunes],
+    })
+
+# ==========================
+# Tiempo en zonas de ritmo
+
+# Límites (min/km) entre zonas, de más rápida a más lenta
+LIMITES_ZONAS_RITMO = (4.5, 5.0, 5.5, 6.0, 6.5)
+
+# Puntos a cada lado usados para suavizar el ritmo instantáneo
+VENTANA_RITMO = 5
+
+# ==========================
+def ritmo_decimal_a_min_seg(ritmo):
+    """Ritmo en minutos decimales como 'm:ss' (5.5 -> '5:30'; 4.999 -> '5:00')."""
+    minutos = int(ritmo)
+    segundos = int(round((ritmo - minutos) * 60))
+    if segundos == 60:
+        minutos, segundos = minutos + 1, 0
+    return f"{minutos}:{segundos:02d}"
+
+# ==========================
+def nombres_zonas_ritmo(limites=LIMITES_ZONAS_RITMO):
+    """Etiquetas de las zonas definidas por limites (ej. '< 4:30', '4:30-5:00', '> 6:30')."""
+    limites = sorted(limites)
+    nombres = [f"< {ritmo_decimal_a_min_seg(limites[0])}"]
+    nombres += [
+        f"{ritmo_decimal_a_min_seg(a)}-{ritmo_decimal_a_min_seg(b)}" for a, b in zip(limites[:-1], limites[1:])
+    ]
+    nombres.append(f"> {ritmo_decimal_a_min_seg(limites[-1])}")
+    return nombres
+
+# ==========================
+@memorizar
+def tiempo_en_zonas(df_granular, limites=LIMITES_ZONAS_RITMO, ventana=VENTANA_RITMO):
+    """
+    Segundos pasados en cada zona de ritmo para todas las sesiones a la vez.
+    El ritmo instantáneo sale de los deltas de distancia y duración sobre una
+    ventana de ±`ventana` puntos (recortada a la sesión); cada tramo se asigna
+    a una zona con np.digitize y se acumula con un único np.bincount sobre la
+    clave sesión × zona. El coste es lineal en el número total de puntos.
+    Los tramos sin avance (paradas) cuentan en la zona más lenta.
+
+    Devuelve (archivos, nombres_zonas, matriz_segundos) con matriz_segundos de
+    forma (n_sesiones x n_zonas).
+    """
+    limites = np.sort(np.asarray(limites, dtype=float))
+    nombres = nombres_zonas_ritmo(limites)
+    n_zonas = len(nombres)
+    columnas = ["archivo", "timestamp", "distance", "duration_s"]
+    if df_granular is None or df_granular.empty or not set(columnas).issubset(df_granular.columns):
+        return np.array([], dtype=object), nombres, np.empty((0, n_zonas))
+
+    df, codigos, archivos, nuevo, inicio_punto, final_punto = _ordenar_por_sesion(df_granular, columnas)
+    if df.empty:
+        return np.array([], dtype=object), nombres, np.empty((0, n_zonas))
+
+    dist = np.nan_to_num(df["distance"].to_numpy(dtype=float))
+    dur = np.nan_to_num(df["duration_s"].to_numpy(dtype=float))
+
+    # Ritmo suavizado por ventana
+    pos = np.arange(len(dist))
+    lo = np.maximum(pos - ventana, inicio_punto)
+    hi = np.minimum(pos + ventana, final_punto)
+    dd_ventana = dist[hi] - dist[lo]
+    dt_ventana = dur[hi] - dur[lo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ritmo = np.where(dd_ventana > 0, (dt_ventana / 60) / (dd_ventana / 1000), np.inf)
+
+    # Tiempo de cada tramo entre puntos consecutivos
+    dt = np.clip(_deltas_por_sesion(dur, nuevo), 0, None)
+
+    zona = np.digitize(ritmo, limites)
+    clave = codigos.astype(np.int64) * n_zonas + zona
+    matriz_segundos = np.bincount(clave, weights=dt, minlength=len(archivos) * n_zonas)
+    return archivos, nombres, matriz_segundos.reshape(len(archivos), n_zonas)
+
+# ==========================
+def tiempo_en_zonas_por_mes(archivos, nombres_zonas, matriz_segundos, fechas):
+    """
+    Suma la matriz de tiempo en zonas por mes. fechas es una Serie indexada por
+    archivo con la fecha de inicio de cada sesión. Devuelve un DataFrame con una
+    fila por mes ('YYYY-MM') y una columna de minutos por zona.
+    """
+    if len(archivos) == 0:
+        return pd.DataFrame(columns=["mes"] + list(nombres_zonas))
+
+    meses = pd.to_datetime(pd.Series(archivos).map(fechas), errors="coerce").dt.to_period("M").astype(str)
+    df_zonas = pd.DataFrame(matriz_segundos / 60, columns=nombres_zonas)
+    df_zonas["mes"] = meses.to_numpy()
+    df_zonas = df_zonas[df_zonas["mes"] != "NaT"]
+    return df_zonas.groupby("mes", as_index=False)[list(nombres_zonas)].sum().sort_values("mes", ignore_index=True)
+
+# ==========================
+def formatear_limites_zonas(limites=LIMITES_ZONAS_RITMO):
+    """Texto editable con los límites de zona, ej. '4:30, 5:00, 5:30'."""
+    return ", ".join(ritmo_decimal_a_min_seg(l) for l in sorted(limites))
+
+# ==========================
+def parsear_limites_zonas(texto):
+    """
+    Convierte un texto tipo '4:30, 5:00, 5:30' (o decimales '4.5, 5') en una
+    tupla ordenada de límites en minutos decimales. Lanza ValueError si no es válido.
+    """
+    limites = []
+    for parte in str(texto).replace(";", ",").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if ":" in parte:
+            minutos, segundos = parte.split(":", 1)
+            valor = int(minutos) + int(segundos) / 60
+        else:
+            valor = float(parte)
+        if valor <= 0:
+            raise ValueError(f"Límite de zona no válido: {parte}")
+        limites.append(valor)
+    if not limites:
+        raise ValueError("Indica al menos un límite de zona.")
+    return tuple(sorted(set(limites)))
+
+# ==========================
+# Features por sesión para clustering
+
+# Features disponibles y su etiqueta para la interfaz
+FEATURES_SESION = {
+    "distancia": "Distancia (km)",
+    "ritmo": "Ritmo medio (min/km)",
+    "ritmo_gap": "Ritmo ajustado por pendiente (min/km)",
+    "desnivel_positivo": "Desnivel positivo (m)",
+    "variabilidad_ritmo": "Variabilidad del ritmo por km (CV)",
+    "ratio_split_negativo": "Ritmo 2ª mitad / 1ª mitad",
+    "hora_dia": "Hora de inicio",
+}
+
+def _desnivel_positivo_por_sesion(df, codigos, nuevo, n_sesiones):
+    """
+    Desnivel positivo de todas las sesiones a la vez, con el mismo filtrado que
+    visualization.calcular_desniveles (±5 m por muestra, ruido < 0.3 m, >150 m/km descartado).
+    """
+    alt = df["altitude"].astype(float).groupby(codigos).ffill()
+    alt = alt.groupby(codigos).bfill().to_numpy(dtype=float)
+    diffs = np.clip(np.nan_to_num(_deltas_por_sesion(alt, nuevo)), -5, 5)
+    diffs[np.abs(diffs) < 0.3] = 0
+    ganancia = np.bincount(codigos, weights=np.clip(diffs, 0, None), minlength=n_sesiones)
+
+    dist = df["distance"].to_numpy(dtype=float)
+    dist_km = np.zeros(n_sesiones)
+    np.maximum.at(dist_km, codigos, np.nan_to_num(dist) / 1000)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        absurdo = (dist_km > 0) & (ganancia / dist_km > 150)
+    ganancia[absurdo] = 0.0
+    return ganancia
+
+# ==========================
+@memorizar
+def calcular_features_sesion(df_granular, df_sesion, rejilla=None):
+    """
+    Tabla de features por sesión (una fila por archivo) para el clustering,
+    calculada una sola vez por carga de datos con operaciones vectorizadas:
+    distancia, ritmo, ritmo_gap, desnivel_positivo, variabilidad_ritmo
+    (coeficiente de variación de los splits por km), ratio_split_negativo
+    (ritmo de la 2ª mitad / 1ª mitad; < 1 es split negativo) y hora_dia.
+    """
+    columnas = list(FEATURES_SESION)
+    if df_sesion is None or df_sesion.empty:
+        return pd.DataFrame(columns=["archivo"] + columnas)
+
+    features = df_sesion[["archivo"]].copy()
+    for col in ("distancia", "ritmo", "ritmo_gap"):
+        features[col] = df_sesion[col].to_numpy() if col in df_sesion.columns else np.nan
+    fechas = pd.to_datetime(df_sesion["fecha"], errors="coerce")
+    features["hora_dia"] = (fechas.dt.hour + fechas.dt.minute / 60).to_numpy()
+
+    # --- Desnivel positivo ---
+    cols_granular = ["archivo", "timestamp", "distance", "altitude"]
+    if df_granular is not None and not df_granular.empty and set(cols_granular).issubset(df_granular.columns):
+        df, codigos, archivos, nuevo, _, _ = _ordenar_por_sesion(df_granular, cols_granular)
+        ganancia = _desnivel_positivo_por_sesion(df, codigos, nuevo, len(archivos))
+        features["desnivel_positivo"] = features["archivo"].map(pd.Series(ganancia, index=archivos))
+    else:
+        features["desnivel_positivo"] = np.nan
+
+    # --- Variabilidad y split negativo a partir de la rejilla ---
+    if rejilla is None:
+        rejilla = remuestrear_sesiones(df_granular)
+    archivos_rej, rejilla_m, matriz_tiempo, _, _ = rejilla
+    if len(archivos_rej) and matriz_tiempo.size:
+        paso_m = rejilla_m[1] - rejilla_m[0] if len(rejilla_m) > 1 else PASO_REJILLA_M
+        splits = ritmo_desde_rejilla(matriz_tiempo, paso_m, tramo_m=1000)
+        n_splits = np.isfinite(splits).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            media = np.nansum(splits, axis=1) / n_splits
+            desv = np.sqrt(np.nansum((splits - media[:, None]) ** 2, axis=1) / n_splits)
+            cv = np.where(n_splits >= 2, desv / media, np.nan)
+
+        tiempos = matriz_tiempo.astype(float)
+        n_filas, n_celdas = tiempos.shape
+        ultima = n_celdas - 1 - np.argmax(np.isfinite(tiempos)[:, ::-1], axis=1)
+        mitad = ultima // 2
+        filas = np.arange(n_filas)
+        t_mitad, t_final = tiempos[filas, mitad], tiempos[filas, ultima]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ritmo_1 = t_mitad / (mitad * paso_m)
+            ritmo_2 = (t_final - t_mitad) / ((ultima - mitad) * paso_m)
+            ratio = np.where(mitad > 0, ritmo_2 / ritmo_1, np.nan)
+
+        features["variabilidad_ritmo"] = features["archivo"].map(pd.Series(cv, index=archivos_rej))
+        features["ratio_split_negativo"] = features["archivo"].map(pd.Series(ratio, index=archivos_rej))
+    else:
+        features["variabilidad_ritmo"] = np.nan
+        features["ratio_split_negativo"] = np.nan
+
+    return features[["archivo"] + columnas].reset_index(drop=True)
+
+# ==========================
+# Cubo de agregación temporal: totales por día, semana ISO, mes y año
+
+MES_NOMBRES = [
+    "", "enero", "febrero", "marzo", "abril", "mayo", "junio",
+    "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"
+]
+
+NIVELES_CUBO = {"dia": "D", "semana": "W-SUN", "mes": "MS", "anio": "YS"}
+
+def construir_cubo_temporal(df_sesion):
+    """
+    Totales de distancia (km), sesiones y tiempo (min) por día, semana ISO
+    (lunes a domingo), mes y año, a partir de las columnas fecha, distancia y
+    tiempo de df_sesion. El nivel diario se obtiene con un único resample y los
+    demás se agregan desde él, así que los periodos sin sesiones valen 0.
+    Devuelve un dict nivel -> DataFrame con 'periodo' (inicio del periodo),
+    distancia, sesiones y tiempo; la semana añade anio_iso y semana_iso.
+    """
+    # Sólo las columnas usadas forman la clave de memoria (otras, como el cluster, no afectan)
+    columnas = [c for c in ("fecha", "distancia", "tiempo") if c in df_sesion.columns]
+    return _cubo_temporal(df_sesion[columnas])
+
+@memorizar
+def _cubo_temporal(df_sesion):
+    fechas = pd.to_datetime(df_sesion["fecha"], errors="coerce")
+    base = pd.DataFrame({
+        "distancia": pd.to_numeric(df_sesion["distancia"], errors="coerce").fillna(0.0).to_numpy(),
+        "sesiones": 1,
+        "tiempo": (pd.to_numeric(df_sesion["tiempo"], errors="coerce").fillna(0.0).to_numpy()
+                   if "tiempo" in df_sesion.columns else 0.0),
+    }, index=pd.DatetimeIndex(fechas, name="periodo"))
+    base = base[base.index.notna()]
+
+    cubo = {}
+    diario = base.resample(NIVELES_CUBO["dia"]).sum()
+    for nivel, frecuencia in NIVELES_CUBO.items():
+        tabla = diario if nivel == "dia" else diario.resample(frecuencia).sum()
+        tabla = tabla.reset_index()
+        if nivel == "semana":
+            # resample semanal etiqueta con el domingo final; se guarda el lunes de inicio
+            tabla["periodo"] = tabla["periodo"] - pd.Timedelta(days=6)
+            iso = tabla["periodo"].dt.isocalendar()
+            tabla["anio_iso"] = iso["year"].astype(int)
+            tabla["semana_iso"] = iso["week"].astype(int)
+        tabla["sesiones"] = tabla["sesiones"].astype(int)
+        cubo[nivel] = tabla
+    return cubo
+
+# ==========================
+def nombre_mes(periodo, mayusculas=False):
+    """'enero 2025' (o 'ENERO 2025') para un Timestamp de inicio de mes."""
+    texto = f"{MES_NOMBRES[periodo.month]} {periodo.year}"
+    return texto.upper() if mayusculas else texto
+
+# ==========================
+# Submuestreo para gráficos (se hace en el servidor, antes del ColumnDataSource)
+
+# Puntos por serie temporal (del orden del ancho en píxeles del gráfico)
+MAX_PUNTOS_SERIE = 1500
+
+# Puntos de un gráfico de dispersión antes de aclararlo
+MAX_PUNTOS_DISPERSION = 3000
+
+def indices_lttb(x, y, n_objetivo):
+    """
+    Índices de los puntos elegidos por Largest-Triangle-Three-Buckets: se
+    conservan el primero y el último, y de cada cubo intermedio el punto que
+    forma el triángulo de mayor área con el elegido en el cubo anterior y la
+    media del siguiente. Mantiene picos y valles de la serie (x ordenado).
+    """
+    n = len(x)
+    if n_objetivo >= n or n_objetivo < 3:
+        return np.arange(n)
+
+    bordes = np.linspace(1, n - 1, n_objetivo - 1).astype(np.int64)
+    elegidos = np.empty(n_objetivo, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    anterior = 0
+    for i in range(n_objetivo - 2):
+        ini, fin = bordes[i], bordes[i + 1]
+        sig_ini, sig_fin = bordes[i + 1], (bordes[i + 2] if i + 2 < len(bordes) else n)
+        x_sig = x[sig_ini:sig_fin].mean()
+        y_sig = y[sig_ini:sig_fin].mean()
+        areas = np.abs(
+            (x[anterior] - x_sig) * (y[ini:fin] - y[anterior])
+            - (x[anterior] - x[ini:fin]) * (y_sig - y[anterior])
+        )
+        anterior = ini + int(np.argmax(areas))
+        elegidos[i + 1] = anterior
+    return elegidos
+
+def indices_por_celda(x, y, n_objetivo):
+    """
+    Aclara una nube de puntos: divide el rango en una rejilla de unas
+    n_objetivo celdas y deja un punto por celda ocupada. Las zonas densas se
+    reducen y los puntos aislados (extremos) se conservan.
+    """
+    n = len(x)
+    if n_objetivo >= n:
+        return np.arange(n)
+    lado = max(1, int(np.sqrt(n_objetivo)))
+
+    def _celda(v):
+        v_min, v_max = v.min(), v.max()
+        if v_max <= v_min:
+            return np.zeros(n, dtype=np.int64)
+        return np.minimum(((v - v_min) / (v_max - v_min) * lado).astype(np.int64), lado - 1)
+
+    _, primeros = np.unique(_celda(x) * lado + _celda(y), return_index=True)
+    return np.sort(primeros)
+
+def submuestrear(x, y, max_puntos, dispersion=False):
+    """
+    Índices (ordenados) de como mucho unos max_puntos puntos de (x, y) que
+    conservan la forma del gráfico: LTTB para series ordenadas por x y una
+    rejilla por celda para gráficos de dispersión. Ignora puntos no finitos.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finitos = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(finitos) <= max_puntos:
+        return finitos
+    funcion = indices_por_celda if dispersion else indices_lttb
+    return finitos[funcion(x[finitos], y[finitos], max_puntos)]
+
+# ==========================
+@memorizar
+def serie_sesion(df_granular, archivo, ventana=VENTANA_RITMO):
+    """
+    Serie punto a punto de una sesión: tiempo (min), distancia (km), altitud (m)
+    y ritmo (min/km) suavizado sobre ±`ventana` puntos. Sin avance -> NaN.
+    """
+    columnas = ["archivo", "timestamp", "distance", "duration_s", "altitude"]
+    if df_granular is None or df_granular.empty or not set(columnas).issubset(df_granular.columns):
+        return pd.DataFrame(columns=["tiempo", "distancia", "altitud", "ritmo"])
+
+    df = df_granular.loc[df_granular["archivo"] == archivo, columnas].sort_values("timestamp", kind="mergesort")
+    dist = np.nan_to_num(df["distance"].to_numpy(dtype=float))
+    dur = np.nan_to_num(df["duration_s"].to_numpy(dtype=float))
+
+    pos = np.arange(len(dist))
+    lo = np.maximum(pos - ventana, 0)
+    hi = np.minimum(pos + ventana, len(dist) - 1)
+    dd_ventana = dist[hi] - dist[lo]
+    dt_ventana = dur[hi] - dur[lo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ritmo = np.where(dd_ventana > 0, (dt_ventana / 60) / (dd_ventana / 1000), np.nan)
+
+    return pd.DataFrame({
+        "tiempo": dur / 60,
+        "distancia": dist / 1000,
+        "altitud": df["altitude"].astype(float).interpolate(limit_direction="both").to_numpy(),
+        "ritmo": ritmo,
+    })
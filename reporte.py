@@ -0,0 +1,259 @@
+"""
+Generación del reporte HTML descargable.
+
+El reporte se arma con plantillas string.Template precompiladas y se escribe
+en un buffer (StringIO), a partir de las figuras y resúmenes que la app ya
+calculó. Todas las figuras Bokeh se serializan juntas en un único documento
+(components) con un solo bloque de recursos en el <head>. La generación corre
+en un hilo de fondo (lanzar_reporte) para no bloquear la página.
+"""
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+
+from metricas import nombre_mes
+
+# ===========================
+# Íconos SVG (reporte y app)
+ICONO_REPORTE = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="44px" '
+    'viewBox="0 -960 960 960" width="44px" fill="#222222" '
+    'style="vertical-align:middle;margin-right:10px;">'
+    '<path d="M680-330q-50 0-85-35t-35-85q0-50 35-85t85-35q50 0 85 35t35 85q0 50-35 85t-85 35Zm0-60q25.5 0 42.75-17.25T740-450q0-25.5-17.25-42.75T680-510q-25.5 0-42.75 17.25T620-450q0 25.5 17.25 42.75T680-390ZM440-50v-116q0-21 10-39.5t28-29.5q28-17 58-29.5t62-20.5l82 106 82-106q32 8 61.5 20.5T881-235q18 11 28.5 29.5T920-166v116H440Zm60-60h157l-82-106q-20 8-39 17.5T500-178v68Zm203 0h157v-68q-17-11-35.5-20.5T786-216l-83 106Zm-46 0Zm46 0Zm-523-10q-24.75 0-42.37-17.63Q120-155.25 120-180v-600q0-24.75 17.63-42.38Q155.25-840 180-840h600q24.75 0 42.38 17.62Q840-804.75 840-780v247q-11-20-26-37t-34-30v-180H180v600h200v60H180Zm100-500h341q14-5 28.84-7.5T680-630v-50H280v60Zm0 170h220q0-15 2.5-30.5T510-510H280v60Zm0 170h158q17-13 36-21.5t39-16.5v-22H280v60ZM180-180v-600 180-30 450Zm500-270Z"/>'
+    '</svg>'
+)
+
+ICONO_SESION = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" viewBox="0 -960 960 960" '
+    'width="40px" fill="#264653">'
+    '<path d="M320-360h66.67v-126.67H556v90L680-520 556-644v90.67H353.33q-14.16 0-23.75 9.58Q320-534.17 320-520v160ZM479.97-78Q467-78 454.5-82.67q-12.5-4.66-21.83-14l-336-336q-9.34-9.33-14-21.86Q78-467.07 78-480.03q0-12.97 4.67-25.47 4.66-12.5 14-21.83l336-336q9.33-9.34 21.86-14 12.54-4.67 25.5-4.67 12.97 0 25.47 4.67 12.5 4.66 21.83 14l336 336q9.34 9.33 14 21.86 4.67 12.54 4.67 25.5 0 12.97-4.67 25.47-4.66 12.5-14 21.83l-336 336q-9.33 9.34-21.86 14Q492.93-78 479.97-78ZM312-312l168 168 336-336-336-336-336 336 168 168Zm168-168Z"/>'
+    '</svg>'
+)
+
+ICONO_DISTANCIA = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
+    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
+    'style="vertical-align:middle;margin-right:8px;">'
+    '<path d="M653.33-160v-280H800v280H653.33Zm-246.66 0v-640h146.66v640H406.67ZM160-160v-440h146.67v440H160Z"/>'
+    '</svg>'
+)
+
+ICONO_CLUSTER = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
+    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
+    'style="vertical-align:middle;margin-right:8px;">'
+    '<path d="m260.67-524 220-356 220 356h-440Z'
+    'M704-80q-74.33 0-125.17-50.83Q528-181.67 528-256t50.83-125.17Q629.67-432 704-432t125.17 50.83Q880-330.33 880-256t-50.83 125.17Q778.33-80 704-80Z'
+    'm-584-23.33v-309.34h309.33v309.34H120Z'
+    'm584.06-43.34q45.94 0 77.61-31.72 31.66-31.72 31.66-77.67 0-45.94-31.72-77.61-31.72-31.66-77.67-31.66-45.94 0-77.61 31.72-31.66 31.72-31.66 77.67 0 45.94 31.72 77.61 31.72 31.66 77.67 31.66Z'
+    'M186.67-170h176v-176h-176v176Z'
+    'M380-590.67h201.33L480.67-753.33 380-590.67Z"/>'
+    '</svg>'
+)
+
+ICONO_PREDICCION = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
+    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
+    'style="vertical-align:middle;margin-right:8px;">'
+    '<path d="M360-853.33V-920h240v66.67H360ZM480-80.67q-74 0-139.5-28.5T226-186.67q-49-49-77.5-114.5T120-440.67q0-74 28.5-139.5t77.5-114.5q49-49 114.5-77.5t139.5-28.5q65.33 0 123.67 21.67 58.33 21.67 105.66 61L762-770.67 808.67-724 756-671.33Q792.67-628 816.33-571 840-514 840-440.67q0 74-28.5 139.5T734-186.67q-49 49-114.5 77.5T480-80.67Zm0-66.66q122 0 207.67-85.67 85.66-85.67 85.66-207.67 0-122-85.66-207.66Q602-734 480-734q-122 0-207.67 85.67-85.66 85.66-85.66 207.66T272.33-233Q358-147.33 480-147.33ZM480-440Zm-75.33 151.33L632-441.33l-227.33-152v304.66Z"/>'
+    '</svg>'
+)
+
+# ==== ICONOS GLOBALES ====
+ICONO_CALENDARIO = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" '
+    'viewBox="0 -960 960 960" width="40px" fill="#264653" '
+    'style="vertical-align:middle;margin-right:8px;">'
+    '<path d="M240-280h240v-80H240v80Zm120-160h240v-80H360v80Zm120-160h240v-80H480v80ZM200-120q-33 '
+    '0-56.5-23.5T120-200v-560q0-33 23.5-56.5T200-840h560q33 0 '
+    '56.5 23.5T840-760v560q0 33-23.5 56.5T760-120H200Zm0-80h560v-560H200v560Zm0-560v560-560Z"/>'
+    '</svg>'
+)
+
+ICONO_IA = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="40px" viewBox="0 -960 960 960" width="40px" fill="#264653" '
+    'style="vertical-align:middle;margin-right:8px;">'
+    '<path d="M319-160q-9 0-16.83-4.5Q294.33-169 290-177l-82-146.33h66.67l41.33 80h90.67v-33.34H336l-41.33-80H190l-61-106.66q-2-4.34-3.17-8.34-1.16-4-1.16-8.33 0-2.67 4.33-16.67l61-106.66h104.67l41.33-80h70.67v-33.34H316l-41.33 80H208L290-783q4.33-8 12.17-12.5Q310-800 319-800h111q14.33 0 23.83 9.5 9.5 9.5 9.5 23.83v170h-76.66l-33.34 33.34h110v126.66h-94.66l-39.34-80h-96L200-483.33h108l40 80h115.33v210q0 14.33-9.5 23.83-9.5 9.5-23.83 9.5H319Zm211 0q-14.33 0-23.83-9.5-9.5-9.5-9.5-23.83v-210H612l40-80h108l-33.33-33.34h-96l-39.34 80h-94.66v-126.66h110l-33.34-33.34h-76.66v-170q0-14.33 9.5-23.83 9.5-9.5 23.83-9.5h111q9 0 16.83 4.5Q665.67-791 670-783l82 146.33h-66.67l-41.33-80h-90.67v33.34H624l41.33 80H770l61 106.66q2 4.34 3.17 8.34 1.16 4 1.16 8.33 0 2.67-4.33 16.67l-61 106.66H665.33l-41.33 80h-70.67v33.34H644l41.33-80H752L670-177q-4.33 8-12.17 12.5Q650-160 641-160H530Z"/>'
+    '</svg>'
+)
+
+# ===========================
+# Plantillas
+
+PLANTILLA_DOCUMENTO = Template("""<html>
+<head>
+    <meta charset='utf-8'>
+    <title>Reporte de Running</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .section { background-color: #f7f9fc; border: 1px solid #ddd; border-radius: 8px;
+                    padding: 15px 25px; margin-bottom: 20px; }
+        h1, h2, h3, h4 { color: #2a3f66; }
+        .sesion-card {
+            display:flex; align-items:center; justify-content:space-between;
+            padding:10px 14px; border-radius:12px; margin-bottom:8px;
+            box-shadow:0 1px 3px rgba(0,0,0,0.06); /* sombra más suave */
+        }
+        .sesion-left { display:flex; align-items:center; gap:12px; min-width:60px; }
+        .sesion-tipo { flex:1; font-weight:600; font-size:15px; }
+        .sesion-info { flex:1; line-height:1.2; }
+        .sesion-count { font-weight: normal; color:#264653; text-align:right; min-width:70px; }
+        .resumen-card {
+            display: flex;
+            align-items: center;
+            justify-content: space-between;
+            padding: 10px 14px;
+            border-radius: 12px;
+            margin-bottom: 8px;
+            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+            background-color: #2A9D8F; /* Color de fondo unificado para todas las tarjetas */
+            color: white; /* Ajustar el color del texto para mejor contraste */
+        }
+        .resumen-left { display: flex; align-items: center; justify-content: center; width: 25px; font-weight: bold; }
+        .resumen-mes { flex: 2; font-weight: 600; font-size: 15px; }
+        .resumen-dist { flex: 1; text-align: left; }
+        .resumen-sesiones { flex: 1; text-align: right; font-weight: normal; }
+    </style>
+$recursos
+</head>
+<body>
+<div style='display: flex; align-items: center; gap: 10px;'>
+    $icono
+    <h1 style='margin: 0; font-size: 1.8rem; font-weight: 600; color: #000000;'>Reporte Running</h1>
+</div>
+""")
+
+PLANTILLA_TITULO = Template("""
+<div style='display: flex; align-items: center; gap: 8px; margin-top: 1.5em;'>
+    $icono
+    <h3 style='margin: 0; color: #264653; font-weight: 600;'>$titulo</h3>
+</div>
+""")
+
+PLANTILLA_TARJETA_SESION = Template("""
+<div class="sesion-card" style="background-color:$fondo; color:#264653;">
+    <div class="sesion-left">$icono</div>
+    <div class="sesion-tipo">$tipo</div>
+    <div class="sesion-info">$distancia km (distancia media)<br>$ritmo min/km (ritmo medio)</div>
+    <div class="sesion-count">$cantidad</div>
+</div>
+""")
+
+PLANTILLA_TARJETA_MES = Template("""
+<div class="resumen-card">
+    <div class="resumen-left">┃</div>
+    <div class="resumen-mes">$mes</div>
+    <div class="resumen-dist">$distancia km</div>
+    <div class="resumen-sesiones">$sesiones sesiones</div>
+</div>
+""")
+
+# Las figuras compartidas con la app se serializan bajo este lock (Bokeh re-aloja
+# temporalmente los modelos en otro documento al serializarlos). La app pinta
+# esas mismas figuras con mostrar_figura.
+LOCK_BOKEH = threading.Lock()
+
+_ejecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reporte")
+
+# ===========================
+def _fondo_pastel(color_hex, alpha=0.13):
+    """Color HEX → rgba con opacidad baja para el efecto pastel de las tarjetas."""
+    r, g, b = int(color_hex[1:3], 16), int(color_hex[3:5], 16), int(color_hex[5:7], 16)
+    return f"rgba({r},{g},{b},{alpha})"
+
+def _escribir_seccion(buffer, icono, titulo):
+    buffer.write('<div class="section">')
+    buffer.write(PLANTILLA_TITULO.substitute(icono=icono, titulo=titulo))
+
+# ===========================
+def construir_reporte(tipos_sesion, grafico_km, predicciones, resumen_mensual, sin_conexion=False):
+    """
+    Escribe el reporte completo y lo devuelve codificado en UTF-8.
+    - tipos_sesion: (figura, tarjetas, colores) de tab_clustering(solo_objeto=True)
+    - grafico_km: figura de tab_kilometros_por_mes
+    - predicciones: lista de (nombre, figura, resumen)
+    - resumen_mensual: nivel "mes" del cubo temporal, meses con sesiones
+    Devuelve (bytes, nº de figuras, segundos de generación).
+    """
+    from bokeh.embed import components
+    from bokeh.resources import CDN, INLINE
+
+    inicio = time.perf_counter()
+    cuerpo = io.StringIO()
+    figuras = []
+
+    def _hueco(figura):
+        figuras.append(figura)
+        cuerpo.write(f"<!--FIGURA_{len(figuras) - 1}-->")
+
+    # 1️⃣ Tipos de sesión
+    _escribir_seccion(cuerpo, ICONO_CLUSTER, "Tipos de sesión")
+    grafico_cluster, tarjetas_cluster, colores_cluster = tipos_sesion or (None, None, None)
+    if grafico_cluster is not None:
+        _hueco(grafico_cluster)
+    if tarjetas_cluster is not None:
+        # Tarjetas ordenadas por distancia media ascendente
+        for fila in tarjetas_cluster.sort_values("distancia_media").itertuples():
+            cantidad = fila.cantidad_sesiones
+            cuerpo.write(PLANTILLA_TARJETA_SESION.substitute(
+                fondo=_fondo_pastel(colores_cluster.get(fila.tipo_sesion, "#E6F0FA")),
+                icono=ICONO_SESION,
+                tipo=fila.tipo_sesion,
+                distancia=f"{fila.distancia_media:.1f}",
+                ritmo=fila.ritmo_medio,
+                cantidad=f"{cantidad} {'sesión' if cantidad == 1 else 'sesiones'}"
+            ))
+    cuerpo.write("</div>")
+
+    # 2️⃣ Distancia recorrida
+    _escribir_seccion(cuerpo, ICONO_DISTANCIA, "Distancia recorrida")
+    if grafico_km is not None:
+        _hueco(grafico_km)
+    cuerpo.write("</div>")
+
+    # 3️⃣ Predicciones (sólo el gráfico de predicción, no el histograma)
+    cuerpo.write('<div class="section">')
+    for nombre, figura, resumen in predicciones:
+        cuerpo.write(PLANTILLA_TITULO.substitute(icono=ICONO_PREDICCION, titulo=nombre))
+        if resumen:
+            cuerpo.write(f"<p><b>{resumen}</b></p>")
+        if figura is not None:
+            _hueco(figura)
+    cuerpo.write("</div>")
+
+    # 4️⃣ Resumen mensual
+    _escribir_seccion(cuerpo, ICONO_CALENDARIO, "Resumen")
+    for fila in resumen_mensual.itertuples():
+        cuerpo.write(PLANTILLA_TARJETA_MES.substitute(
+            mes=nombre_mes(fila.periodo, mayusculas=True),
+            distancia=f"{fila.distancia:.2f}",
+            sesiones=fila.sesiones
+        ))
+    cuerpo.write("</div>")
+
+    # Un único documento Bokeh para todas las figuras
+    try:
+        with LOCK_BOKEH:
+            script, divs = components(figuras) if figuras else ("", ())
+    except Exception as e:
+        script, divs = "", [f"<p>(Error al exportar gráficos: {e})</p>"] * len(figuras)
+    html_cuerpo = cuerpo.getvalue()
+    for i, div in enumerate(divs):
+        html_cuerpo = html_cuerpo.replace(f"<!--FIGURA_{i}-->", div, 1)
+
+    salida = io.StringIO()
+    salida.write(PLANTILLA_DOCUMENTO.substitute(
+        recursos=(INLINE if sin_conexion else CDN).render(),
+        icono=ICONO_REPORTE
+    ))
+    salida.write(html_cuerpo)
+    salida.write(script)
+    salida.write("</body></html>")
+    datos = salida.getvalue().encode("utf-8")
+    return datos, len(figuras), time.perf_counter() - inicio
+
+def lanzar_reporte(*args, **kwargs):
+    """construir_reporte en el hilo de fondo; devuelve un Future con su resultado."""
+    return _ejecutor.submit(construir_reporte, *args, **kwargs)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+# Los módulos de la app están en la raíz del repositorio (no es un paquete instalable)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+
+def sesion(archivo, metros=None, velocidad=2.5, pendiente=0.0, segundos=None):
+    """
+    Sesión sintética con un punto por segundo a velocidad (m/s) y pendiente
+    constantes, de `metros` (múltiplo de velocidad) o de `segundos` de duración.
+    """
+    duracion = segundos if segundos is not None else round(metros / velocidad)
+    t = np.arange(0, duracion + 1, dtype=float)
+    d = t * velocidad
+    return pd.DataFrame({
+        "archivo": archivo,
+        "timestamp": pd.Timestamp("2025-01-01") + pd.to_timedelta(t, unit="s"),
+        "distance": d,
+        "duration_s": t,
+        "altitude": 100 + d * pendiente,
+    })
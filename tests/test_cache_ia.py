@@ -0,0 +1,52 @@
+import os
+import time
+
+import pytest
+
+import analisis_ia
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Caché de respuestas IA sobre un directorio temporal."""
+    monkeypatch.setattr(analisis_ia, "RUTA_CACHE_IA", str(tmp_path / "cache"))
+    return analisis_ia
+
+
+def test_clave_ignora_formato_de_la_pregunta(cache):
+    assert cache.clave_cache_ia("ctx", "¿Cuántos   km?") == cache.clave_cache_ia("ctx", "cuantos km")
+    assert cache.clave_cache_ia("ctx", "cuantos km") != cache.clave_cache_ia("otro ctx", "cuantos km")
+    assert cache.clave_cache_ia("ctx", "cuantos km") != cache.clave_cache_ia("ctx", "cuantas sesiones")
+
+
+def test_clave_depende_del_modelo(cache, monkeypatch):
+    clave = cache.clave_cache_ia("ctx", "cuantos km")
+    monkeypatch.setattr(analisis_ia, "MAX_TOKENS_IA", cache.MAX_TOKENS_IA + 1)
+    assert cache.clave_cache_ia("ctx", "cuantos km") != clave
+
+
+def test_guardar_y_leer(cache):
+    assert cache.leer_cache_ia("a") is None
+    cache.guardar_cache_ia("a", "respuesta")
+    assert cache.leer_cache_ia("a") == "respuesta"
+
+
+def test_entrada_caducada(cache, monkeypatch):
+    cache.guardar_cache_ia("a", "respuesta")
+    monkeypatch.setattr(analisis_ia, "TTL_CACHE_IA_S", -1)
+    assert cache.leer_cache_ia("a") is None
+    assert not os.path.exists(os.path.join(cache.RUTA_CACHE_IA, "a.json"))
+
+
+def test_expulsa_la_de_uso_mas_antiguo(cache, monkeypatch):
+    monkeypatch.setattr(analisis_ia, "MAX_ENTRADAS_CACHE_IA", 2)
+    cache.guardar_cache_ia("a", "1")
+    cache.guardar_cache_ia("b", "2")
+    antes = time.time() - 60
+    os.utime(os.path.join(cache.RUTA_CACHE_IA, "a.json"), (antes - 60, antes - 60))
+    os.utime(os.path.join(cache.RUTA_CACHE_IA, "b.json"), (antes, antes))
+    assert cache.leer_cache_ia("a") == "1"  # leer renueva el uso de "a"
+    cache.guardar_cache_ia("c", "3")
+    assert cache.leer_cache_ia("b") is None
+    assert cache.leer_cache_ia("a") == "1"
+    assert cache.leer_cache_ia("c") == "3"
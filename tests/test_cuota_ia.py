@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import analisis_ia
+
+_INICIAR_SYNC_SHEETS = analisis_ia._iniciar_sync_sheets
+
+
+@pytest.fixture
+def cuota(tmp_path, monkeypatch):
+    """Cuota sobre una base temporal, sin hoja de Google Sheets ni hilo de sincronización."""
+    monkeypatch.setattr(analisis_ia, "RUTA_CUOTA_IA", str(tmp_path / "cuota.sqlite3"))
+    monkeypatch.setattr(analisis_ia, "hoja_sheets", lambda: None)
+    monkeypatch.setattr(analisis_ia, "_iniciar_sync_sheets", lambda: None)
+    monkeypatch.setitem(analisis_ia._estado_sync, "sembrado", False)
+    monkeypatch.setitem(analisis_ia._estado_sync, "sincronizado", None)
+    return analisis_ia
+
+
+def test_reserva_hasta_el_limite(cuota):
+    assert [cuota.reservar_consulta_ia(3) for _ in range(5)] == [True, True, True, False, False]
+    assert cuota.consultas_ia_hoy() == 3
+
+
+def test_liberar_devuelve_la_consulta(cuota):
+    assert cuota.reservar_consulta_ia(1)
+    assert not cuota.reservar_consulta_ia(1)
+    cuota.liberar_consulta_ia()
+    assert cuota.consultas_ia_hoy() == 0
+    assert cuota.reservar_consulta_ia(1)
+
+
+def test_reservas_concurrentes_no_superan_el_limite(cuota):
+    with ThreadPoolExecutor(max_workers=16) as ejecutor:
+        concedidas = sum(ejecutor.map(lambda _: cuota.reservar_consulta_ia(3), range(200)))
+    assert concedidas == 3
+    assert cuota.consultas_ia_hoy() == 3
+
+
+def test_primera_reserva_parte_del_contador_de_la_hoja(cuota, monkeypatch):
+    # Disco local vacío (redeploy) y la hoja ya lleva hoy el límite gastado
+    monkeypatch.setattr(cuota, "hoja_sheets", lambda: object())
+    monkeypatch.setattr(cuota, "leer_contador_gs", lambda: {"fecha": cuota._hoy(), "contador": 3})
+    assert not cuota.reservar_consulta_ia(3)
+    assert cuota.consultas_ia_hoy() == 3
+
+
+def test_contador_de_la_hoja_de_otro_dia_no_cuenta(cuota, monkeypatch):
+    monkeypatch.setattr(cuota, "hoja_sheets", lambda: object())
+    monkeypatch.setattr(cuota, "leer_contador_gs", lambda: {"fecha": "2000-01-01", "contador": 3})
+    assert cuota.reservar_consulta_ia(3)
+    assert cuota.consultas_ia_hoy() == 1
+
+
+def test_sin_sync_no_se_toca_la_hoja(cuota, monkeypatch):
+    def prohibido(*args, **kwargs):
+        raise AssertionError("no se debe usar Google Sheets")
+
+    monkeypatch.setattr(cuota, "SYNC_SHEETS_IA", False)
+    monkeypatch.setattr(cuota, "hoja_sheets", prohibido)
+    monkeypatch.setattr(cuota, "leer_contador_gs", prohibido)
+    monkeypatch.setattr(cuota, "guardar_contador_gs", prohibido)
+    monkeypatch.setattr(cuota, "_iniciar_sync_sheets", _INICIAR_SYNC_SHEETS)
+    assert cuota.reservar_consulta_ia(3)
+    assert cuota._estado_sync["hilo"] is None
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from conftest import sesion
+from metricas import calcular_gap, factor_coste_pendiente, intervalos_gap
+
+
+def test_factor_coste_en_llano_es_uno():
+    assert factor_coste_pendiente(0.0) == pytest.approx(1.0)
+    assert factor_coste_pendiente(0.05) > 1 > factor_coste_pendiente(-0.05)
+
+
+def test_gap_en_llano_coincide_con_el_ritmo():
+    _, splits, por_sesion = calcular_gap(sesion("llano", 2500))
+    ritmo = 1000 / 2.5 / 60
+    assert splits["km"].tolist() == [1, 2, 3]
+    assert splits["ritmo_gap"].to_numpy() == pytest.approx(ritmo, rel=1e-3)
+    assert por_sesion["ritmo_gap"].iloc[0] == pytest.approx(ritmo, rel=1e-3)
+
+
+def test_gap_en_subida_es_mas_rapido_que_el_ritmo():
+    _, splits, por_sesion = calcular_gap(sesion("subida", 3000, pendiente=0.05))
+    ritmo = 1000 / 2.5 / 60
+    assert (splits["ritmo_gap"] < ritmo).all()
+    assert por_sesion["ritmo_gap"].iloc[0] == pytest.approx(ritmo / factor_coste_pendiente(0.05), rel=0.02)
+
+
+def test_gap_por_sesion_independiente_del_orden():
+    df = pd.concat([sesion("b", 2000, pendiente=0.03), sesion("a", 1500)], ignore_index=True)
+    puntos, _, por_sesion = calcular_gap(df.sample(frac=1, random_state=0))
+    assert puntos.index.equals(df.sample(frac=1, random_state=0).index)
+    solo_a = calcular_gap(sesion("a", 1500))[2]["ritmo_gap"].iloc[0]
+    assert por_sesion.set_index("archivo").loc["a", "ritmo_gap"] == pytest.approx(solo_a)
+
+
+def test_gap_sin_columnas_devuelve_vacios():
+    puntos, splits, por_sesion = calcular_gap(pd.DataFrame({"archivo": ["x"]}))
+    assert puntos.empty and splits.empty and por_sesion.empty
+
+
+def test_intervalos_gap_etiqueta_el_km_final_con_la_distancia_total():
+    df = pd.concat([sesion("a", 2500), sesion("b", 2030), sesion("c", 1000)], ignore_index=True)
+    intervalos = intervalos_gap(df, ["a", "b"])
+    por_sesion = intervalos.groupby("archivo")["intervalo"].apply(list).to_dict()
+    assert por_sesion["a"] == [1.0, 2.0, 2.5]
+    assert por_sesion["b"] == [1.0, 2.0]  # 30 m finales: por debajo del mínimo
+    assert "c" not in por_sesion
+    assert intervalos["ritmo_intervalo"].to_numpy() == pytest.approx(1000 / 2.5 / 60, rel=1e-3)
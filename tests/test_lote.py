@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+import lote
+
+OPCIONES = {"gap": False, "sin_conexion": False}
+
+
+@pytest.fixture
+def atleta(tmp_path):
+    """ZIP de un atleta y su directorio de salida con un resumen.json de ese mismo ZIP."""
+    dir_zips = tmp_path / "zips"
+    dir_zips.mkdir()
+    ruta_zip = dir_zips / "ana.zip"
+    ruta_zip.write_bytes(b"zip")
+    dir_salida = str(tmp_path / "salida")
+    dir_atleta = lote._dir_atleta(dir_salida, str(ruta_zip))
+    os.makedirs(dir_atleta)
+    resumen = {"origen": lote._origen(str(ruta_zip)), "opciones": OPCIONES}
+    with open(os.path.join(dir_atleta, lote.ARCHIVO_RESUMEN_ATLETA), "w", encoding="utf-8") as f:
+        json.dump(resumen, f)
+    return str(ruta_zip), dir_atleta
+
+
+def test_terminado_con_mismo_zip_y_opciones(atleta):
+    assert lote.atleta_terminado(*atleta, OPCIONES)
+
+
+def test_opciones_distintas_lo_repiten(atleta):
+    assert not lote.atleta_terminado(*atleta, {**OPCIONES, "gap": True})
+
+
+def test_zip_modificado_lo_repite(atleta):
+    ruta_zip, dir_atleta = atleta
+    with open(ruta_zip, "ab") as f:
+        f.write(b" nuevo")
+    assert not lote.atleta_terminado(ruta_zip, dir_atleta, OPCIONES)
+
+
+def test_resumen_ausente_o_a_medias(atleta):
+    ruta_zip, dir_atleta = atleta
+    ruta_resumen = os.path.join(dir_atleta, lote.ARCHIVO_RESUMEN_ATLETA)
+    with open(ruta_resumen, "w", encoding="utf-8") as f:
+        f.write('{"origen": ')
+    assert not lote.atleta_terminado(ruta_zip, dir_atleta, OPCIONES)
+    os.remove(ruta_resumen)
+    assert not lote.atleta_terminado(ruta_zip, dir_atleta, OPCIONES)
+
+
+def test_directorio_salta_los_terminados(atleta, capsys):
+    ruta_zip, dir_atleta = atleta
+    dir_salida = os.path.dirname(dir_atleta)
+    resumen = lote.procesar_directorio(os.path.dirname(ruta_zip), dir_salida, procesos=1)
+    assert resumen["atletas_saltados"] == 1
+    assert resumen["atletas_procesados"] == 0
+    assert os.path.exists(os.path.join(dir_salida, lote.ARCHIVO_RESUMEN_LOTE))
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import memoria
+from memoria import huella_contenido, memorizar
+
+
+@pytest.fixture(autouse=True)
+def memoria_vacia():
+    memoria.limpiar_memoria()
+    yield
+    memoria.limpiar_memoria()
+
+
+def test_huella_igual_para_mismo_contenido():
+    a = pd.DataFrame({"a": [1.0, 2.0], "b": ["x", "y"]})
+    b = a.copy()
+    assert huella_contenido(a) == huella_contenido(b)
+    assert huella_contenido((a, 3, "z")) == huella_contenido((b, 3, "z"))
+
+
+def test_huella_cambia_con_modificacion_en_sitio_de_dataframe():
+    df = pd.DataFrame({"a": [1.0, 2.0]})
+    antes = huella_contenido(df)
+    df.loc[0, "a"] = 100.0
+    assert huella_contenido(df) != antes
+
+
+def test_huella_cambia_con_modificacion_en_sitio_de_array():
+    a = np.arange(5, dtype=float)
+    antes = huella_contenido(a)
+    a[0] = 50
+    assert huella_contenido(a) != antes
+
+
+def test_huella_distingue_columnas_y_tipos():
+    assert huella_contenido(pd.DataFrame({"a": [1]})) != huella_contenido(pd.DataFrame({"b": [1]}))
+    assert huella_contenido(np.array([1], dtype=np.int32)) != huella_contenido(np.array([1], dtype=np.int64))
+
+
+def test_memorizar_recalcula_tras_modificar_el_argumento():
+    llamadas = []
+
+    @memorizar
+    def suma(df):
+        llamadas.append(1)
+        return float(df["a"].sum())
+
+    df = pd.DataFrame({"a": [1.0, 2.0]})
+    assert suma(df) == 3.0
+    assert suma(df) == 3.0
+    assert len(llamadas) == 1
+    df.loc[0, "a"] = 100.0
+    assert suma(df) == 102.0
+    assert len(llamadas) == 2
+
+
+def test_memorizar_ignora_parametros_con_guion_bajo_y_devuelve_copias():
+    @memorizar
+    def doble(x, _extra=None):
+        return np.asarray(x) * 2
+
+    r1 = doble([1, 2], _extra="a")
+    r1[0] = -1
+    r2 = doble([1, 2], _extra="b")
+    assert r2.tolist() == [2, 4]
+    assert memoria.estadisticas_memoria()["aciertos"] == 1
+
+
+def test_expulsion_lru_por_numero_de_entradas(monkeypatch):
+    monkeypatch.setattr(memoria, "MEMORIA_MAX_ENTRADAS", 2)
+
+    @memorizar
+    def identidad(x):
+        return x
+
+    identidad(1)
+    identidad(2)
+    identidad(1)  # 1 pasa a ser la más reciente
+    identidad(3)  # expulsa 2
+    estado = memoria.estadisticas_memoria()
+    assert estado["entradas"] == 2 and estado["expulsiones"] == 1
+    identidad(1)
+    assert memoria.estadisticas_memoria()["aciertos"] == 2
+
+
+def test_entradas_caducan_por_ttl(monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(memoria.time, "monotonic", lambda: reloj[0])
+
+    @memorizar(ttl=10)
+    def identidad(x):
+        return x
+
+    identidad(1)
+    reloj[0] += 11
+    identidad(1)
+    assert memoria.estadisticas_memoria()["aciertos"] == 0
@@ -0,0 +1,69 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+from visualization import (
+    _ajustar_kmeans,
+    _escalar_features,
+    asignar_clusters_incremental,
+    cargar_modelo_clusters,
+    crear_modelo_clusters,
+    guardar_modelo_clusters,
+    tab_clustering,
+)
+
+
+def sesiones(n, semilla=0, inicio=0):
+    rng = np.random.default_rng(semilla)
+    distancia = np.r_[rng.normal(5, 0.3, n // 2), rng.normal(15, 0.5, n - n // 2)]
+    ritmo = np.r_[rng.normal(5.0, 0.1, n // 2), rng.normal(6.0, 0.1, n - n // 2)]
+    return pd.DataFrame({"archivo": [f"s{i:04d}" for i in range(inicio, inicio + n)],
+                         "distancia": distancia, "ritmo": ritmo})
+
+
+def modelo_de(df):
+    X = df[["distancia", "ritmo"]].to_numpy()
+    scaler, X_scaled = _escalar_features(X)
+    _, model, labels, score = _ajustar_kmeans(X_scaled)
+    return crear_modelo_clusters(["distancia", "ritmo"], scaler, model, labels, df["archivo"], score)
+
+
+def test_asignacion_incremental_no_modifica_el_modelo_recibido():
+    modelo = modelo_de(sesiones(40))
+    original = copy.deepcopy(modelo)
+    nuevas = sesiones(10, semilla=1, inicio=40)
+    labels, actualizado = asignar_clusters_incremental(
+        modelo, nuevas[["distancia", "ritmo"]].to_numpy(), nuevas["archivo"]
+    )
+    assert len(labels) == 10
+    assert modelo["labels"] == original["labels"]
+    assert modelo["inercia_media"] == original["inercia_media"]
+    assert len(actualizado["labels"]) == 50
+
+
+def test_asignacion_incremental_detecta_deriva():
+    modelo = modelo_de(sesiones(40))
+    lejanas = pd.DataFrame({"archivo": ["x1", "x2"], "distancia": [40.0, 42.0], "ritmo": [9.0, 9.5]})
+    assert asignar_clusters_incremental(modelo, lejanas[["distancia", "ritmo"]].to_numpy(), lejanas["archivo"]) is None
+
+
+def test_guardar_y_cargar_modelo(tmp_path):
+    modelo = dict(modelo_de(sesiones(40)), nombres={0: "Corta", 1: "Larga"})
+    ruta = tmp_path / "modelo.json"
+    assert cargar_modelo_clusters(str(ruta)) is None
+    guardar_modelo_clusters(modelo, str(ruta))
+    cargado = cargar_modelo_clusters(str(ruta))
+    assert cargado["labels"] == modelo["labels"]
+    assert cargado["nombres"] == modelo["nombres"]
+    np.testing.assert_allclose(cargado["centroides"], modelo["centroides"])
+
+
+def test_tipos_de_sesion_estables_con_ruta_modelo(tmp_path):
+    ruta = str(tmp_path / "modelo.json")
+    df = sesiones(40)
+    _, resumen1, _ = tab_clustering(df.copy(), solo_objeto=True, ruta_modelo=ruta)
+    df2 = pd.concat([df, sesiones(6, semilla=2, inicio=40)], ignore_index=True)
+    _, resumen2, _ = tab_clustering(df2.copy(), solo_objeto=True, ruta_modelo=ruta)
+    assert set(resumen1["tipo_sesion"]) == set(resumen2["tipo_sesion"])
+    assert len(cargar_modelo_clusters(ruta)["labels"]) == 46
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from analisis_ia import construir_indice_registros, contexto_para_pregunta, recuperar_registros
+
+
+def df_sesiones():
+    return pd.DataFrame({
+        "fecha": pd.to_datetime(["2025-01-04 08:00", "2025-01-12 09:00", "2025-02-02 07:30", "2025-02-20 18:00"]),
+        "distancia": [5.1, 21.2, 10.0, 42.3],
+        "tiempo": [26.0, 115.0, 52.0, 250.0],
+        "ritmo": [5.1, 5.42, 5.2, 5.91],
+        "tipo_sesion": ["Corta / Rápida", "Media Maratón / Tempo", "Media / Moderada", "Maratón / Competencia"],
+    })
+
+
+def test_pregunta_por_maraton_recupera_esa_sesion():
+    registros = recuperar_registros(construir_indice_registros(df_sesiones()), "¿Cómo fue mi maratón de 42k?")
+    sesiones = [r for r in registros if r.startswith("Sesión")]
+    assert sesiones and "2025-02-20" in sesiones[0]
+
+
+def test_meses_y_sesiones_se_limitan_por_separado():
+    indice = construir_indice_registros(df_sesiones())
+    registros = recuperar_registros(indice, "sesiones de enero y febrero", k_meses=1, k_sesiones=2)
+    assert sum(r.startswith("Mes") for r in registros) <= 1
+    assert sum(r.startswith("Sesión") for r in registros) <= 2
+
+
+def test_sin_terminos_comunes_no_hay_registros():
+    indice = construir_indice_registros(df_sesiones())
+    assert recuperar_registros(indice, "xyzzy") == []
+    assert recuperar_registros(indice, "   ") == []
+    assert contexto_para_pregunta("DIGEST", df_sesiones(), "xyzzy") == "DIGEST"
+
+
+def test_sin_sesiones_no_hay_indice():
+    assert construir_indice_registros(df_sesiones().iloc[:0]) is None
+    assert recuperar_registros(None, "maratón") == []
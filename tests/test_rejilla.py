@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import sesion
+from metricas import (
+    intervalos_desde_rejilla,
+    perfil_ritmo_desde_rejilla,
+    redondear_intervalos,
+    remuestrear_sesiones,
+)
+from visualization import calcular_intervalos_sesiones
+
+
+@pytest.fixture
+def df_granular():
+    # Finales fuera de la rejilla de 100 m: 80 m tras el km 5 y 190 m tras el km 5
+    return pd.concat([
+        sesion("a", 5080, 2.5),
+        sesion("b", 5190, 3.0),
+        sesion("c", 3000, 2.0),
+    ], ignore_index=True)
+
+
+def test_final_real_de_cada_sesion(df_granular):
+    archivos, _, _, dist_final_m, t_final_s = remuestrear_sesiones(df_granular)
+    assert list(archivos) == ["a", "b", "c"]
+    assert dist_final_m == pytest.approx([5080, 5190, 3000])
+    assert t_final_s == pytest.approx([2032, 1730, 1500])
+
+
+def test_intervalos_coinciden_con_el_calculo_por_puntos(df_granular):
+    archivos, _, matriz, dist_final_m, t_final_s = remuestrear_sesiones(df_granular)
+    rejilla = intervalos_desde_rejilla(archivos, matriz, dist_final_m, t_final_s)
+    puntos = calcular_intervalos_sesiones(df_granular, archivos)
+    pd.testing.assert_frame_equal(
+        rejilla[["archivo", "intervalo", "ritmo_intervalo"]],
+        puntos[["archivo", "intervalo", "ritmo_intervalo"]].sort_values(["archivo", "intervalo"], ignore_index=True),
+        check_dtype=False, rtol=1e-4,
+    )
+    assert rejilla.loc[rejilla["archivo"] == "a", "intervalo"].max() == pytest.approx(5.08)
+    assert rejilla.loc[rejilla["archivo"] == "b", "intervalo"].max() == pytest.approx(5.19)
+
+
+def test_perfil_coincide_con_la_agrupacion(df_granular):
+    archivos, _, matriz, dist_final_m, t_final_s = remuestrear_sesiones(df_granular)
+    intervalos = intervalos_desde_rejilla(archivos, matriz, dist_final_m, t_final_s)
+    intervalos["intervalo_redondeado"] = redondear_intervalos(intervalos["intervalo"], intervalos["intervalo"].max())
+    esperado = intervalos.groupby("intervalo_redondeado", as_index=False).agg(
+        ritmo_prom=("ritmo_intervalo", "mean"), ritmo_std=("ritmo_intervalo", "std")
+    )
+    pd.testing.assert_frame_equal(
+        perfil_ritmo_desde_rejilla(matriz, dist_final_m, t_final_s), esperado, check_dtype=False, rtol=1e-6
+    )
+    assert np.isnan(esperado["ritmo_std"].iloc[-1])
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import sesion
+from metricas import comparar_sesiones, matriz_splits
+
+
+@pytest.fixture
+def splits():
+    df = pd.concat([sesion("a", 3500, 2.5), sesion("b", 2000, 3.125)], ignore_index=True)
+    return matriz_splits(df)
+
+
+def test_matriz_splits_por_km_completo(splits):
+    archivos, matriz = splits
+    assert list(archivos) == ["a", "b"]
+    assert matriz.shape == (2, 3)
+    assert matriz[0] == pytest.approx(1000 / 2.5 / 60, rel=1e-3)
+    assert matriz[1, :2] == pytest.approx(1000 / 3.125 / 60, rel=1e-3)
+    assert np.isnan(matriz[1, 2])
+
+
+def test_matriz_splits_vacia():
+    archivos, matriz = matriz_splits(pd.DataFrame())
+    assert len(archivos) == 0 and matriz.shape == (0, 0)
+
+
+def test_comparar_sesiones_solo_km_comunes(splits):
+    archivos, matriz = splits
+    comparacion = comparar_sesiones(archivos, matriz, "a", "b")
+    assert comparacion["km"].tolist() == [1, 2]
+    assert comparacion[["ritmo_a", "ritmo_b", "diferencia"]].notna().all().all()
+    assert (comparacion["diferencia"] < 0).all()
+
+
+def test_comparar_sesiones_archivo_inexistente(splits):
+    archivos, matriz = splits
+    assert comparar_sesiones(archivos, matriz, "a", "zzz").empty
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import analisis_ia
+
+FRAGMENTOS = ["Llevas 42 km", " esta semana. Tu ritmo medio es 5.", "30 min/km. Mantén", " la constancia. Esta frase queda"]
+
+
+class ServidorSSE(BaseHTTPRequestHandler):
+    """chat/completions en modo stream que responde 503 a las dos primeras peticiones."""
+    peticiones = []
+
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        ServidorSSE.peticiones.append((self.path, cuerpo))
+        if len(ServidorSSE.peticiones) <= 2:
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for fragmento in FRAGMENTOS:
+            evento = {"choices": [{"delta": {"content": fragmento}}]}
+            self.wfile.write(f"data: {json.dumps(evento)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(0.01)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor(monkeypatch):
+    """Servidor SSE local, sesión HTTP nueva y el backend compatible con OpenAI apuntando a él."""
+    ServidorSSE.peticiones = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ServidorSSE)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    monkeypatch.setattr(analisis_ia, "_sesion_http", None)
+    monkeypatch.setenv("IA_BACKEND", "openai")
+    monkeypatch.setenv("IA_BASE_URL", url)
+    yield url
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class Contenedor:
+    """Sustituto de st.empty() que guarda cada texto mostrado."""
+
+    def __init__(self):
+        self.textos = []
+
+    def markdown(self, texto):
+        self.textos.append(texto)
+
+
+def test_fragmentos_tras_reintentar_los_503(servidor):
+    mensajes = analisis_ia.construir_mensajes("contexto", "¿Cómo voy?")
+    fragmentos = list(analisis_ia._fragmentos_chat_completions(servidor, None, "modelo", mensajes))
+    assert fragmentos == FRAGMENTOS
+    assert len(ServidorSSE.peticiones) == 3
+    ruta, cuerpo = ServidorSSE.peticiones[-1]
+    assert ruta == "/v1/chat/completions"
+    assert cuerpo["stream"] is True
+
+
+def test_muestra_solo_frases_completas_y_registra_tiempos(servidor, caplog):
+    contenedor = Contenedor()
+    with caplog.at_level("INFO", logger="analisis_ia"):
+        texto = analisis_ia.analizar_con_ia("contexto", "¿Cómo voy?", contenedor)
+    assert texto == "".join(FRAGMENTOS)
+    # El "5." del ritmo no corta la frase hasta que llega el resto del decimal
+    assert contenedor.textos == [
+        "Llevas 42 km esta semana.",
+        "Llevas 42 km esta semana. Tu ritmo medio es 5.30 min/km.",
+        "Llevas 42 km esta semana. Tu ritmo medio es 5.30 min/km. Mantén la constancia.",
+    ]
+    assert len(ServidorSSE.peticiones) == 3
+    assert any("primer fragmento" in r.getMessage() for r in caplog.records)
+
+
+def test_fin_frases_completas_incremental():
+    texto = "Hola. Tu ritmo es 5."
+    assert analisis_ia.fin_frases_completas(texto) == len("Hola.")
+    texto += "30 min/km. Sigue"
+    assert analisis_ia.fin_frases_completas(texto, len("Hola.")) == len("Hola. Tu ritmo es 5.30 min/km.")
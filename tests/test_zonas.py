@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from conftest import sesion
+from metricas import (
+    LIMITES_ZONAS_RITMO,
+    formatear_limites_zonas,
+    parsear_limites_zonas,
+    ritmo_decimal_a_min_seg,
+    tiempo_en_zonas,
+)
+
+
+def test_ritmo_constante_cae_en_una_zona():
+    # 3.5 m/s = 4:46 min/km (zona 4:30-5:00); 2.5 m/s = 6:40 min/km (> 6:30)
+    df = pd.concat([sesion("rapida", segundos=600, velocidad=3.5), sesion("lenta", segundos=900)], ignore_index=True)
+    archivos, nombres, segundos = tiempo_en_zonas(df)
+    assert list(archivos) == ["lenta", "rapida"]
+    assert len(nombres) == len(LIMITES_ZONAS_RITMO) + 1
+    assert segundos.sum(axis=1) == pytest.approx([900, 600])
+    assert segundos[0, -1] == pytest.approx(900)
+    assert segundos[1, nombres.index("4:30-5:00")] == pytest.approx(600)
+
+
+def test_paradas_cuentan_en_la_zona_mas_lenta():
+    df = sesion("parada", segundos=100, velocidad=0.0)
+    _, _, segundos = tiempo_en_zonas(df)
+    assert segundos[0, -1] == pytest.approx(100)
+
+
+def test_sin_datos():
+    archivos, nombres, segundos = tiempo_en_zonas(pd.DataFrame())
+    assert len(archivos) == 0 and segundos.shape == (0, len(nombres))
+
+
+def test_limites_ida_y_vuelta():
+    assert parsear_limites_zonas(formatear_limites_zonas()) == pytest.approx(LIMITES_ZONAS_RITMO)
+    assert parsear_limites_zonas("5:00; 4.5, 5") == (4.5, 5.0)
+    with pytest.raises(ValueError):
+        parsear_limites_zonas(" , ")
+
+
+def test_formato_min_seg():
+    assert ritmo_decimal_a_min_seg(5.5) == "5:30"
+    assert ritmo_decimal_a_min_seg(4.999) == "5:00"
@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import os
 import re
+import json
 
 from bokeh.models import (
     ColumnDataSource, 
@@ -11,20 +13,64 @@ from bokeh.models import (
     WheelZoomTool, 
     Span, 
     Label,
-    HoverTool
+    HoverTool,
+    LinearColorMapper,
+    ColorBar
 )
 
 from bokeh.plotting import figure
-from bokeh.palettes import Category10, Category20, Turbo256
-from scipy.stats import norm
+from bokeh.layouts import column
+from bokeh.palettes import Category10, Category20, Turbo256, RdYlBu, Greens
 from datetime import datetime
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
+
+from memoria import memorizar
+from metricas import (
+    PASO_REJILLA_M,
+    intervalos_desde_rejilla,
+    perfil_ritmo_desde_rejilla,
+    redondear_intervalos,
+    bandas_percentiles_splits,
+    comparar_sesiones,
+    tiempo_en_zonas_por_mes,
+    construir_cubo_temporal,
+    nombre_mes,
+    MAX_PUNTOS_SERIE,
+    MAX_PUNTOS_DISPERSION,
+    submuestrear,
+    serie_sesion,
+    intervalos_gap,
+    ritmo_decimal_a_min_seg
+)
 
 # Alto estándar para gráficos
 PLOT_HEIGHT = 350
 
+# Semanas mostradas en la vista semanal y en el calendario de kilómetros
+SEMANAS_VISTA = 26
+SEMANAS_CALENDARIO = 53
+DIAS_SEMANA = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
+
+# Sesiones por página en cada mes de la tabla resumen
+SESIONES_POR_PAGINA = 25
+
+# Parámetros del bootstrap para el intervalo de confianza de la predicción
+N_REMUESTREOS_BOOTSTRAP = 5000
+NIVEL_CONFIANZA = 0.90
+SEMILLA_BOOTSTRAP = 42
+
+# Colores de los gráficos de predicción (5K, 10K, media, maratón)
+COLORES_PREDICCION = ['#6A994E', '#E76F51', '#2A9D8F', '#F4A261']
+
+# Clustering: a partir de este número de sesiones se usa el modo de gran volumen.
+# Cruce medido con `python benchmark.py clustering`: por debajo de ~2500 sesiones
+# el barrido completo no llega a tardar el doble; en 3000 ya tarda ~2.3 veces más.
+UMBRAL_SESIONES_GRAN_VOLUMEN = 3000
+MUESTRA_SILHOUETTE = 2000
+
+# Asignación incremental: se reajusta si la inercia media de las sesiones
+# nuevas supera en este porcentaje la del modelo guardado
+UMBRAL_DERIVA_INERCIA = 0.5
+
 # ===========================
 
 def minseg_formatter():
@@ -42,13 +88,6 @@ def minseg_formatter():
         }
     """)
 
-# ===========================
-
-def ritmo_decimal_a_min_seg(decimal_ritmo):
-    minutos = int(decimal_ritmo)
-    segundos = int(round((decimal_ritmo - minutos) * 60))
-    return f"{minutos}:{segundos:02d}"
-
 # ========================
 def ritmo_decimal_a_hora_min_seg(minutos_decimales):
     horas = int(minutos_decimales // 60)
@@ -57,7 +96,55 @@ def ritmo_decimal_a_hora_min_seg(minutos_decimales):
     return f"{horas}:{minutos:02d}:{segundos:02d}"
 
 # ===========================
+def agregar_kilometros_por_mes(cubo, mes_actual):
+    """
+    Kilómetros y sesiones por mes de los 12 meses que terminan en mes_actual
+    ('YYYY-MM') y su resumen textual, leídos del cubo temporal
+    (metricas.construir_cubo_temporal).
+    Devuelve (km_por_mes, meses, resumen) o None si no hay fechas válidas.
+    """
+    if cubo["mes"].empty:
+        return None
+
+    # Generación de rango de meses
+    meses = pd.date_range(end=pd.Period(mes_actual, freq='M').to_timestamp(), periods=12, freq='MS').strftime('%Y-%m').tolist()
+
+    # Meses del cubo reindexados a los 12 meses mostrados
+    por_mes = cubo["mes"].assign(mes=cubo["mes"]["periodo"].dt.strftime('%Y-%m')).set_index('mes')
+    km_por_mes = por_mes.reindex(meses)[['distancia', 'sesiones']].fillna(0).rename_axis('mes').reset_index()
+    km_por_mes['distancia_acum'] = km_por_mes['distancia'].cumsum()
+
+    # --- Resumen anual ---
+    resumen_anual = cubo["anio"][cubo["anio"]["sesiones"] > 0]
 
+    # --- Mes más y menos activo ---
+    if (km_por_mes['distancia'] == 0).any():
+        meses_minimos = km_por_mes.loc[km_por_mes['distancia'] == 0, 'mes'].tolist()
+        mes_min_txt = ", ".join(meses_minimos)
+        valor_min = 0.0
+    else:
+        mes_min = km_por_mes.loc[km_por_mes['distancia'].idxmin()]
+        mes_min_txt = mes_min['mes']
+        valor_min = mes_min['distancia']
+
+    mes_max = km_por_mes.loc[km_por_mes['distancia'].idxmax()]
+
+    # Construir resumen textual
+    lineas = ["Resumen anual:"]
+    for fila in resumen_anual.itertuples():
+        lineas.append(f"- {fila.periodo.year}: {round(fila.distancia, 1)} km ({fila.sesiones} sesiones)")
+
+    lineas.append("\nKilómetros por mes:")
+    for _, row in km_por_mes.iterrows():
+        sesiones_txt = f"{int(row['sesiones'])} sesión" if row['sesiones'] == 1 else f"{int(row['sesiones'])} sesiones"
+        lineas.append(f"- {row['mes']}: {row['distancia']} km ({sesiones_txt}, acumulado: {row['distancia_acum']} km)")
+
+    lineas.append(f"\nMes más activo: {mes_max['mes']} ({mes_max['distancia']} km)")
+    lineas.append(f"Mes menos activo: {mes_min_txt} ({valor_min} km)")
+
+    return km_por_mes, meses, "\n".join(lineas)
+
+# ==========================
 def tab_kilometros_por_mes(df_sesion):
     """
     Genera un gráfico Bokeh con kilómetros mensuales y acumulados.
@@ -77,68 +164,18 @@ def tab_kilometros_por_mes(df_sesion):
             sizing_mode="stretch_width"
         )
     
-    # Copia para evitar modificar el DataFrame original
-    df = df_sesion.copy()
-    
-    # Conversión de fechas
-    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
-    df = df.dropna(subset=['fecha', 'distancia'])
-    
-    if df.empty:
+    agregado = agregar_kilometros_por_mes(construir_cubo_temporal(df_sesion), datetime.now().strftime('%Y-%m'))
+    if agregado is None:
         return figure(
             title="⚠️ No hay fechas válidas en los datos",
             height=PLOT_HEIGHT,
             toolbar_location=None,
             sizing_mode="stretch_width"
         )
-    
-    # Generación de rango de meses
-    hoy = pd.Timestamp(datetime.now())
-    meses = pd.date_range(end=hoy, periods=12, freq='MS').strftime('%Y-%m').tolist()
-    
-    # Agrupación y merge
-    df['mes'] = df['fecha'].dt.to_period('M').astype(str)
-    df['año'] = df['fecha'].dt.year
-    km_por_mes = df.groupby('mes', as_index=False)['distancia'].sum()
-    sesiones_por_mes = df.groupby('mes', as_index=False)['distancia'].count()
-    
-    df_completo = pd.DataFrame({'mes': meses})
-    km_por_mes = df_completo.merge(km_por_mes, on='mes', how='left').fillna(0)
-    sesiones_por_mes = df_completo.merge(sesiones_por_mes, on='mes', how='left').fillna(0)
-    km_por_mes['distancia_acum'] = km_por_mes['distancia'].cumsum()
-    km_por_mes['sesiones'] = sesiones_por_mes['distancia']
-    
-    # --- Resumen anual ---
-    resumen_anual = df.groupby('año').agg(distancia=('distancia', 'sum'), sesiones=('distancia', 'count')).reset_index()
-    resumen_anual['distancia'] = resumen_anual['distancia'].round(1)
-    
-    # --- Mes más y menos activo ---
-    if (km_por_mes['distancia'] == 0).any():
-        meses_minimos = km_por_mes.loc[km_por_mes['distancia'] == 0, 'mes'].tolist()
-        mes_min_txt = ", ".join(meses_minimos)
-        valor_min = 0.0
-    else:
-        mes_min = km_por_mes.loc[km_por_mes['distancia'].idxmin()]
-        mes_min_txt = mes_min['mes']
-        valor_min = mes_min['distancia']
-    
-    mes_max = km_por_mes.loc[km_por_mes['distancia'].idxmax()]
-    
-    # Construir resumen textual
-    lineas = ["Resumen anual:"]
-    for _, row in resumen_anual.iterrows():
-        lineas.append(f"- {row['año']}: {row['distancia']} km ({row['sesiones']} sesiones)")
-    
-    lineas.append("\nKilómetros por mes:")
-    for _, row in km_por_mes.iterrows():
-        sesiones_txt = f"{int(row['sesiones'])} sesión" if row['sesiones'] == 1 else f"{int(row['sesiones'])} sesiones"
-        lineas.append(f"- {row['mes']}: {row['distancia']} km ({sesiones_txt}, acumulado: {row['distancia_acum']} km)")
-    
-    lineas.append(f"\nMes más activo: {mes_max['mes']} ({mes_max['distancia']} km)")
-    lineas.append(f"Mes menos activo: {mes_min_txt} ({valor_min} km)")
-    
+    km_por_mes, meses, resumen_km = agregado
+
     # Guardar resumen en session_state
-    st.session_state["resumen_km"] = "\n".join(lineas)
+    st.session_state["resumen_km"] = resumen_km
     
     # --- CREACIÓN DEL GRÁFICO --- (sin cambios)
     max_mensual = km_por_mes['distancia'].max()
@@ -221,6 +258,84 @@ def tab_kilometros_por_mes(df_sesion):
     
     return p
 
+# ==========================
+def tab_kilometros_por_semana(df_sesion, semanas=SEMANAS_VISTA):
+    """
+    Kilómetros por semana ISO (lunes a domingo) de las últimas `semanas`
+    semanas, leídos del cubo temporal.
+    """
+    cubo = construir_cubo_temporal(df_sesion)
+    lunes_actual = pd.Timestamp(datetime.now()).normalize()
+    lunes_actual -= pd.Timedelta(days=lunes_actual.dayofweek)
+    inicios = pd.date_range(end=lunes_actual, periods=semanas, freq='7D')
+
+    tabla = cubo["semana"].set_index("periodo").reindex(inicios)[["distancia", "sesiones"]].fillna(0)
+    tabla = tabla.rename_axis("periodo").reset_index()
+    tabla["centro"] = tabla["periodo"] + pd.Timedelta(days=3.5)
+    tabla["etiqueta"] = tabla["periodo"].dt.strftime("%G-S%V")
+    tabla["desde"] = tabla["periodo"].dt.strftime("%d/%m")
+
+    p = figure(
+        x_axis_type="datetime",
+        height=PLOT_HEIGHT - 50,
+        toolbar_location=None,
+        tools="",
+        sizing_mode="stretch_width"
+    )
+    p.vbar(x="centro", top="distancia", width=pd.Timedelta(days=6).total_seconds() * 1000,
+           color="#2A9D8F", alpha=0.85, source=ColumnDataSource(tabla))
+    p.y_range.start = 0
+    p.yaxis.axis_label = "Kilómetros semanales"
+    p.xgrid.grid_line_color = None
+    p.add_tools(HoverTool(tooltips=[
+        ("Semana", "@etiqueta (desde @desde)"),
+        ("Km", "@distancia{0,0.0} km"),
+        ("Sesiones", "@sesiones")
+    ]))
+    p.background_fill_color = "#f9f9f9"
+    return p
+
+# ==========================
+def tab_calendario_km(df_sesion, semanas=SEMANAS_CALENDARIO):
+    """
+    Mapa de calor tipo calendario (semana × día de la semana) con los
+    kilómetros diarios del cubo temporal.
+    """
+    cubo = construir_cubo_temporal(df_sesion)
+    hoy = pd.Timestamp(datetime.now()).normalize()
+    inicio = hoy - pd.Timedelta(days=hoy.dayofweek) - pd.Timedelta(weeks=semanas - 1)
+    dias = pd.date_range(inicio, hoy, freq="D")
+
+    tabla = cubo["dia"].set_index("periodo").reindex(dias)[["distancia", "sesiones"]].fillna(0)
+    tabla = tabla.rename_axis("fecha").reset_index()
+    tabla["semana"] = tabla["fecha"] - pd.to_timedelta(tabla["fecha"].dt.dayofweek, unit="D") + pd.Timedelta(days=3.5)
+    tabla["dia_semana"] = [DIAS_SEMANA[d] for d in tabla["fecha"].dt.dayofweek]
+    tabla["fecha_txt"] = tabla["fecha"].dt.strftime("%d/%m/%y")
+
+    mapper = LinearColorMapper(palette=list(reversed(Greens[9])), low=0,
+                               high=max(float(tabla["distancia"].max()), 1.0))
+    p = figure(
+        x_axis_type="datetime",
+        y_range=list(reversed(DIAS_SEMANA)),
+        height=230,
+        toolbar_location=None,
+        tools="",
+        sizing_mode="stretch_width"
+    )
+    p.rect(x="semana", y="dia_semana", width=pd.Timedelta(days=6.5).total_seconds() * 1000, height=0.9,
+           fill_color={"field": "distancia", "transform": mapper}, line_color=None,
+           source=ColumnDataSource(tabla))
+    p.add_layout(ColorBar(color_mapper=mapper, title="km", width=8), "right")
+    p.add_tools(HoverTool(tooltips=[
+        ("Fecha", "@fecha_txt"),
+        ("Km", "@distancia{0,0.0} km"),
+        ("Sesiones", "@sesiones")
+    ]))
+    p.grid.grid_line_color = None
+    p.axis.axis_line_color = None
+    p.axis.major_tick_line_color = None
+    return p
+
 # ============================  
 
 def extraer_fecha_desde_archivo(nombre_archivo):
@@ -273,40 +388,44 @@ def calcular_desniveles(df_granular, id_sesion=None):
 
 # =====================================
 
-def tab_prediccion(df_sesion, distancia_objetivo, df_granular, color_principal="#6A994E"):
-    if df_sesion is None or df_sesion.empty:
-        return None, None, "⚠️ No hay datos de sesiones para esta distancia."
-
-    cercanos = df_sesion
-
-    elevaciones = []
-    for _, fila in cercanos.iterrows():
-        archivo = fila["archivo"]
-        df_gran_sesion = df_granular[df_granular["archivo"] == archivo]
-        if df_gran_sesion.empty:
-            elevaciones.append({"elev_gain": np.nan, "elev_loss": np.nan})
-            continue
-        try:
-            desnivel = calcular_desniveles(df_gran_sesion, archivo)
-        except Exception as e:
-            print(f"⚠️ Error calculando desnivel para {archivo}: {e}")
-            desnivel = {"elev_gain": np.nan, "elev_loss": np.nan}
-        elevaciones.append(desnivel)
-
-    cercanos = cercanos.copy()
-    cercanos.loc[:, "elev_gain"] = [e["elev_gain"] for e in elevaciones]
-    cercanos.loc[:, "elev_loss"] = [e["elev_loss"] for e in elevaciones]
+def bootstrap_intervalo_prediccion(ritmos, elev_gains, distancia_objetivo,
+                                   n_remuestreos=N_REMUESTREOS_BOOTSTRAP,
+                                   nivel=NIVEL_CONFIANZA, semilla=SEMILLA_BOOTSTRAP):
+    """
+    Intervalo de confianza bootstrap del tiempo estimado (en minutos).
+    Todas las remuestras se sortean de una vez como una matriz de índices
+    (n_remuestreos x n_sesiones), remuestreando ritmo y desnivel en pareja
+    para que el ajuste por desnivel también varíe entre remuestras.
+    Devuelve (tiempo_inf, tiempo_sup) o None si hay menos de 2 sesiones.
+    """
+    ritmos = np.asarray(ritmos, dtype=float)
+    elev = np.asarray(elev_gains, dtype=float)
+    validos = np.isfinite(ritmos)
+    ritmos, elev = ritmos[validos], elev[validos]
+    if len(ritmos) < 2:
+        return None
+
+    # Sesiones sin desnivel calculado toman el desnivel medio (igual que .mean() los ignora)
+    elev_media = np.nanmean(elev) if np.isfinite(elev).any() else 0.0
+    elev = np.where(np.isfinite(elev), elev, elev_media)
+
+    rng = np.random.default_rng(semilla)
+    idx = rng.integers(0, len(ritmos), size=(n_remuestreos, len(ritmos)), dtype=np.int32)
+    ritmo_medio = ritmos[idx].mean(axis=1)
+    ajuste = 1 + (elev[idx].mean(axis=1) / 1000 * 0.015)
+    tiempos = distancia_objetivo * ritmo_medio * ajuste
+
+    alfa = (1 - nivel) / 2
+    tiempo_inf, tiempo_sup = np.quantile(tiempos, [alfa, 1 - alfa])
+    return float(tiempo_inf), float(tiempo_sup)
 
-    # --- Cálculo base de predicción ---
-    ritmo_promedio = cercanos["ritmo"].mean()
-    elev_prom = cercanos["elev_gain"].mean()
-    ajuste_desnivel = 1 + (elev_prom / 1000 * 0.015)
-    ritmo_ajustado = ritmo_promedio * ajuste_desnivel
-    tiempo_estimado_min = distancia_objetivo * ritmo_ajustado
+# =====================================
 
-    # --- Preparación de gráficos ---
-    archivos_usados = cercanos["archivo"].unique()
-    N = len(archivos_usados)
+def calcular_intervalos_sesiones(df_granular, archivos_usados):
+    """
+    Ritmo por tramos (0.1 km inicial, cada km y tramo final) de cada sesión,
+    buscando los cortes sobre los puntos GPS originales.
+    """
     registros = []
 
     for archivo in archivos_usados:
@@ -363,22 +482,127 @@ def tab_prediccion(df_sesion, distancia_objetivo, df_granular, color_principal="
                 {"archivo": archivo, "fecha": fecha, "intervalo": distancia_total_km, "ritmo_intervalo": ritmo}
             )
 
-    if not registros:
-        return None, None, "⚠️ No se pudieron calcular los ritmos por kilómetro."
+    return pd.DataFrame(registros, columns=["archivo", "fecha", "intervalo", "ritmo_intervalo"])
+
+# =====================================
+
+@memorizar
+def calcular_prediccion(df_sesion, distancia_objetivo, df_granular, usar_gap=False, rejilla=None):
+    """
+    Parte numérica de tab_prediccion (desniveles, ritmo ajustado, intervalo
+    bootstrap y ritmos por km), memorizada por contenido de las sesiones.
+    Devuelve (datos, None) o (None, mensaje de aviso).
+    """
+    if df_sesion is None or df_sesion.empty:
+        return None, "⚠️ No hay datos de sesiones para esta distancia."
+
+    cercanos = df_sesion
+
+    elevaciones = []
+    for _, fila in cercanos.iterrows():
+        archivo = fila["archivo"]
+        df_gran_sesion = df_granular[df_granular["archivo"] == archivo]
+        if df_gran_sesion.empty:
+            elevaciones.append({"elev_gain": np.nan, "elev_loss": np.nan})
+            continue
+        try:
+            desnivel = calcular_desniveles(df_gran_sesion, archivo)
+        except Exception as e:
+            print(f"⚠️ Error calculando desnivel para {archivo}: {e}")
+            desnivel = {"elev_gain": np.nan, "elev_loss": np.nan}
+        elevaciones.append(desnivel)
+
+    cercanos = cercanos.copy()
+    cercanos.loc[:, "elev_gain"] = [e["elev_gain"] for e in elevaciones]
+    cercanos.loc[:, "elev_loss"] = [e["elev_loss"] for e in elevaciones]
+
+    # --- Cálculo base de predicción ---
+    usar_gap = usar_gap and "ritmo_gap" in cercanos.columns and cercanos["ritmo_gap"].notna().any()
+    if usar_gap:
+        ritmos_base = cercanos["ritmo_gap"]
+        elev_base = np.zeros(len(cercanos))
+    else:
+        ritmos_base = cercanos["ritmo"]
+        elev_base = cercanos["elev_gain"].to_numpy()
 
-    df_intervalos = pd.DataFrame(registros)
-    dist_max = df_intervalos["intervalo"].max()
-    df_intervalos["intervalo_redondeado"] = df_intervalos["intervalo"].apply(
-        lambda x: x if np.isclose(x, dist_max) or x <= 0.2 else round(x)
+    ritmo_promedio = ritmos_base.mean()
+    elev_prom = np.nanmean(elev_base) if np.isfinite(elev_base).any() else np.nan
+    ajuste_desnivel = 1 + (elev_prom / 1000 * 0.015)
+    ritmo_ajustado = ritmo_promedio * ajuste_desnivel
+    tiempo_estimado_min = distancia_objetivo * ritmo_ajustado
+    intervalo_confianza = bootstrap_intervalo_prediccion(
+        ritmos_base.to_numpy(), elev_base, distancia_objetivo
     )
 
-    df_prom = (
-        df_intervalos.groupby("intervalo_redondeado", as_index=False)
-        .agg(ritmo_prom=("ritmo_intervalo", "mean"), ritmo_std=("ritmo_intervalo", "std"))
+    # --- Ritmos por km de las sesiones usadas ---
+    archivos_usados = cercanos["archivo"].unique()
+    df_prom = None
+    if usar_gap:
+        # Splits GAP por km (metricas.calcular_gap sobre los puntos de estas sesiones)
+        df_intervalos = intervalos_gap(df_granular, archivos_usados)
+        df_intervalos["fecha"] = df_intervalos["archivo"].map(extraer_fecha_desde_archivo)
+    elif rejilla is not None:
+        # Tramos calculados sobre la rejilla de distancia ya remuestreada
+        archivos_rejilla, rejilla_m, matriz_tiempo, dist_final_m, t_final_s = rejilla
+        seleccion = np.isin(archivos_rejilla, archivos_usados)
+        paso_m = rejilla_m[1] - rejilla_m[0] if len(rejilla_m) > 1 else PASO_REJILLA_M
+        tramos = (matriz_tiempo[seleccion], dist_final_m[seleccion], t_final_s[seleccion], paso_m)
+        df_intervalos = intervalos_desde_rejilla(archivos_rejilla[seleccion], *tramos)
+        df_intervalos["fecha"] = df_intervalos["archivo"].map(extraer_fecha_desde_archivo)
+        # Perfil medio por km reduciendo la matriz de tramos por columnas
+        df_prom = perfil_ritmo_desde_rejilla(*tramos)
+    else:
+        df_intervalos = calcular_intervalos_sesiones(df_granular, archivos_usados)
+
+    if df_intervalos.empty:
+        return None, "⚠️ No se pudieron calcular los ritmos por kilómetro."
+
+    df_intervalos["intervalo_redondeado"] = redondear_intervalos(
+        df_intervalos["intervalo"], df_intervalos["intervalo"].max()
     )
+    if df_prom is None:
+        df_prom = (
+            df_intervalos.groupby("intervalo_redondeado", as_index=False)
+            .agg(ritmo_prom=("ritmo_intervalo", "mean"), ritmo_std=("ritmo_intervalo", "std"))
+        )
     df_prom["ritmo_min"] = df_prom["ritmo_prom"] - df_prom["ritmo_std"]
     df_prom["ritmo_max"] = df_prom["ritmo_prom"] + df_prom["ritmo_std"]
 
+    return {
+        "n_sesiones": len(archivos_usados),
+        "usar_gap": bool(usar_gap),
+        "ritmo_ajustado": ritmo_ajustado,
+        "tiempo_estimado_min": tiempo_estimado_min,
+        "intervalo_confianza": intervalo_confianza,
+        "df_intervalos": df_intervalos,
+        "df_prom": df_prom,
+    }, None
+
+# =====================================
+
+def tab_prediccion(df_sesion, distancia_objetivo, df_granular, color_principal="#6A994E", usar_gap=False,
+                   rejilla=None):
+    """
+    Predice el tiempo para distancia_objetivo a partir de las sesiones cercanas.
+    Con usar_gap=True se parte del ritmo ajustado por pendiente (ritmo_gap),
+    que ya corrige el terreno, y no se aplica el ajuste por desnivel medio.
+    Si se pasa rejilla (resultado de metricas.remuestrear_sesiones), los ritmos
+    por km salen de la matriz remuestreada en lugar de buscar en los puntos GPS.
+    Los cálculos salen de calcular_prediccion (memorizada); aquí sólo se
+    construyen los gráficos y el resumen.
+    """
+    datos, aviso = calcular_prediccion(df_sesion, distancia_objetivo, df_granular, usar_gap, rejilla)
+    if datos is None:
+        return None, None, aviso
+
+    N = datos["n_sesiones"]
+    usar_gap = datos["usar_gap"]
+    ritmo_ajustado = datos["ritmo_ajustado"]
+    tiempo_estimado_min = datos["tiempo_estimado_min"]
+    intervalo_confianza = datos["intervalo_confianza"]
+    df_intervalos = datos["df_intervalos"]
+    df_prom = datos["df_prom"]
+
     # --- Ajuste para línea y área hasta distancia objetivo o máxima ---
     max_dist_sesiones = df_intervalos["intervalo"].max()
     try:
@@ -401,10 +625,11 @@ def tab_prediccion(df_sesion, distancia_objetivo, df_granular, color_principal="
     h, l, s = colorsys.rgb_to_hls(rgb[0]/255, rgb[1]/255, rgb[2]/255)
     color_oscuro = '#%02x%02x%02x' % tuple(int(c*255) for c in colorsys.hls_to_rgb(h, max(0, l-0.2), s))
 
+    etiqueta_ritmo = "Ritmo GAP (min/km)" if usar_gap else "Ritmo (min/km)"
     p1 = figure(
         title=f"{N} sesiones utilizadas en la predicción",
         x_axis_label="Distancia (km)",
-        y_axis_label="Ritmo (min/km)",
+        y_axis_label=etiqueta_ritmo,
         height=PLOT_HEIGHT - 50,
         y_range=(y_min, y_max),
         x_range=(0, limite_linea + 0.2),
@@ -432,7 +657,7 @@ def tab_prediccion(df_sesion, distancia_objetivo, df_granular, color_principal="
 
     p2 = figure(
         title="Histograma de ritmos por intervalo",
-        x_axis_label="Ritmo (min/km)",
+        x_axis_label=etiqueta_ritmo,
         y_axis_label="Frecuencia",
         height=PLOT_HEIGHT - 50,
         toolbar_location=None,
@@ -441,6 +666,8 @@ def tab_prediccion(df_sesion, distancia_objetivo, df_granular, color_principal="
 
     p2.quad(top=hist, bottom=0, left=edges[:-1], right=edges[1:],
             fill_color="#F7C948", line_color="#5F4B8B", alpha=1)
+    from scipy.stats import norm
+
     mu, std = norm.fit(ritmos_min)
     x = np.linspace(float(ritmos_min.min()), float(ritmos_min.max()), 100)
     y = norm.pdf(x, mu, std) * len(ritmos_min) * (edges[1] - edges[0])
@@ -460,31 +687,66 @@ def tab_prediccion(df_sesion, distancia_objetivo, df_granular, color_principal="
 
     # --- Resumen ---
     resumen = f"Tiempo estimado: {tiempo_str} (h:m:s)"
+    texto_ic = ""
+    if intervalo_confianza is not None:
+        ic_inf, ic_sup = intervalo_confianza
+        texto_ic = (f" (IC {NIVEL_CONFIANZA:.0%}: {ritmo_decimal_a_hora_min_seg(ic_inf)}"
+                    f" - {ritmo_decimal_a_hora_min_seg(ic_sup)})")
+        resumen += texto_ic
 
     # Guardar en session_state
-    resumen_contexto = f"Tiempo estimado para {dist_obj_val:.1f} km: {tiempo_str} (h:m:s)"
+    resumen_contexto = f"Tiempo estimado para {dist_obj_val:.1f} km: {tiempo_str} (h:m:s){texto_ic}"
+    if usar_gap:
+        resumen_contexto += " [basado en ritmo ajustado por pendiente (GAP), terreno llano]"
     st.session_state["resumen_prediccion"] = resumen_contexto
 
     return p1, p2, resumen
 
 # ==========================
-def mostrar_tabla_resumen_con_expansion(df_sesion):
-    
-    MES_NOMBRES = [
-        "", "enero", "febrero", "marzo", "abril", "mayo", "junio",
-        "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"
-    ]
+ICONO_FILA_SESION = (
+    '<svg xmlns="http://www.w3.org/2000/svg" height="22px" viewBox="0 -960 960 960" '
+    'width="40px" fill="#434343">'
+    '<path d="m216-160-56-56 384-384H440v80h-80v-160h233q16 0 31 6t26 17l120 '
+    '119q27 27 66 42t84 16v80q-62 0-112.5-19T718-476l-40-42-88 88 90 90-262 '
+    '151-40-69 172-99-68-68-266 265Zm-96-280v-80h200v80H120ZM40-560v-80h200v80H40Zm739-80q-33 '
+    '0-57-23.5T698-720q0-33 24-56.5t57-23.5q33 0 57 23.5t24 56.5q0 33-24 56.5T779-640Zm-659-40v-80h200v80H120Z"/>'
+    '</svg>'
+)
 
-    ICONO_SVG = (
-        '<svg xmlns="http://www.w3.org/2000/svg" height="22px" viewBox="0 -960 960 960" '
-        'width="40px" fill="#434343">'
-        '<path d="m216-160-56-56 384-384H440v80h-80v-160h233q16 0 31 6t26 17l120 '
-        '119q27 27 66 42t84 16v80q-62 0-112.5-19T718-476l-40-42-88 88 90 90-262 '
-        '151-40-69 172-99-68-68-266 265Zm-96-280v-80h200v80H120ZM40-560v-80h200v80H40Zm739-80q-33 '
-        '0-57-23.5T698-720q0-33 24-56.5t57-23.5q33 0 57 23.5t24 56.5q0 33-24 56.5T779-640Zm-659-40v-80h200v80H120Z"/>'
-        '</svg>'
+@memorizar
+def paginas_html_sesiones(df, por_pagina=SESIONES_POR_PAGINA):
+    """
+    Filas HTML de la tabla de sesiones agrupadas por mes (inicio de mes) y
+    troceadas en páginas de por_pagina sesiones; cada página es un solo bloque
+    HTML, así que se pinta con un único st.markdown.
+    df necesita fecha, distancia (km) y tiempo (min).
+    Devuelve un dict periodo -> lista de páginas.
+    """
+    df = df[df["fecha"].notna()].sort_values("fecha", ascending=False)
+    dist_txt = df["distancia"].map(lambda d: f"{d:.2f} km" if pd.notna(d) else "-")
+    tiempo_txt = df["tiempo"].map(lambda t: ritmo_decimal_a_hora_min_seg(t) if pd.notna(t) else "-")
+    fecha_txt = df["fecha"].dt.strftime("%d/%m/%y")
+
+    filas = (
+        '<div class="sesion-row"><div class="sesion-left">'
+        f'<div class="sesion-icon">{ICONO_FILA_SESION}</div>'
+        '<div class="sesion-info"><strong>' + dist_txt + '</strong><br>'
+        '<span style="color:#444;">' + tiempo_txt + '</span></div></div>'
+        '<div class="sesion-date">' + fecha_txt + '</div></div>'
     )
 
+    paginas = {}
+    for periodo, filas_mes in filas.groupby(df["fecha"].dt.to_period("M").dt.start_time, sort=False):
+        lista = filas_mes.tolist()
+        paginas[periodo] = ["".join(lista[i:i + por_pagina]) for i in range(0, len(lista), por_pagina)]
+    return paginas
+
+# ==========================
+def mostrar_tabla_resumen_con_expansion(df_sesion):
+    """
+    Un desplegable por mes (totales del cubo temporal) con sus sesiones,
+    paginadas y pintadas con un solo bloque HTML por página.
+    """
     if df_sesion is None or df_sesion.empty:
         st.info("No hay sesiones registradas.")
         return
@@ -517,26 +779,10 @@ def mostrar_tabla_resumen_con_expansion(df_sesion):
     if 'archivo' not in df.columns:
         df['archivo'] = df.index.astype(str)
 
-    def _mes_anio_from_row(row):
-        try:
-            mn = int(row['fecha'].month)
-            y = int(row['fecha'].year)
-            if 1 <= mn <= 12:
-                return f"{MES_NOMBRES[mn].capitalize()} {y}"
-            return "Sin fecha"
-        except Exception:
-            return "Sin fecha"
-
-    df['mes_anio'] = df.apply(_mes_anio_from_row, axis=1)
-    df['mes_num'] = df['fecha'].dt.month.fillna(0).astype(int)
-    df['anio'] = df['fecha'].dt.year.fillna(0).astype(int)
-
-    resumen = (
-        df.groupby(['anio', 'mes_num', 'mes_anio'], dropna=False)
-          .agg(sesiones=('archivo', 'count'), distancia_total=('distancia', 'sum'))
-          .reset_index()
-          .sort_values(['anio', 'mes_num'], ascending=[False, False])
-    )
+    # Totales por mes desde el cubo; las filas de cada mes ya vienen en páginas HTML
+    cubo = construir_cubo_temporal(df)
+    resumen = cubo["mes"][cubo["mes"]["sesiones"] > 0].sort_values("periodo", ascending=False)
+    paginas_por_mes = paginas_html_sesiones(df[['fecha', 'distancia', 'tiempo']])
 
     st.markdown("""
     <style>
@@ -556,47 +802,24 @@ def mostrar_tabla_resumen_con_expansion(df_sesion):
     </style>
     """, unsafe_allow_html=True)
 
-    for _, fila in resumen.iterrows():
-        mes_num = int(fila['mes_num'])
-        anio = int(fila['anio'])
-        sesiones = int(fila['sesiones'])
-        distancia_total = float(fila['distancia_total']) if not pd.isna(fila['distancia_total']) else 0.0
-
-        mes_nombre_upper = MES_NOMBRES[mes_num].upper() if 1 <= mes_num <= 12 else "SIN FECHA"
+    for fila in resumen.itertuples():
         # Orden correcto: barra + mes/año + distancia + sesiones
-        titulo = f"┃ {mes_nombre_upper} {anio} • {distancia_total:.2f} km • {sesiones} sesiones"
+        titulo = f"┃ {nombre_mes(fila.periodo, mayusculas=True)} • {fila.distancia:.2f} km • {fila.sesiones} sesiones"
 
         with st.expander(titulo):
-            df_mes = df[(df['mes_num'] == mes_num) & (df['anio'] == anio)].sort_values('fecha', ascending=False)
-            if df_mes.empty:
+            paginas = paginas_por_mes.get(fila.periodo, [])
+            if not paginas:
                 st.info("No hay sesiones para este mes.")
                 continue
 
-            for _, s in df_mes.iterrows():
-                try:
-                    dist_text = f"{float(s['distancia']):.2f} km"
-                except Exception:
-                    dist_text = "-"
-
-                tiempo_val = s.get('tiempo', None)
-                tiempo_text = ritmo_decimal_a_hora_min_seg(tiempo_val)
-                fecha_text = s['fecha'].strftime("%d/%m/%y") if pd.notna(s['fecha']) else "-"
-
-                st.markdown(
-                    f"""
-                    <div class="sesion-row">
-                        <div class="sesion-left">
-                            <div class="sesion-icon">{ICONO_SVG}</div>
-                            <div class="sesion-info">
-                                <strong>{dist_text}</strong><br>
-                                <span style="color:#444;">{tiempo_text}</span>
-                            </div>
-                        </div>
-                        <div class="sesion-date">{fecha_text}</div>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
+            # Meses largos: una página de sesiones cada vez
+            pagina = 1
+            if len(paginas) > 1:
+                pagina = st.number_input(
+                    f"Página (de {len(paginas)})", min_value=1, max_value=len(paginas), value=1,
+                    key=f"pagina_sesiones_{fila.periodo:%Y%m}"
                 )
+            st.markdown(paginas[pagina - 1], unsafe_allow_html=True)
 
 # =======================
 def get_palette(n):
@@ -611,7 +834,184 @@ def get_palette(n):
         return [Turbo256[i * step] for i in range(n)]
 
 # ==========================
-def tab_clustering(df_sesion, solo_objeto=False):
+def asignar_nombre_cluster(dist_media, ritmo_medio):
+    """
+    Nombre del tipo de sesión a partir de la distancia y el ritmo medios del cluster.
+    Sólo depende de las medias, así que es el mismo con cualquier modo de clustering.
+    """
+    if dist_media < 3:
+        return "Sprint / Muy Corta"
+    elif dist_media < 6:
+        return "Corta / Rápida" if ritmo_medio < 5.0 else "Corta / Suave"
+    elif dist_media < 10:
+        return "Media / Rápida" if ritmo_medio < 5.5 else "Media / Moderada"
+    elif dist_media < 15:
+        return "10K / Tempo" if ritmo_medio < 5.5 else "10K / Base"
+    elif dist_media < 25:
+        return "Media Maratón / Tempo" if ritmo_medio < 6.0 else "Larga / Constante"
+    else:
+        return "Maratón / Competencia" if ritmo_medio < 6.0 else "Muy Larga / Recuperación"
+
+# ==========================
+@memorizar
+def _escalar_features(X):
+    """StandardScaler ajustado y matriz escalada, memorizados por el contenido de la matriz de features."""
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    return scaler, scaler.fit_transform(X)
+
+# ==========================
+def _evaluar_k(X_scaled, k, gran_volumen=False):
+    # scikit-learn sólo se importa al agrupar (cuesta ~0.5 s al arrancar)
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    if gran_volumen:
+        # Mini-batch y silhouette estimada sobre una muestra: evita el coste O(n²)
+        model = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=1024)
+        labels = model.fit_predict(X_scaled)
+        score = silhouette_score(X_scaled, labels, sample_size=min(MUESTRA_SILHOUETTE, len(X_scaled)),
+                                 random_state=42)
+    else:
+        model = KMeans(n_clusters=k, random_state=42, n_init=10)
+        labels = model.fit_predict(X_scaled)
+        score = silhouette_score(X_scaled, labels)
+    return k, score, model, labels
+
+# ==========================
+@memorizar
+def _ajustar_kmeans(X_scaled, umbral_gran_volumen=UMBRAL_SESIONES_GRAN_VOLUMEN, hilos=None):
+    """
+    Barrido de k (2..7) en paralelo y selección por silhouette.
+    Por encima de umbral_gran_volumen sesiones se usa MiniBatchKMeans y una
+    silhouette muestreada (ver `python benchmark.py clustering`).
+    hilos limita los ajustes simultáneos (por defecto, uno por núcleo); con
+    hilos=1 el barrido es secuencial y no cambia los límites de OpenMP/BLAS.
+    Se memoriza por el contenido de la matriz (memoria.py), así que los reruns,
+    el reporte HTML y otros usuarios con los mismos datos reutilizan el modelo.
+    Devuelve (best_k, modelo, labels, silhouette).
+    """
+    gran_volumen = len(X_scaled) > umbral_gran_volumen
+    possible_k = list(range(2, min(8, len(X_scaled))))
+    nucleos = os.cpu_count() or 1
+    hilos = max(1, min(len(possible_k), hilos or nucleos))
+    if hilos == 1:
+        resultados = [_evaluar_k(X_scaled, k, gran_volumen) for k in possible_k]
+    else:
+        from joblib import Parallel, delayed
+        from threadpoolctl import threadpool_limits
+
+        # Cada ajuste ya usa OpenMP/BLAS en todos los núcleos: se reparten entre
+        # los hilos del barrido para no lanzar hilos × núcleos a la vez
+        with threadpool_limits(max(1, nucleos // hilos)):
+            resultados = Parallel(n_jobs=hilos, prefer="threads")(
+                delayed(_evaluar_k)(X_scaled, k, gran_volumen) for k in possible_k
+            )
+    # Con random_state fijo el modelo del barrido es idéntico a reajustarlo con best_k
+    best_k, score, model_final, labels = max(resultados, key=lambda x: x[1])
+    return best_k, model_final, labels, score
+
+# ==========================
+def _distancias_a_centroides(modelo, X):
+    """Distancia cuadrada de cada fila de X (sin escalar) a cada centroide del modelo."""
+    X_scaled = (np.asarray(X, dtype=float) - modelo["media"]) / modelo["escala"]
+    return ((X_scaled[:, None, :] - modelo["centroides"][None, :, :]) ** 2).sum(axis=2)
+
+# ==========================
+def crear_modelo_clusters(columnas, scaler, model, labels, archivos, silhouette):
+    """
+    Guarda lo necesario para asignar sesiones nuevas sin reajustar: columnas,
+    media/escala del StandardScaler, centroides, etiqueta de cada sesión
+    conocida, inercia media por sesión y silhouette del ajuste.
+    """
+    modelo = {
+        "columnas": list(columnas),
+        "media": np.asarray(scaler.mean_, dtype=float),
+        "escala": np.asarray(scaler.scale_, dtype=float),
+        "centroides": np.asarray(model.cluster_centers_, dtype=float),
+        "labels": {str(a): int(l) for a, l in zip(archivos, labels)},
+        "silhouette": float(silhouette),
+        "nombres": {},
+    }
+    modelo["inercia_media"] = float(model.inertia_) / max(len(labels), 1)
+    return modelo
+
+# ==========================
+def asignar_clusters_incremental(modelo, X, archivos, umbral_deriva=UMBRAL_DERIVA_INERCIA):
+    """
+    Etiqueta las sesiones con el modelo guardado: las conocidas conservan su
+    cluster y las nuevas se asignan al centroide más cercano (O(sesiones nuevas)).
+    Devuelve (etiquetas, modelo actualizado con las sesiones nuevas), sin tocar
+    el modelo recibido, o None si hay deriva, es decir, si la inercia media de
+    las sesiones nuevas supera en umbral_deriva la del modelo (hay que reajustar).
+    """
+    archivos = np.asarray(archivos, dtype=str)
+    conocidas = np.array([a in modelo["labels"] for a in archivos], dtype=bool)
+    labels = np.empty(len(archivos), dtype=int)
+    labels[conocidas] = [modelo["labels"][a] for a in archivos[conocidas]]
+
+    nuevas = ~conocidas
+    if nuevas.any():
+        distancias = _distancias_a_centroides(modelo, X[nuevas])
+        labels_nuevas = distancias.argmin(axis=1)
+        inercia_nuevas = distancias.min(axis=1).mean()
+        if inercia_nuevas > modelo["inercia_media"] * (1 + umbral_deriva):
+            return None
+
+        # Copia del modelo con las sesiones nuevas
+        n_previas = len(modelo["labels"])
+        n_nuevas = int(nuevas.sum())
+        modelo = dict(
+            modelo,
+            inercia_media=(modelo["inercia_media"] * n_previas + inercia_nuevas * n_nuevas) / (n_previas + n_nuevas),
+            labels={**modelo["labels"], **{a: int(l) for a, l in zip(archivos[nuevas], labels_nuevas)}},
+        )
+        labels[nuevas] = labels_nuevas
+
+    return labels, modelo
+
+# ==========================
+def guardar_modelo_clusters(modelo, ruta):
+    """Guarda el modelo de clusters en JSON para reutilizarlo entre ejecuciones."""
+    datos = {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in modelo.items()}
+    datos["nombres"] = {str(k): v for k, v in modelo.get("nombres", {}).items()}
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+# ==========================
+def cargar_modelo_clusters(ruta):
+    """Carga un modelo guardado con guardar_modelo_clusters (None si no existe)."""
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    for clave in ("media", "escala", "centroides"):
+        datos[clave] = np.asarray(datos[clave], dtype=float)
+    datos["nombres"] = {int(k): v for k, v in datos.get("nombres", {}).items()}
+    return datos
+
+# ==========================
+def tab_clustering(df_sesion, solo_objeto=False, usar_gap=False, umbral_gran_volumen=UMBRAL_SESIONES_GRAN_VOLUMEN,
+                   modelo=None, features=None, df_features=None, ruta_modelo=None, hilos_kmeans=None):
+    """
+    Agrupa las sesiones con KMeans, por defecto por distancia y ritmo.
+    Con usar_gap=True se usa el ritmo ajustado por pendiente (ritmo_gap).
+    features elige otras columnas de df_features, la tabla por sesión ya
+    calculada con metricas.calcular_features_sesion (aquí sólo se leen); los
+    huecos se rellenan con la mediana de cada feature.
+    Con más de umbral_gran_volumen sesiones se pasa al modo de gran volumen
+    (MiniBatchKMeans + silhouette muestreada). hilos_kmeans limita los
+    ajustes simultáneos del barrido de k (ver _ajustar_kmeans).
+    Si hay un modelo guardado (argumento modelo, archivo ruta_modelo o
+    st.session_state["modelo_clusters"]) las sesiones nuevas se asignan al
+    centroide más cercano y sólo se reajusta cuando hay deriva; así los tipos
+    de sesión no cambian entre cargas. En la app el modelo vive en la sesión
+    del navegador; con ruta_modelo (lote.py, un archivo por atleta) se carga
+    de disco y se vuelve a guardar, y se conserva entre ejecuciones.
+    """
     ICONO_SESION = (
         '<svg xmlns="http://www.w3.org/2000/svg" height="40px" viewBox="0 -960 960 960" '
         'width="40px" fill="#264653">'
@@ -619,55 +1019,71 @@ def tab_clustering(df_sesion, solo_objeto=False):
         '</svg>'
     )
 
-    if not {"distancia", "ritmo"}.issubset(df_sesion.columns):
-        st.warning("No se encontraron las columnas 'distancia' y 'ritmo'.")
+    col_ritmo = "ritmo_gap" if usar_gap and "ritmo_gap" in df_sesion.columns else "ritmo"
+
+    if not {"distancia", col_ritmo}.issubset(df_sesion.columns):
+        st.warning(f"No se encontraron las columnas 'distancia' y '{col_ritmo}'.")
         return None, None, None
 
-    X = df_sesion[["distancia", "ritmo"]].copy().dropna()
+    columnas_features = list(features) if features else ["distancia", col_ritmo]
+    if col_ritmo == "ritmo_gap":
+        columnas_features = ["ritmo_gap" if c == "ritmo" else c for c in columnas_features]
+    columnas_features = list(dict.fromkeys(columnas_features))
+
+    if df_features is not None:
+        tabla = df_features.set_index("archivo").reindex(df_sesion["archivo"].astype(str))
+        tabla.index = df_sesion.index
+    else:
+        tabla = df_sesion
+    faltan = [c for c in columnas_features if c not in tabla.columns]
+    if faltan:
+        st.warning(f"No se encontraron las features: {', '.join(faltan)}.")
+        return None, None, None
+
+    # Las sesiones sin distancia o ritmo no se agrupan; el resto de huecos se rellena con la mediana
+    validas = df_sesion[["distancia", col_ritmo]].notna().all(axis=1)
+    X = tabla.loc[validas, columnas_features].astype(float)
+    X = X.loc[:, X.notna().any()]
+    X = X.fillna(X.median())
     if len(X) < 3:
         st.info("Se necesitan al menos 3 sesiones para agrupar.")
         return None, None, None
 
-    # Escalamiento y clustering
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    archivos_X = df_sesion.loc[X.index, "archivo"].astype(str).to_numpy()
+    if modelo is None:
+        modelo = cargar_modelo_clusters(ruta_modelo) if ruta_modelo else st.session_state.get("modelo_clusters")
 
-    silhouette_scores = []
-    possible_k = range(2, min(8, len(X_scaled)))
-    for k in possible_k:
-        model = KMeans(n_clusters=k, random_state=42, n_init=10)
-        labels = model.fit_predict(X_scaled)
-        score = silhouette_score(X_scaled, labels)
-        silhouette_scores.append((k, score))
-    best_k = max(silhouette_scores, key=lambda x: x[1])[0]
-
-    model_final = KMeans(n_clusters=best_k, random_state=42, n_init=10)
-    df_sesion["cluster"] = model_final.fit_predict(X_scaled)
-
-    # Asignar nombres a clusters
-    cluster_stats = df_sesion.groupby("cluster").agg({"distancia":"mean","ritmo":"mean"}).reset_index()
-    def asignar_nombre_cluster(dist_media, ritmo_medio):
-        if dist_media < 3:
-            return "Sprint / Muy Corta"
-        elif dist_media < 6:
-            return "Corta / Rápida" if ritmo_medio < 5.0 else "Corta / Suave"
-        elif dist_media < 10:
-            return "Media / Rápida" if ritmo_medio < 5.5 else "Media / Moderada"
-        elif dist_media < 15:
-            return "10K / Tempo" if ritmo_medio < 5.5 else "10K / Base"
-        elif dist_media < 25:
-            return "Media Maratón / Tempo" if ritmo_medio < 6.0 else "Larga / Constante"
-        else:
-            return "Maratón / Competencia" if ritmo_medio < 6.0 else "Muy Larga / Recuperación"
-
-    nombre_clusters = {row["cluster"]: asignar_nombre_cluster(row["distancia"], row["ritmo"]) 
+    # Asignación incremental con el modelo guardado (None si no hay modelo o hay deriva)
+    labels = None
+    if modelo is not None and modelo["columnas"] == list(X.columns):
+        asignacion = asignar_clusters_incremental(modelo, X.to_numpy(), archivos_X)
+        if asignacion is not None:
+            labels, modelo = asignacion
+
+    if labels is None:
+        # Escalamiento (memorizado) y clustering completo
+        scaler, X_scaled = _escalar_features(X.to_numpy())
+
+        best_k, model_final, labels, score = _ajustar_kmeans(X_scaled, umbral_gran_volumen, hilos_kmeans)
+        modelo = crear_modelo_clusters(X.columns, scaler, model_final, labels, archivos_X, score)
+
+    df_sesion["cluster"] = pd.Series(labels, index=X.index)
+
+    # Asignar nombres a clusters (se conservan los del modelo para clusters ya nombrados)
+    cluster_stats = df_sesion.groupby("cluster").agg({"distancia":"mean", col_ritmo:"mean"}).reset_index()
+    nombre_clusters = {row["cluster"]: modelo["nombres"].get(int(row["cluster"])) or
+                       asignar_nombre_cluster(row["distancia"], row[col_ritmo])
                        for _, row in cluster_stats.iterrows()}
+    modelo = dict(modelo, nombres={**modelo["nombres"], **{int(c): n for c, n in nombre_clusters.items()}})
+    st.session_state["modelo_clusters"] = modelo
+    if ruta_modelo:
+        guardar_modelo_clusters(modelo, ruta_modelo)
     df_sesion["tipo_sesion"] = df_sesion["cluster"].map(nombre_clusters)
 
     # Resumen y paleta
     resumen = df_sesion.groupby("tipo_sesion").agg(
         distancia_media=("distancia", "mean"),
-        ritmo_medio=("ritmo", "mean"),
+        ritmo_medio=(col_ritmo, "mean"),
         cantidad_sesiones=("archivo", "count"),
         cluster_id=("cluster", "first")
     ).reset_index()
@@ -681,17 +1097,23 @@ def tab_clustering(df_sesion, solo_objeto=False):
 
     # Límites del gráfico
     x_min, x_max = 0, df_sesion["distancia"].max() + 1
-    ritmo_min = df_sesion["ritmo"].min()
-    ritmo_max = df_sesion["ritmo"].max()
+    ritmo_min = df_sesion[col_ritmo].min()
+    ritmo_max = df_sesion[col_ritmo].max()
     y_min = max(0, ritmo_min - 0.5)
     y_max = ritmo_max + 0.5
 
+    # Con muchas sesiones los puntos se aclaran (metricas.submuestrear) y se dibujan con WebGL;
+    # las elipses se calculan siempre con todas las sesiones
+    muchas_sesiones = len(df_sesion) > MAX_PUNTOS_DISPERSION
+
     p = figure(
         height=PLOT_HEIGHT,
-        x_axis_label="Distancia (km)", y_axis_label="Ritmo (min/km)",
+        x_axis_label="Distancia (km)",
+        y_axis_label="Ritmo GAP (min/km)" if col_ritmo == "ritmo_gap" else "Ritmo (min/km)",
         toolbar_location=None,
         x_range=(x_min, x_max), y_range=(y_min, y_max),
-        sizing_mode="stretch_width"
+        sizing_mode="stretch_width",
+        output_backend="webgl" if muchas_sesiones else "canvas"
     )
     p.yaxis.formatter = minseg_formatter()
 
@@ -701,7 +1123,7 @@ def tab_clustering(df_sesion, solo_objeto=False):
     for tipo, cluster_data in df_sesion.groupby("tipo_sesion"):
         color = color_map[tipo]
         x = cluster_data["distancia"].values
-        y = cluster_data["ritmo"].values
+        y = cluster_data[col_ritmo].values
 
         if len(x) >= 3:
             cov = np.cov(x, y)
@@ -733,8 +1155,13 @@ def tab_clustering(df_sesion, solo_objeto=False):
     # Dibujar puntos encima
     for tipo, cluster_data in df_sesion.groupby("tipo_sesion"):
         color = color_map[tipo]
+        if muchas_sesiones:
+            presupuesto = max(1, round(MAX_PUNTOS_DISPERSION * len(cluster_data) / len(df_sesion)))
+            cluster_data = cluster_data.iloc[
+                submuestrear(cluster_data["distancia"], cluster_data[col_ritmo], presupuesto, dispersion=True)
+            ]
         source = ColumnDataSource(cluster_data)
-        p.circle(x="distancia", y="ritmo", size=9, color=color, alpha=0.8,
+        p.circle(x="distancia", y=col_ritmo, size=9, color=color, alpha=0.8,
                  legend_label=tipo, source=source)
 
     p.legend.title = "Tipos de sesión"
@@ -786,3 +1213,258 @@ def tab_clustering(df_sesion, solo_objeto=False):
     st.session_state["resumen_clusters"] = resumen
 
     return p, resumen, color_map
+
+# ==========================
+def _etiqueta_sesion(archivo):
+    fecha = extraer_fecha_desde_archivo(str(archivo))
+    return fecha.strftime("%d/%m/%y %H:%M") if pd.notna(fecha) else str(archivo)
+
+# ==========================
+def tab_splits(archivos, matriz_ritmo, solo_objeto=False):
+    """
+    Vista de la matriz de splits sesión × km (metricas.matriz_splits):
+    mapa de calor, bandas de percentiles por km y comparación de dos sesiones.
+    Todo se calcula sobre la matriz, sin reagrupar DataFrames.
+    """
+    if matriz_ritmo is None or matriz_ritmo.size == 0 or not np.isfinite(matriz_ritmo).any():
+        if not solo_objeto:
+            st.info("No hay kilómetros completos suficientes para construir la matriz de splits.")
+        return None, None
+
+    archivos = np.asarray(archivos)
+    etiquetas = np.array([_etiqueta_sesion(a) for a in archivos])
+    n_sesiones, n_km = matriz_ritmo.shape
+
+    # --- Mapa de calor sesión × km ---
+    filas, cols = np.nonzero(np.isfinite(matriz_ritmo))
+    valores = matriz_ritmo[filas, cols]
+    source = ColumnDataSource({
+        "km": cols + 1,
+        "sesion": filas,
+        "ritmo": valores,
+        "fecha": etiquetas[filas],
+    })
+    low, high = np.percentile(valores, [5, 95])
+    mapper = LinearColorMapper(palette=Turbo256, low=low, high=high if high > low else low + 0.1)
+
+    p_calor = figure(
+        height=max(PLOT_HEIGHT, min(900, 14 * n_sesiones)),
+        x_axis_label="Kilómetro", y_axis_label="Sesión",
+        x_range=(0.5, n_km + 0.5), y_range=(n_sesiones - 0.5, -0.5),
+        toolbar_location=None,
+        sizing_mode="stretch_width"
+    )
+    p_calor.rect(x="km", y="sesion", width=1, height=1, source=source,
+                 fill_color={"field": "ritmo", "transform": mapper}, line_color=None)
+    color_bar = ColorBar(color_mapper=mapper, formatter=minseg_formatter(), title="min/km")
+    p_calor.add_layout(color_bar, "right")
+    p_calor.yaxis.visible = False
+    p_calor.xgrid.grid_line_color = None
+    p_calor.ygrid.grid_line_color = None
+    p_calor.add_tools(HoverTool(tooltips=[("Sesión", "@fecha"), ("Km", "@km"), ("Ritmo", "@ritmo{0.00} min/km")]))
+
+    # --- Bandas de percentiles por km ---
+    bandas = bandas_percentiles_splits(matriz_ritmo)
+    bandas = bandas[bandas["n_sesiones"] > 0]
+    p_bandas = figure(
+        height=PLOT_HEIGHT - 50,
+        x_axis_label="Kilómetro", y_axis_label="Ritmo (min/km)",
+        toolbar_location=None,
+        sizing_mode="stretch_width"
+    )
+    p_bandas.varea(x=bandas["km"], y1=bandas["p10"], y2=bandas["p90"], color="#2A9D8F", fill_alpha=0.25,
+                   legend_label="P10-P90")
+    p_bandas.varea(x=bandas["km"], y1=bandas["p25"], y2=bandas["p75"], color="#2A9D8F", fill_alpha=0.5,
+                   legend_label="P25-P75")
+    p_bandas.line(bandas["km"], bandas["p50"], line_width=2, color="#264653", legend_label="Mediana")
+    p_bandas.yaxis.formatter = minseg_formatter()
+    p_bandas.legend.location = "top_left"
+    p_bandas.legend.background_fill_alpha = 0.8
+
+    if solo_objeto:
+        return p_calor, p_bandas
+
+    st.bokeh_chart(p_calor, use_container_width=True)
+    st.markdown("**Ritmo por kilómetro (percentiles entre sesiones)**")
+    st.bokeh_chart(p_bandas, use_container_width=True)
+
+    # --- Comparar dos sesiones ---
+    st.markdown("**Comparar dos sesiones**")
+    # Etiquetas únicas (dos sesiones pueden empezar en el mismo minuto)
+    vistas = {}
+    opciones = []
+    for e in etiquetas:
+        vistas[e] = vistas.get(e, 0) + 1
+        opciones.append(e if vistas[e] == 1 else f"{e} ({vistas[e]})")
+    col_a, col_b = st.columns(2)
+    with col_a:
+        opcion_a = st.selectbox("Sesión A", opciones, index=n_sesiones - 1, key="splits_sesion_a")
+    with col_b:
+        opcion_b = st.selectbox("Sesión B", opciones, index=max(0, n_sesiones - 2), key="splits_sesion_b")
+    idx_a, idx_b = opciones.index(opcion_a), opciones.index(opcion_b)
+
+    comparacion = comparar_sesiones(archivos, matriz_ritmo, archivos[idx_a], archivos[idx_b])
+    if comparacion.empty:
+        st.info("Las sesiones seleccionadas no tienen kilómetros completos en común.")
+        return p_calor, p_bandas
+
+    p_comp = figure(
+        height=PLOT_HEIGHT - 100,
+        x_axis_label="Kilómetro", y_axis_label="Ritmo (min/km)",
+        toolbar_location=None,
+        sizing_mode="stretch_width"
+    )
+    p_comp.line(comparacion["km"], comparacion["ritmo_a"], line_width=2, color="#E76F51", legend_label="Sesión A")
+    p_comp.line(comparacion["km"], comparacion["ritmo_b"], line_width=2, color="#264653", legend_label="Sesión B")
+    p_comp.yaxis.formatter = minseg_formatter()
+    p_comp.legend.location = "top_left"
+    st.bokeh_chart(p_comp, use_container_width=True)
+
+    diferencia_media = comparacion["diferencia"].mean()
+    if pd.notna(diferencia_media):
+        segundos = abs(diferencia_media) * 60
+        sentido = "más lenta" if diferencia_media > 0 else "más rápida"
+        st.markdown(f"En los kilómetros comunes, la sesión B fue en promedio **{segundos:.0f} s/km {sentido}** que la sesión A.")
+
+    return p_calor, p_bandas
+
+# ==========================
+def tab_detalle_sesion(df_granular, df_sesion, solo_objeto=False, archivo=None):
+    """
+    Detalle de una sesión: ritmo, altitud y distancia frente al tiempo, con los
+    ejes x enlazados. Cada serie se reduce en el servidor a MAX_PUNTOS_SERIE
+    puntos con LTTB (metricas.submuestrear) y se dibuja con WebGL, así que una
+    maratón a 1 Hz no envía decenas de miles de puntos al navegador.
+    Si no se indica archivo se elige con un selector (la más reciente primero).
+    """
+    if df_sesion is None or df_sesion.empty:
+        if not solo_objeto:
+            st.info("No hay sesiones para mostrar.")
+        return None
+
+    sesiones = df_sesion.sort_values("fecha", ascending=False)
+    if archivo is None:
+        # Etiquetas únicas (dos sesiones pueden empezar en el mismo minuto)
+        opciones = {}
+        for a, d in zip(sesiones["archivo"], sesiones["distancia"]):
+            etiqueta = f"{_etiqueta_sesion(a)} · {d:.1f} km"
+            while etiqueta in opciones:
+                etiqueta += " "
+            opciones[etiqueta] = a
+        archivo = opciones[st.selectbox("Sesión", list(opciones), key="detalle_sesion")]
+
+    serie = serie_sesion(df_granular, archivo)
+    if serie.empty:
+        if not solo_objeto:
+            st.info("La sesión no tiene puntos GPS.")
+        return None
+
+    paneles = [
+        ("ritmo", "Ritmo (min/km)", "#E76F51"),
+        ("altitud", "Altitud (m)", "#6A994E"),
+        ("distancia", "Distancia (km)", "#264653"),
+    ]
+    figuras = []
+    for columna, etiqueta, color in paneles:
+        indices = submuestrear(serie["tiempo"], serie[columna], MAX_PUNTOS_SERIE)
+        source = ColumnDataSource(serie.iloc[indices][["tiempo", columna]])
+        p = figure(
+            height=PLOT_HEIGHT // 2 + 40,
+            x_axis_label="Tiempo (min)" if columna == paneles[-1][0] else None,
+            y_axis_label=etiqueta,
+            x_range=figuras[0].x_range if figuras else None,
+            tools="xpan,xwheel_zoom,reset",
+            toolbar_location="right" if not figuras else None,
+            output_backend="webgl",
+            sizing_mode="stretch_width"
+        )
+        p.line(x="tiempo", y=columna, source=source, line_width=1.5, color=color)
+        if columna == "ritmo":
+            p.yaxis.formatter = minseg_formatter()
+            # Eje invertido (más rápido arriba) y limitado a percentiles: en las paradas el ritmo se dispara
+            validos = serie["ritmo"].dropna()
+            if not validos.empty:
+                bajo, alto = np.percentile(validos, [1, 99])
+                p.y_range = Range1d(alto + 0.5, max(0, bajo - 0.5))
+        p.add_tools(HoverTool(
+            tooltips=[("Tiempo", "@tiempo{0.0} min"), (etiqueta, f"@{columna}{{0.00}}")],
+            mode="vline"
+        ))
+        figuras.append(p)
+
+    layout = column(*figuras, sizing_mode="stretch_width")
+    if not solo_objeto:
+        st.bokeh_chart(layout, use_container_width=True)
+        st.caption(
+            f"{len(serie)} puntos GPS; cada gráfico muestra como mucho {MAX_PUNTOS_SERIE} "
+            "(submuestreo que conserva picos y valles)."
+        )
+    return layout
+
+# ==========================
+def tab_zonas_ritmo(archivos, nombres_zonas, matriz_segundos, df_sesion, solo_objeto=False):
+    """
+    Tiempo pasado en cada zona de ritmo (metricas.tiempo_en_zonas): barras
+    apiladas por mes y tabla por sesión.
+    Guarda el resumen en st.session_state["resumen_zonas"] para el contexto IA.
+    """
+    if matriz_segundos is None or len(archivos) == 0 or matriz_segundos.sum() <= 0:
+        st.session_state["resumen_zonas"] = "Zonas de ritmo: no hay datos suficientes."
+        if not solo_objeto:
+            st.info("No hay datos suficientes para calcular el tiempo por zonas de ritmo.")
+        return None
+
+    nombres_zonas = list(nombres_zonas)
+    fechas = df_sesion.set_index("archivo")["fecha"] if df_sesion is not None and not df_sesion.empty else pd.Series(dtype="datetime64[ns]")
+    por_mes = tiempo_en_zonas_por_mes(archivos, nombres_zonas, matriz_segundos, fechas)
+
+    # --- Resumen textual ---
+    total_zona = matriz_segundos.sum(axis=0) / 60
+    pct_zona = total_zona / total_zona.sum() * 100
+    lineas = ["Tiempo por zonas de ritmo (min/km) en todas las sesiones:"]
+    lineas += [f"- {nombre}: {pct:.0f}% ({minutos:.0f} min)"
+               for nombre, pct, minutos in zip(nombres_zonas, pct_zona, total_zona)]
+    if not por_mes.empty:
+        ultimo = por_mes.iloc[-1]
+        total_ultimo = ultimo[nombres_zonas].sum()
+        if total_ultimo > 0:
+            reparto = ", ".join(f"{n}: {ultimo[n] / total_ultimo * 100:.0f}%" for n in nombres_zonas)
+            lineas.append(f"Último mes con datos ({ultimo['mes']}): {reparto}.")
+    st.session_state["resumen_zonas"] = "\n".join(lineas)
+
+    # --- Barras apiladas por mes ---
+    paleta = list(RdYlBu[len(nombres_zonas)]) if len(nombres_zonas) in RdYlBu else get_palette(len(nombres_zonas))
+    source = ColumnDataSource(por_mes)
+    p = figure(
+        x_range=por_mes["mes"].tolist(),
+        height=PLOT_HEIGHT,
+        x_axis_label="Año-Mes", y_axis_label="Minutos",
+        toolbar_location=None,
+        tools="",
+        sizing_mode="stretch_width"
+    )
+    p.vbar_stack(nombres_zonas, x="mes", width=0.8, color=paleta, source=source,
+                 legend_label=nombres_zonas, alpha=0.9)
+    p.xaxis.major_label_orientation = 0.8
+    p.xgrid.grid_line_color = None
+    p.legend.title = "Zona (min/km)"
+    p.legend.location = "top_left"
+    p.legend.background_fill_alpha = 0.8
+    p.add_tools(HoverTool(tooltips=[("Año-Mes", "@mes"), ("Zona", "$name"), ("Minutos", "@$name{0,0}")]))
+
+    if solo_objeto:
+        return p
+
+    st.bokeh_chart(p, use_container_width=True)
+
+    # --- Tabla por sesión (porcentaje de tiempo en cada zona) ---
+    totales = matriz_segundos.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        porcentajes = np.where(totales > 0, matriz_segundos / totales * 100, 0.0)
+    tabla = pd.DataFrame(porcentajes.round(0), columns=[f"% {n}" for n in nombres_zonas])
+    tabla.insert(0, "Sesión", [_etiqueta_sesion(a) for a in archivos])
+    tabla.insert(1, "Minutos", (totales[:, 0] / 60).round(1))
+    with st.expander("Tiempo en zonas por sesión"):
+        st.dataframe(tabla.iloc[::-1], hide_index=True, use_container_width=True)
+
+    return p